@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Compare the peak memory used to summarise the output of chronyc clients on a
+busy server when it is read as a whole (as process.execute() does) and when it
+is streamed one line at a time into ClientStats.
+"""
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+from unittest import mock
+
+import process
+
+from clients import ClientStats
+
+
+def main() -> None:
+    count = 200000
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as f:
+        for i in range(count):
+            f.write(f"10.{i // 65536}.{i // 256 % 256}.{i % 256},{(i * 7919) % 10007 + 1},{i % 7},6,-,{i % 900},0,0,-,-\n")
+    try:
+        with mock.patch("process.get_progs", return_value={"clients": f"cat {f.name}"}):
+            tracemalloc.start()
+            start = time.time()
+            output, elapsed = process.execute("clients")
+            clients = ClientStats()
+            for line in output:
+                clients.add(line)
+            buffered = time.time() - start
+            del output
+            _, buffered_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            tracemalloc.start()
+            start = time.time()
+            clients = ClientStats()
+            process.execute_stream("clients", clients.add)
+            streamed = time.time() - start
+            _, streamed_peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        os.unlink(f.name)
+
+    assert clients.clients == count
+    print(f"buffered: {buffered_peak / 1e6:6.1f} MB peak, {buffered / count * 1e6:.2f} us/line")
+    print(f"streamed: {streamed_peak / 1e6:6.1f} MB peak, {streamed / count * 1e6:.2f} us/line")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Compare the speed of line_protocol.to_line_protocol() and line_protocol.Encoder
+on a stream of chrony measurements.
+"""
+
+import timeit
+
+import line_protocol
+import peer_stats
+
+sample_measurements = """
+2021-12-30 11:28:49 17.253.66.253   N  1 111 111 1111   6  6 0.00 -3.420e-04  1.302e-03  4.121e-06  0.000e+00  1.984e-04 47505373 4B K K
+2021-12-30 11:28:49 17.253.66.125   N  1 111 111 1111   6  6 0.00 -2.447e-04  1.109e-03  3.707e-06  0.000e+00  1.373e-04 47505373 4B K K
+2021-12-30 11:28:49 150.101.186.50  N  2 111 111 1111   6  6 0.00 -1.287e-04  1.978e-02  4.450e-05  6.714e-04  1.282e-03 AC16FE35 4B K K
+2021-12-30 11:28:49 169.254.169.123 N  3 111 111 1111   6  6 0.00 -2.082e-04  2.231e-04  1.276e-06  2.136e-04  2.747e-04 0A2C4A4E 4B K K
+2021-12-30 11:28:49 150.101.186.48  N  2 111 111 1111   6  6 0.00 -4.276e-04  1.970e-02  4.405e-05  9.003e-04  6.546e-03 AC16FE35 4B K K
+"""
+
+
+def main() -> None:
+    measurements = [peer_stats.parse_measurement(l) for l in sample_measurements.strip().split("\n")]
+    for m in measurements:
+        m["peertype"] = "survivor"
+    encoder = line_protocol.Encoder()
+
+    for m in measurements:
+        assert encoder.encode(m, "ntpmon_peer") == line_protocol.to_line_protocol(m, "ntpmon_peer").encode()
+
+    def original() -> None:
+        for m in measurements:
+            line_protocol.to_line_protocol(m, "ntpmon_peer").encode()
+
+    def compiled() -> None:
+        for m in measurements:
+            encoder.encode(m, "ntpmon_peer")
+
+    number = 2000
+    lines = number * len(measurements)
+    # alternate between the two so that other load on the machine affects both equally
+    t_original = t_compiled = float("inf")
+    for i in range(7):
+        t_original = min(t_original, timeit.timeit(original, number=number))
+        t_compiled = min(t_compiled, timeit.timeit(compiled, number=number))
+    print(f"to_line_protocol: {t_original / lines * 1e6:.2f} us/line")
+    print(f"Encoder.encode:   {t_compiled / lines * 1e6:.2f} us/line")
+    print(f"speedup:          {t_original / t_compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
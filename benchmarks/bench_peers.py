@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Compare the speed of NTPPeers.parse() and NTPPeers.parsetable(), and of
+calculating peer metrics from lists and from a PeerTable, on the output of ntpq
+with a large number of associations.
+"""
+
+import timeit
+
+from peers import NTPPeers
+
+header = """
+     remote           refid      st t when poll reach   delay   offset  jitter
+==============================================================================
+ 0.ubuntu.pool.n .POOL.          16 p    -   64    0    0.000    0.000   0.000
+"""
+
+tallies = "*+#-x. o"
+
+
+def list_metrics(peers: dict) -> dict:
+    """Calculate peer metrics from the lists of peer values, as NTPPeers.getmetrics() used to."""
+    metrics = {}
+    for t in NTPPeers.peertypes:
+        metrics[t] = len(peers[t]["address"])
+        for field in ("offset", "reach"):
+            mean = NTPPeers.getmean(peers[t][field])
+            metrics[f"{t}-{field}-mean"] = mean
+            metrics[f"{t}-{field}-stdev"] = NTPPeers.getstdev(peers[t][field], mean)
+            metrics[f"{t}-{field}-rms"] = NTPPeers.rms(peers[t][field])
+    return metrics
+
+
+def main() -> None:
+    lines = header.strip().split("\n")
+    for i in range(500):
+        lines.append(
+            f"{tallies[i % len(tallies)]}192.0.2.{i % 250:<3}     172.17.237.14    2 u  {i % 1000:>3} 1024  377"
+            f"    1.{i:03}    {(i - 250) / 100:.3f}   0.098"
+        )
+    assert repr(NTPPeers.parse(lines)) == repr(NTPPeers.parsefast(lines))
+
+    number = 200
+    count = number * len(lines)
+    # alternate between the two so that other load on the machine affects both equally
+    t_original = t_fast = float("inf")
+    for i in range(7):
+        t_original = min(t_original, timeit.timeit(lambda: NTPPeers.parse(lines), number=number))
+        t_fast = min(t_fast, timeit.timeit(lambda: NTPPeers.parsetable(lines), number=number))
+    print(f"NTPPeers.parse:      {t_original / count * 1e6:.2f} us/line")
+    print(f"NTPPeers.parsetable: {t_fast / count * 1e6:.2f} us/line")
+    print(f"speedup:             {t_original / t_fast:.1f}x")
+
+    p = NTPPeers(lines)
+    peers = NTPPeers.parse(lines)
+    number = 20
+    t_lists = t_table = float("inf")
+    for i in range(7):
+        t_lists = min(t_lists, timeit.timeit(lambda: list_metrics(peers), number=number))
+        t_table = min(t_table, timeit.timeit(lambda: p.getmetrics(), number=number))
+    print(f"metrics from lists:  {t_lists / number * 1e3:.2f} ms/poll")
+    print(f"metrics from table:  {t_table / number * 1e3:.2f} ms/poll")
+    print(f"speedup:             {t_lists / t_table:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Downsample peer measurements into per-source summaries over fixed time windows.
+"""
+
+import math
+
+from typing import Dict, List
+
+
+class Accumulator:
+    """Running count, minimum, maximum, mean, variance, and mean square of a
+    series of values, using Welford's algorithm."""
+
+    __slots__ = ("count", "last", "m2", "max", "mean", "min", "squares")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.last = None
+        self.m2 = 0.0
+        self.max = None
+        self.mean = 0.0
+        self.min = None
+        self.squares = 0.0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.last = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def stddev(self) -> float:
+        """Return the population standard deviation of the values."""
+        return math.sqrt(self.m2 / self.count) if self.count > 0 else 0.0
+
+    def rms(self) -> float:
+        """Return the root mean square of the values."""
+        return math.sqrt(self.squares / self.count) if self.count > 0 else 0.0
+
+
+class Window:
+    """Accumulated measurements from one source in one time window."""
+
+    __slots__ = ("accumulators", "flags", "last", "samples", "start")
+
+    def __init__(self, start: int, fields: List[str], flags: List[str]) -> None:
+        self.accumulators = {f: Accumulator() for f in fields}
+        self.flags = {f: 0 for f in flags}
+        self.last = None
+        self.samples = 0
+        self.start = start
+
+    def add(self, stats: dict) -> None:
+        self.samples += 1
+        self.last = stats
+        for field, acc in self.accumulators.items():
+            if field in stats:
+                acc.add(stats[field])
+        for flag in self.flags:
+            if stats.get(flag):
+                self.flags[flag] += 1
+
+    def summary(self) -> dict:
+        """Return the last measurement in the window, with the statistics of the
+        accumulated fields and the number of times each flag was set added.  Each
+        flag is reported as set if it was set in any measurement in the window."""
+        result = dict(self.last)
+        result["samples"] = self.samples
+        for field, acc in self.accumulators.items():
+            if acc.count > 0:
+                result[field + "_max"] = acc.max
+                result[field + "_mean"] = acc.mean
+                result[field + "_min"] = acc.min
+                result[field + "_stddev"] = acc.stddev()
+        for flag, count in self.flags.items():
+            if flag in result:
+                result[flag] = 1 if count > 0 else 0
+                result[flag + "_count"] = count
+        return result
+
+
+class PeerAggregator:
+    """Summarise the measurements from each source over windows of the given
+    length (aligned to multiples of the window length since the epoch).  Only
+    one window per source is held at a time."""
+
+    fields: List[str] = ["delay", "dispersion", "offset"]
+
+    # the statistics reported for each field, as <field>_<statistic>
+    statistics: List[str] = ["max", "mean", "min", "stddev"]
+
+    # the test flags reported by chrony, which are 1 when the test failed
+    flags: List[str] = [
+        "authentication_fail",
+        "bad_header",
+        "bogus",
+        "duplicate",
+        "exceeded_max_delay",
+        "exceeded_max_delay_dev_ratio",
+        "exceeded_max_delay_ratio",
+        "invalid",
+        "sync_loop",
+    ]
+
+    def __init__(self, window: float) -> None:
+        self.window_ns = int(window * 1_000_000_000)
+        self.windows: Dict[str, Window] = {}
+
+    def add(self, stats: dict) -> List[dict]:
+        """Add a measurement, returning the summaries of any windows which it completes."""
+        source = stats["source"]
+        start = stats["timestamp_ns"] - stats["timestamp_ns"] % self.window_ns
+        result = []
+        window = self.windows.get(source)
+        if window is not None and window.start != start:
+            result.append(window.summary())
+            window = None
+        if window is None:
+            window = self.windows[source] = Window(start, self.fields, self.flags)
+        window.add(stats)
+        return result
+
+    def expire(self, now_ns: int) -> List[dict]:
+        """Return the summaries of all windows which ended before now_ns."""
+        expired = [source for (source, window) in self.windows.items() if window.start + self.window_ns <= now_ns]
+        return [self.windows.pop(source).summary() for source in expired]
@@ -0,0 +1,87 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Accumulate encoded lines and deliver them to a sink in batches.
+"""
+
+import time
+
+from typing import Callable, Dict
+
+
+class BatchWriter:
+    """Collect lines in a buffer and hand them to the sink in a single call
+    when the line or byte threshold is reached, or when flush() is called.
+    Callers are expected to call flush() at the end of each unit of work (e.g.
+    a tail tick), and periodically via a timer so that lines are never held
+    for too long."""
+
+    def __init__(
+        self,
+        sink: Callable[[bytes], None],
+        max_lines: int = 1000,
+        max_bytes: int = 65536,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.sink = sink
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.buffer = bytearray()
+        self.lines = 0
+        # when the oldest line in the buffer was written
+        self.oldest = None
+
+        # statistics about completed flushes; flush_seconds is the time for which
+        # the oldest line in each batch waited in the buffer
+        self.flushes = 0
+        self.flushed_lines = 0
+        self.flushed_bytes = 0
+        self.flush_seconds = 0.0
+        self.flush_seconds_max = 0.0
+
+    def write(self, line: bytes) -> None:
+        """Add a single line (without its trailing newline) to the buffer,
+        flushing if either threshold has been reached."""
+        if self.lines == 0:
+            self.oldest = self.clock()
+        self.buffer += line
+        self.buffer += b"\n"
+        self.lines += 1
+        if self.lines >= self.max_lines or len(self.buffer) >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """Send all buffered lines to the sink in one call."""
+        if self.lines == 0:
+            return
+        data = bytes(self.buffer)
+        lines = self.lines
+        self.buffer.clear()
+        self.lines = 0
+
+        elapsed = self.clock() - self.oldest
+        self.sink(data)
+
+        self.flushes += 1
+        self.flushed_lines += lines
+        self.flushed_bytes += len(data)
+        self.flush_seconds += elapsed
+        if elapsed > self.flush_seconds_max:
+            self.flush_seconds_max = elapsed
+
+    def getmetrics(self) -> Dict[str, float]:
+        """Return batch size statistics, and how long lines waited in the buffer before being flushed."""
+        metrics = {
+            "batch_flushes": self.flushes,
+            "batch_lines_total": self.flushed_lines,
+            "batch_bytes_total": self.flushed_bytes,
+            "batch_flush_seconds_max": self.flush_seconds_max,
+        }
+        if self.flushes > 0:
+            metrics["batch_lines_mean"] = self.flushed_lines / self.flushes
+            metrics["batch_bytes_mean"] = self.flushed_bytes / self.flushes
+            metrics["batch_flush_seconds_mean"] = self.flush_seconds / self.flushes
+        return metrics
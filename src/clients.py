@@ -0,0 +1,210 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Summarise 'chronyc -c clients' or 'ntpq -n -c mrulist' output one line at a
+time, in memory which does not grow with the number of clients.
+"""
+
+import bisect
+import heapq
+import math
+
+from typing import Dict, List, Tuple
+
+# chronyc -c clients fields:
+# 1. The hostname or IP address of the client. [192.0.2.1]
+# 2. NTP: the number of NTP packets received from the client. [34]
+# 3. Drop: the number of NTP packets dropped by rate limiting. [0]
+# 4. Int: the average interval between NTP packets, as a power of 2 in seconds. [6]
+# 5. IntL: the average interval between NTP packets which were not dropped, as a power of 2 in seconds. [-]
+# 6. Last: the time since the last NTP packet, in seconds. [23]
+# 7-10. The same statistics for command packets.
+# Older versions of chrony do not report IntL.
+
+# ntpq -n -c mrulist fields:
+# lstint avgint rstr r m v  count rport remote address
+# The r field is L or K when responses to the client are rate limited.
+
+# Upper bounds of the histogram buckets for the average interval between a client's
+# packets, and the number of its packets dropped.
+interval_bounds = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+dropped_bounds = [0, 1, 10, 100, 1000, 10000]
+
+histograms = {
+    "interval": interval_bounds,
+    "dropped": dropped_bounds,
+}
+
+
+def bucketname(histogram: str, bound: int) -> str:
+    return f"{histogram}_le_{bound}"
+
+
+def parse_chrony_client(line: str) -> Tuple[str, int, int, float, int]:
+    """Return the address, NTP packets, dropped packets, average interval, and time
+    since the last packet of one client, or None if the line is not a client with
+    NTP packets."""
+    f = line.strip().split(",")
+    if len(f) < 9:
+        return None
+    try:
+        packets = int(f[1])
+        if packets == 0:
+            # command clients, such as chronyc itself
+            return None
+        interval = 2.0 ** int(f[3]) if f[3] != "-" else None
+        last = f[5] if len(f) >= 10 else f[4]
+        return (f[0], packets, int(f[2]), interval, int(last) if last != "-" else None)
+    except (OverflowError, ValueError):
+        return None
+
+
+def parse_ntpd_client(line: str) -> Tuple[str, int, int, float, int, bool]:
+    """Return the same as parse_chrony_client() for one line of ntpq mrulist, and
+    whether the client is rate limited.  Dropped packets are not reported by
+    ntpd, so their count is None."""
+    f = line.split()
+    if len(f) != 9:
+        return None
+    try:
+        last = int(f[0])
+        interval = float(f[1])
+        packets = int(f[6])
+    except ValueError:
+        return None
+    return (f[8], packets, None, interval, last, f[3] in ("K", "L"))
+
+
+class HyperLogLog:
+    """Estimate the number of distinct values added, using 2 ** precision bytes."""
+
+    def __init__(self, precision: int = 12) -> None:
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: str) -> None:
+        # str hashes are randomised per process, so only merge HyperLogLogs from the same process
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        index = h & (len(self.registers) - 1)
+        rank = 64 - self.precision - (h >> self.precision).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> float:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # small range correction (linear counting)
+            return m * math.log(m / zeros)
+        return estimate
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Add the values counted by another HyperLogLog of the same precision."""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+
+class TopClients:
+    """Keep the limit clients with the most packets in a min-heap.  Each line of
+    the clients output already carries a client's totals, so this is exact for
+    chronyd; ntpd lists each port separately, and the packets of a client are
+    summed while it remains in the heap."""
+
+    def __init__(self, limit: int) -> None:
+        self.limit = limit
+        self.heap: List[list] = []
+        self.entries: Dict[str, list] = {}
+
+    def add(self, address: str, packets: int, client: dict) -> None:
+        entry = self.entries.get(address)
+        if entry is not None:
+            entry[0] += packets
+            entry[2]["packets"] += packets
+            heapq.heapify(self.heap)
+        elif len(self.heap) < self.limit:
+            entry = [packets, address, client]
+            self.entries[address] = entry
+            heapq.heappush(self.heap, entry)
+        elif self.limit and packets > self.heap[0][0]:
+            entry = [packets, address, client]
+            self.entries[address] = entry
+            del self.entries[heapq.heapreplace(self.heap, entry)[1]]
+
+    def clients(self) -> List[dict]:
+        """Return the top clients, busiest first, with their rank."""
+        top = sorted(self.heap, key=lambda e: (-e[0], e[1]))
+        return [dict(e[2], rank=rank) for (rank, e) in enumerate(top, start=1)]
+
+
+class ClientStats:
+    """Summary statistics of the clients of the NTP server, built by calling
+    add() with each line of output."""
+
+    def __init__(self, limit: int = 10, elapsed: float = 0) -> None:
+        self.clients = 0
+        self.limited = 0
+        self.packets = 0
+        self.dropped = None
+        self.counts = {h: [0] * (len(bounds) + 1) for (h, bounds) in histograms.items()}
+        self.distinct = HyperLogLog()
+        self.top = TopClients(limit)
+        self.elapsed = elapsed
+
+    def add(self, line: str) -> None:
+        if "," in line:
+            client = parse_chrony_client(line)
+            if client is None:
+                return
+            address, packets, dropped, interval, last = client
+            limited = dropped > 0
+        else:
+            client = parse_ntpd_client(line)
+            if client is None:
+                return
+            address, packets, dropped, interval, last, limited = client
+
+        self.clients += 1
+        self.packets += packets
+        if limited:
+            self.limited += 1
+        if dropped is not None:
+            self.dropped = (self.dropped or 0) + dropped
+            self.counts["dropped"][bisect.bisect_left(dropped_bounds, dropped)] += 1
+        if interval is not None:
+            self.counts["interval"][bisect.bisect_left(interval_bounds, interval)] += 1
+        self.distinct.add(address)
+
+        metrics = {"client": address, "packets": packets}
+        if dropped is not None:
+            metrics["dropped"] = dropped
+        if interval is not None:
+            metrics["interval"] = interval
+        if last is not None:
+            metrics["last"] = last
+        self.top.add(address, packets, metrics)
+
+    def getmetrics(self):
+        """Client statistics are reported by ntpmon rather than as summary metrics."""
+        return {}
+
+    def summary(self) -> dict:
+        """Return the totals and the cumulative histogram buckets of this snapshot."""
+        metrics = {
+            "count": self.clients,
+            "distinct": round(self.distinct.estimate()),
+            "limited": self.limited,
+            "ntp_packets": self.packets,
+        }
+        if self.dropped is not None:
+            metrics["ntp_dropped"] = self.dropped
+        for h, bounds in histograms.items():
+            if h == "dropped" and self.dropped is None:
+                continue
+            total = 0
+            for bound, count in zip(bounds, self.counts[h]):
+                total += count
+                metrics[bucketname(h, bound)] = total
+        return metrics
@@ -0,0 +1,147 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Encode values in the collectd binary network protocol.
+Ref: https://github.com/collectd/collectd/wiki/Binary-protocol
+"""
+
+import struct
+
+from typing import List, Tuple
+
+PART_HOST = 0x0000
+PART_PLUGIN = 0x0002
+PART_PLUGIN_INSTANCE = 0x0003
+PART_TYPE = 0x0004
+PART_TYPE_INSTANCE = 0x0005
+PART_VALUES = 0x0006
+PART_TIME_HR = 0x0008
+PART_INTERVAL_HR = 0x0009
+PART_MESSAGE = 0x0100
+PART_SEVERITY = 0x0101
+
+VALUE_GAUGE = 0x01
+
+SEVERITIES = {"failure": 1, "warning": 2, "okay": 4}
+
+# The default maximum packet size used by collectd's network plugin
+DEFAULT_PACKET_SIZE = 1452
+
+_numeric_parts = (PART_TIME_HR, PART_INTERVAL_HR)
+
+
+def string_part(part_type: int, value: str) -> bytes:
+    data = value.encode() + b"\0"
+    return struct.pack("!HH", part_type, len(data) + 4) + data
+
+
+def numeric_part(part_type: int, value: int) -> bytes:
+    return struct.pack("!HHQ", part_type, 12, value)
+
+
+def gauge_part(value: float) -> bytes:
+    # gauges are the only values encoded in little-endian byte order
+    return struct.pack("!HHHB", PART_VALUES, 15, 1, VALUE_GAUGE) + struct.pack("<d", value)
+
+
+def to_hires(nanoseconds: int) -> int:
+    """Convert nanoseconds to collectd's high resolution time units of 2^-30 seconds."""
+    return (nanoseconds << 30) // 1_000_000_000
+
+
+def split_type(name: str) -> Tuple[str, str, str]:
+    """Split a type name as used in the exec plugin (e.g. "peers/count-backup")
+    into plugin instance, type, and type instance."""
+    plugin_instance, typename = name.split("/", 1)
+    typename, _, type_instance = typename.partition("-")
+    return (plugin_instance, typename, type_instance)
+
+
+def notification(
+    host: str, plugin: str, plugin_instance: str, typename: str, severity: str, message: str, timestamp_ns: int
+) -> bytes:
+    """Return a packet containing a single notification."""
+    return b"".join(
+        [
+            string_part(PART_HOST, host),
+            numeric_part(PART_TIME_HR, to_hires(timestamp_ns)),
+            numeric_part(PART_SEVERITY, SEVERITIES[severity]),
+            string_part(PART_PLUGIN, plugin),
+            string_part(PART_PLUGIN_INSTANCE, plugin_instance),
+            string_part(PART_TYPE, typename),
+            string_part(PART_MESSAGE, message),
+        ]
+    )
+
+
+class PacketBuilder:
+    """Pack gauge values into packets no larger than max_size.  Within a
+    packet, each part is only included when its value differs from the
+    previous value list, as the protocol allows."""
+
+    def __init__(self, plugin: str, interval: float, max_size: int = DEFAULT_PACKET_SIZE) -> None:
+        self.plugin = plugin
+        self.interval = to_hires(int(interval * 1_000_000_000))
+        self.max_size = max_size
+        self.types = {}
+        self.reset()
+
+    def reset(self) -> None:
+        self.buffer = bytearray()
+        self.values = 0
+        self.state = {
+            PART_HOST: None,
+            PART_TIME_HR: None,
+            PART_INTERVAL_HR: None,
+            PART_PLUGIN: "",
+            PART_PLUGIN_INSTANCE: "",
+            PART_TYPE: "",
+            PART_TYPE_INSTANCE: "",
+        }
+
+    def encode(self, host: str, name: str, value: float, timestamp_ns: int) -> Tuple[bytes, dict]:
+        """Return the parts required to add this value to the current packet,
+        and the value list state which results."""
+        if name not in self.types:
+            self.types[name] = split_type(name)
+        plugin_instance, typename, type_instance = self.types[name]
+        state = {
+            PART_HOST: host,
+            PART_TIME_HR: to_hires(timestamp_ns),
+            PART_INTERVAL_HR: self.interval,
+            PART_PLUGIN: self.plugin,
+            PART_PLUGIN_INSTANCE: plugin_instance,
+            PART_TYPE: typename,
+            PART_TYPE_INSTANCE: type_instance,
+        }
+        parts = bytearray()
+        for part_type, part_value in state.items():
+            if self.state[part_type] != part_value:
+                if part_type in _numeric_parts:
+                    parts += numeric_part(part_type, part_value)
+                else:
+                    parts += string_part(part_type, part_value)
+        parts += gauge_part(float(value))
+        return (parts, state)
+
+    def add(self, host: str, name: str, value: float, timestamp_ns: int) -> List[bytes]:
+        """Add a value, returning a list of any packets which were completed as a result."""
+        completed = []
+        parts, state = self.encode(host, name, value, timestamp_ns)
+        if len(self.buffer) + len(parts) > self.max_size and self.values > 0:
+            completed = self.flush()
+            parts, state = self.encode(host, name, value, timestamp_ns)
+        self.buffer += parts
+        self.values += 1
+        self.state = state
+        return completed
+
+    def flush(self) -> List[bytes]:
+        """Return the current packet (if it contains any values) and start a new one."""
+        if self.values == 0:
+            return []
+        packet = bytes(self.buffer)
+        self.reset()
+        return [packet]
@@ -0,0 +1,130 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Run NTPmon inside collectd using its python plugin, e.g.:
+
+    <LoadPlugin python>
+        Globals true
+    </LoadPlugin>
+    <Plugin python>
+        ModulePath "/usr/share/ntpmon"
+        Import "collectd_plugin"
+        <Module collectd_plugin>
+            Interval 60
+        </Module>
+    </Plugin>
+
+Collection runs on a background thread; values are queued as they are
+collected and dispatched to collectd from its read callback.
+"""
+
+import argparse
+import asyncio
+import collections
+import threading
+
+from typing import Deque, Tuple
+
+import collectd
+
+import collectd_network
+import ntpmon
+import outputs
+
+
+class CollectdPluginOutput(outputs.CollectdOutput):
+    """Queue values for dispatch by the read callback, without converting them to text."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(args)
+        self.queue: Deque[Tuple[str, str, float, int]] = collections.deque()
+        self.notifications: Deque[Tuple[str, str, str, str, int]] = collections.deque()
+
+    def notify(self, hostname: str, event: str, severity: str, message: str, timestamp_ns: int) -> None:
+        self.notifications.append((hostname, event, severity, message, timestamp_ns))
+
+    def putval(self, hostname: str, typename: str, value: float, timestamp_ns: int) -> None:
+        self.queue.append((hostname, typename, value, timestamp_ns))
+
+    def dispatch(self) -> int:
+        """Dispatch all queued values and notifications to collectd, returning the number of values dispatched."""
+        count = 0
+        while len(self.queue) > 0:
+            hostname, typename, value, timestamp_ns = self.queue.popleft()
+            plugin_instance, type_name, type_instance = collectd_network.split_type(typename)
+            collectd.Values(
+                host=hostname,
+                plugin="ntpmon",
+                plugin_instance=plugin_instance,
+                type=type_name,
+                type_instance=type_instance,
+                time=timestamp_ns / 1_000_000_000,
+                interval=self.args.interval,
+                values=[value],
+            ).dispatch()
+            count += 1
+        while len(self.notifications) > 0:
+            hostname, event, severity, message, timestamp_ns = self.notifications.popleft()
+            collectd.Notification(
+                host=hostname,
+                plugin="ntpmon",
+                plugin_instance="events",
+                type=event,
+                severity=collectd.NOTIF_OKAY if severity == "okay" else collectd.NOTIF_WARNING,
+                message=message,
+                time=timestamp_ns / 1_000_000_000,
+            ).dispatch()
+        return count
+
+
+args = argparse.Namespace(
+    aggregate_interval=0,
+    debug=False,
+    flush_interval=1.0,
+    hostname="",  # an empty host is replaced by collectd's own hostname
+    interval=60,
+    logfile=None,
+    mode="collectd-plugin",
+    signal="none",
+)
+output = None
+
+
+def run() -> None:
+    try:
+        asyncio.run(ntpmon.run_tasks(args, output))
+    except Exception as e:
+        collectd.error(f"ntpmon: collection stopped: {e}")
+    else:
+        collectd.error("ntpmon: collection stopped")
+
+
+def config(conf) -> None:
+    for child in conf.children:
+        key = child.key.lower()
+        if key == "hostname":
+            args.hostname = child.values[0]
+        elif key == "interval":
+            args.interval = int(child.values[0])
+        elif key == "logfile":
+            args.logfile = child.values[0]
+        else:
+            collectd.warning(f"ntpmon: unknown configuration key {child.key}")
+
+
+def init() -> None:
+    global output
+    output = CollectdPluginOutput(args)
+    threading.Thread(target=run, name="ntpmon", daemon=True).start()
+
+
+def read() -> None:
+    if output is not None:
+        output.dispatch()
+
+
+collectd.register_config(config)
+collectd.register_init(init)
+collectd.register_read(read)
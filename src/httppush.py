@@ -0,0 +1,271 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Deliver batches of encoded metrics to an HTTP endpoint using POST requests.
+"""
+
+import base64
+import collections
+import email.utils
+import gzip
+import http.client
+import sys
+import threading
+import time
+import urllib.parse
+
+from typing import Callable, Deque, Dict, Tuple
+
+from spill import SpillJournal
+
+
+def gzip_compress(data: bytes) -> bytes:
+    # Speed matters more than size for small, frequent batches.
+    return gzip.compress(data, compresslevel=1)
+
+
+def retry_after(value: str, now: float = None) -> float:
+    """Return the number of seconds to wait given the value of a Retry-After header,
+    which may be either a number of seconds or an HTTP date.  Return None if it
+    cannot be parsed."""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    if now is None:
+        now = time.time()
+    return max(0.0, when - now)
+
+
+def spill_record(data: bytes, lines: int) -> bytes:
+    """Return a spill journal record containing a batch.  Request bodies may be
+    binary (e.g. protobuf), so each is base64-encoded onto a single line,
+    preceded by its line count."""
+    return b"%d %s\n" % (lines, base64.b64encode(data))
+
+
+def parse_spill_record(record: bytes) -> Tuple[bytes, int]:
+    """Return the batch and line count in a spill journal record, raising
+    ValueError if it is not valid."""
+    lines, _, encoded = record.rstrip(b"\n").partition(b" ")
+    return (base64.b64decode(encoded, validate=True), int(lines))
+
+
+class HTTPTransport:
+    """POST batches to a URL from a background thread over a persistent
+    (keep-alive) connection.
+
+    Pending batches are held in a queue bounded by the number of lines (or
+    other items) they contain; when the queue is full, the oldest batches are
+    moved to the spill journal (if one is configured) or dropped.  Spilled
+    batches are replayed at a limited rate whenever the queue is empty.
+    Requests which fail due to network errors or server errors are retried
+    with exponential backoff; 429 and 503 responses are retried after the
+    delay given in their Retry-After header.  Other client errors cause the
+    batch to be discarded, since sending it again will not help."""
+
+    def __init__(
+        self,
+        url: str,
+        headers: Dict[str, str] = {},
+        compress: Callable[[bytes], bytes] = gzip_compress,
+        encoding: str = "gzip",
+        max_lines: int = 10000,
+        min_backoff: float = 0.1,
+        max_backoff: float = 30.0,
+        timeout: float = 10.0,
+        spill: SpillJournal = None,
+        replay_rate: int = 65536,
+    ) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported URL scheme in {url}")
+        self.url = url
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = parsed.path or "/"
+        if parsed.query:
+            self.path += "?" + parsed.query
+        self.headers = dict(headers)
+        if encoding is not None:
+            self.headers["Content-Encoding"] = encoding
+        self.compress = compress
+        self.max_lines = max_lines
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.spill = spill
+        self.replay_rate = replay_rate
+        self.next_replay = 0.0
+
+        self.conn = None
+        self.inflight = None
+        self.lock = threading.Condition()
+        self.queue: Deque[Tuple[bytes, int]] = collections.deque()
+        self.queued_lines = 0
+        self.thread = None
+
+        # statistics
+        self.connects = 0
+        self.dropped_lines = 0
+        self.rejected_lines = 0
+        self.requests = 0
+        self.retries = 0
+        self.sent_bytes = 0
+        self.sent_lines = 0
+
+    def send(self, data: bytes, lines: int) -> None:
+        """Queue a batch for delivery, spilling or dropping the oldest queued batches if the queue is full."""
+        with self.lock:
+            self.queue.append((data, lines))
+            self.queued_lines += lines
+            while self.queued_lines > self.max_lines and len(self.queue) > 0:
+                old, dropped = self.queue.popleft()
+                self.queued_lines -= dropped
+                if old is self.inflight:
+                    # it is being sent now, so spilling it would send it twice
+                    continue
+                if self.spill is None:
+                    self.dropped_lines += dropped
+                else:
+                    self.spill.append(spill_record(old, dropped))
+            self.lock.notify()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="httppush", daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+        self.conn = None
+
+    def connect(self) -> None:
+        if self.scheme == "https":
+            self.conn = http.client.HTTPSConnection(self.netloc, timeout=self.timeout)
+        else:
+            self.conn = http.client.HTTPConnection(self.netloc, timeout=self.timeout)
+        self.connects += 1
+
+    def request(self, body: bytes) -> Tuple[int, str, str]:
+        self.conn.request("POST", self.path, body=body, headers=self.headers)
+        response = self.conn.getresponse()
+        text = response.read().decode(errors="replace")
+        self.requests += 1
+        if response.will_close:
+            self.close()
+        return (response.status, response.getheader("Retry-After"), text)
+
+    def post(self, body: bytes) -> Tuple[int, str, str]:
+        """Send the body, returning the response status, Retry-After header, and response text."""
+        reused = self.conn is not None
+        if not reused:
+            self.connect()
+        try:
+            return self.request(body)
+        except (OSError, http.client.HTTPException):
+            self.close()
+            if not reused:
+                raise
+            # The server may have closed an idle keep-alive connection; reconnect once straight away.
+            self.connect()
+            return self.request(body)
+
+    def deliver(self, data: bytes, lines: int) -> None:
+        """Send a batch, retrying until it is accepted or rejected by the server."""
+        body = data if self.compress is None else self.compress(data)
+        backoff = self.min_backoff
+        while True:
+            try:
+                status, retry, text = self.post(body)
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                status, retry, text = (None, None, str(e))
+
+            if status is not None and status < 300:
+                self.sent_bytes += len(body)
+                self.sent_lines += lines
+                return
+            if status is not None and 400 <= status < 500 and status != 429:
+                print(f"{self.url} rejected {lines} lines: {status} {text.strip()}", file=sys.stderr)
+                self.rejected_lines += lines
+                return
+
+            delay = retry_after(retry) if status in (429, 503) else None
+            if delay is None:
+                delay = backoff
+                backoff = min(backoff * 2, self.max_backoff)
+            print(f"Cannot send to {self.url}: {status or ''} {text.strip()}; retrying in {delay:.1f}s", file=sys.stderr)
+            self.retries += 1
+            time.sleep(delay)
+
+    def next_batch(self) -> Tuple[bytes, int, Tuple[int, bytes]]:
+        """Wait for the next batch to send, and return it along with its line
+        count and the spill journal segment and record it came from (or None
+        if it came from the queue).  Must be called with the lock held."""
+        while True:
+            if len(self.queue) > 0:
+                data, lines = self.queue[0]
+                return (data, lines, None)
+            if self.spill is None or self.spill.empty():
+                self.lock.wait()
+                continue
+
+            # replay spilled batches at a limited rate, but send new batches as soon as they arrive
+            delay = self.next_replay - time.monotonic()
+            if delay > 0:
+                self.lock.wait(delay)
+                continue
+            # each record is a whole batch, so reading one byte returns exactly one record
+            seq, record = self.spill.read(1)
+            if len(record) == 0:
+                continue
+            try:
+                data, lines = parse_spill_record(record)
+            except ValueError:
+                print(f"Discarding invalid spill record for {self.url}", file=sys.stderr)
+                self.spill.commit(seq, len(record))
+                continue
+            return (data, lines, (seq, record))
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                data, lines, spilled = self.next_batch()
+                self.inflight = data
+            self.deliver(data, lines)
+            with self.lock:
+                self.inflight = None
+                if spilled is not None:
+                    seq, record = spilled
+                    self.spill.commit(seq, len(record))
+                    self.next_replay = time.monotonic() + len(record) / self.replay_rate
+                # The queue may have been trimmed while we were sending.
+                elif len(self.queue) > 0 and self.queue[0][0] is data:
+                    self.queue.popleft()
+                    self.queued_lines -= lines
+
+    def getmetrics(self) -> Dict[str, int]:
+        """Return delivery statistics."""
+        with self.lock:
+            metrics = {} if self.spill is None else self.spill.getmetrics()
+        metrics.update(
+            {
+                "transport_dropped_lines": self.dropped_lines,
+                "transport_queued_lines": self.queued_lines,
+                "transport_reconnects": max(0, self.connects - 1),
+                "transport_rejected_lines": self.rejected_lines,
+                "transport_requests": self.requests,
+                "transport_retries": self.retries,
+                "transport_sent_bytes": self.sent_bytes,
+                "transport_sent_lines": self.sent_lines,
+            }
+        )
+        return metrics
@@ -9,9 +9,11 @@
 # With telegraf we can only use timestamps in nanosecond format
 
 
+import operator
 import re
 import time
 
+from typing import Callable, ClassVar, Dict, List
 
 exclude_fields = [
     "timestamp_ns",
@@ -80,3 +82,86 @@ punctuation = re.compile(r'[-!@#$%^&()<>,./\?+=:;"\'\[\]\{\}\*\s]+')
 
 def transform_identifier(id: str) -> str:
     return punctuation.sub("_", id).strip("_")
+
+
+def _getter(keys: List[str]) -> Callable[[dict], tuple]:
+    """Return a function which extracts the values of keys from a dict as a tuple."""
+    if len(keys) == 0:
+        return lambda d: ()
+    elif len(keys) == 1:
+        key = keys[0]
+        return lambda d: (d[key],)
+    else:
+        return operator.itemgetter(*keys)
+
+
+class _Schema:
+    """The encoding plan for one measurement name and set of metric names and types."""
+
+    def __init__(self, which: str, metrics: dict, additional_tags: dict) -> None:
+        all_metrics = {}
+        all_metrics.update(additional_tags)
+        all_metrics.update(metrics)
+        tags = [k for k in sorted(all_metrics.keys()) if k not in exclude_tags and type(all_metrics[k]) == str]
+        self.tag_names = [transform_identifier(k) for k in tags]
+        metric_tags = [k for k in tags if k in metrics]
+        other_tags = [k for k in tags if k not in metrics]
+        self.metric_tags = _getter(metric_tags)
+        self.additional_tags = _getter(other_tags)
+        # position of each tag's value in the tuple of values returned by tagset()
+        self.tag_positions = [(metric_tags + other_tags).index(k) for k in tags]
+        self.tagsets = {}
+
+        fields = [k for k in sorted(metrics.keys()) if k not in exclude_fields]
+        floats = [k for k in fields if type(metrics[k]) == float]
+        ints = [k for k in fields if type(metrics[k]) == int]
+        bools = [k for k in fields if type(metrics[k]) == bool]
+        fieldfmt = ",".join(
+            [f"{transform_identifier(k)}={{}}" for k in floats]
+            + [f"{transform_identifier(k)}={{}}i" for k in ints]
+            + [f"{transform_identifier(k)}={{:d}}i" for k in bools]
+        )
+        self.fields = _getter(floats + ints + bools)
+        self.format = (which.replace("{", "{{").replace("}", "}}") + "{} " + fieldfmt + " {}").format
+
+    def tagset(self, metrics: dict, additional_tags: dict) -> str:
+        """Return the formatted tag set for these tag values, formatting it only the first time it is seen."""
+        values = self.metric_tags(metrics) + self.additional_tags(additional_tags)
+        tagset = self.tagsets.get(values)
+        if tagset is None:
+            if len(self.tagsets) >= Encoder.max_tagsets:
+                self.tagsets.clear()
+            tagset = "".join(
+                f",{name}={escape_tag_value(values[pos])}" for (name, pos) in zip(self.tag_names, self.tag_positions)
+            )
+            self.tagsets[values] = tagset
+        return tagset
+
+
+class Encoder:
+    """Encode metrics as line protocol, producing the same output as
+    to_line_protocol().  The sorting, identifier transformation, and field type
+    checks are done once for each distinct measurement schema (the measurement
+    name plus the names and types of its metrics), and the formatted tag set
+    is cached for each distinct combination of tag values."""
+
+    max_tagsets: ClassVar[int] = 4096
+
+    def __init__(self) -> None:
+        self.schemas: Dict[tuple, _Schema] = {}
+
+    def encode(self, metrics: dict, which: str, additional_tags: dict = {}) -> bytes:
+        """Return metrics encoded as a line of line protocol, without a trailing newline."""
+        if "timestamp_ns" not in metrics:
+            metrics["timestamp_ns"] = time.time_ns()
+        key = (
+            which,
+            tuple(metrics.keys()),
+            tuple(map(type, metrics.values())),
+            tuple(additional_tags.keys()),
+            tuple(map(type, additional_tags.values())),
+        )
+        schema = self.schemas.get(key)
+        if schema is None:
+            schema = self.schemas[key] = _Schema(which, metrics, additional_tags)
+        return schema.format(schema.tagset(metrics, additional_tags), *schema.fields(metrics), metrics["timestamp_ns"]).encode()
@@ -0,0 +1,96 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Parse 'chronyc -n ntpdata' or 'ntpq -n -c associations -c "pstats &1" ...'
+output one line at a time, and extract the packet and timestamping counters of
+each association.
+"""
+
+import re
+
+from typing import Dict, List
+
+# The label of the first line of each association's data
+source_labels = ["remote_address", "remote_host"]
+
+# chronyc ntpdata counters; older versions of chrony do not report the good, kernel, and hardware counts
+chrony_counters = [
+    "total_good_rx",
+    "total_hw_rx",
+    "total_hw_tx",
+    "total_kernel_rx",
+    "total_kernel_tx",
+    "total_rx",
+    "total_tx",
+    "total_valid_rx",
+]
+
+# ntpq pstats counters
+ntpd_counters = [
+    "bad_authentication",
+    "bad_dispersion",
+    "bad_reference_time",
+    "bogus_origin",
+    "duplicate",
+    "packets_received",
+    "packets_sent",
+]
+
+counters = chrony_counters + ntpd_counters
+gauges = ["response_time"]
+
+# The values of these fields are reported as labels (e.g. daemon, kernel, or hardware timestamping)
+labels = ["rx_timestamping", "tx_timestamping"]
+
+# The values of these fields are Yes or No
+flags = ["authenticated", "interleaved"]
+
+labelregex = re.compile(r"[^a-z0-9]+")
+
+
+class NTPData:
+    """The counters of each association, built by calling add() with each line of output."""
+
+    def __init__(self, elapsed: float = 0) -> None:
+        self.sources: Dict[str, dict] = {}
+        self.current: dict = None
+        self.elapsed = elapsed
+
+    def add(self, line: str) -> None:
+        name, sep, value = line.partition(":")
+        if not sep:
+            return
+        name = labelregex.sub("_", name.strip().lower())
+        value = value.strip()
+        if name in source_labels:
+            # the address may be followed by its hexadecimal representation
+            address = value.split()[0] if value else value
+            self.current = self.sources[address] = {}
+        elif self.current is None:
+            return
+        elif name in counters:
+            try:
+                self.current[name] = int(value)
+            except ValueError:
+                pass
+        elif name in gauges:
+            try:
+                self.current[name] = float(value.split()[0])
+            except (IndexError, ValueError):
+                pass
+        elif name in labels:
+            self.current[name] = value.lower()
+        elif name in flags:
+            self.current[name] = value == "Yes"
+
+    def getmetrics(self):
+        """Association data is reported per source rather than as summary metrics."""
+        return {}
+
+
+def pstats_args(associations: int) -> List[str]:
+    """Return the ntpq arguments which fetch the statistics of the given number of
+    associations, as numbered by the associations command."""
+    return [arg for i in range(1, associations + 1) for arg in ("-c", f"pstats &{i}")]
@@ -10,12 +10,20 @@ import socket
 import sys
 import time
 
+from typing import Dict, List
+
 import alert
+import ntpdata
 import outputs
 import peer_stats
 import process
 import version
 
+from aggregator import PeerAggregator
+from clients import HyperLogLog
+from peer_events import PeerDiffer
+from peers import PeerTable
+from serverstats import CounterRates
 from tailer import Tailer
 
 
@@ -24,18 +32,80 @@ def get_args() -> argparse.Namespace:
     parser.add_argument(
         "--mode",
         type=str,
+        action="append",
         choices=[
             "collectd",
+            "collectd-network",
+            "execd",
+            "graphite",
+            "influxdb",
+            "otlp",
             "prometheus",
+            "remote_write",
             "telegraf",
+            "textfile",
         ],
-        help="Collectd is the default if collectd environment variables are detected.",
+        help="Where to send metrics; may be given more than once to send to several destinations. "
+        "Collectd is the default if collectd environment variables are detected.",
+    )
+    parser.add_argument(
+        "--aggregate-interval",
+        type=float,
+        help="Summarise each source's measurements over windows of this many seconds, rather than sending every "
+        "measurement (default: 0, which sends every measurement)",
+        default=0,
+    )
+    parser.add_argument(
+        "--batch-bytes",
+        type=int,
+        help="Maximum number of bytes of buffered output to hold before sending to telegraf or InfluxDB (default: 65536)",
+        default=65536,
+    )
+    parser.add_argument(
+        "--batch-lines",
+        type=int,
+        help="Maximum number of buffered lines (or samples in remote_write mode) to hold before sending to telegraf, "
+        "InfluxDB, or prometheus (default: 1000)",
+        default=1000,
+    )
+    parser.add_argument(
+        "--bucket",
+        type=str,
+        help="InfluxDB bucket to which metrics are written in influxdb mode (default: ntpmon)",
+        default="ntpmon",
+    )
+    parser.add_argument(
+        "--client-limit",
+        type=int,
+        help="Number of the busiest clients for which to report individual metrics when --clients is used (default: 10)",
+        default=10,
+    )
+    parser.add_argument(
+        "--clients",
+        action="store_true",
+        default=False,
+        help="Report summary statistics of the local NTP server's clients, from chronyc clients or ntpq mrulist",
     )
     parser.add_argument(
         "--connect",
         type=str,
-        help="Connect string (in host:port format) to use when sending data to telegraf (default: 127.0.0.1:8094)",
-        default="127.0.0.1:8094",
+        help="Where to send data to telegraf: host:port or tcp://host:port, udp://host:port, unix:///path, or "
+        "unixgram:///path (default: 127.0.0.1:8094); or the host:port of the collectd network listener in "
+        "collectd-network mode (default: 127.0.0.1:25826) or of carbon in graphite mode (default: 127.0.0.1:2003 for "
+        "plaintext, 127.0.0.1:2004 for pickle)",
+    )
+    parser.add_argument(
+        "--datagram-size",
+        type=int,
+        help="Maximum payload size of each datagram sent to udp:// or unixgram:// connect URLs "
+        "(default: 1400 for udp, 65536 for unixgram) or to collectd (default: 1452)",
+    )
+    parser.add_argument(
+        "--deadband",
+        type=float,
+        help="With --heartbeat, treat float metrics as unchanged unless they differ from the last value sent by more "
+        "than this fraction of it (default: 0)",
+        default=0.0,
     )
     parser.add_argument(
         "--debug",
@@ -43,10 +113,37 @@ def get_args() -> argparse.Namespace:
         help="Run in debug mode (default: True if standard output is a tty device)",
         default=sys.stdout.isatty(),
     )
+    parser.add_argument(
+        "--flush-interval",
+        type=float,
+        help="Maximum time in seconds to hold buffered output before sending it (default: 1.0)",
+        default=1.0,
+    )
+    parser.add_argument(
+        "--graphite-prefix",
+        type=str,
+        help="Prefix for metric paths in graphite mode (default: none)",
+        default="",
+    )
+    parser.add_argument(
+        "--graphite-protocol",
+        type=str,
+        choices=["pickle", "plaintext"],
+        help="Protocol used to send metrics to carbon in graphite mode (default: plaintext)",
+        default="plaintext",
+    )
+    parser.add_argument(
+        "--heartbeat",
+        type=int,
+        help="Only send metrics which have changed, but send each at least once in this many intervals; this applies "
+        "to all metrics except peer measurements and peer change events (default: 0, which sends all metrics "
+        "every interval)",
+        default=0,
+    )
     parser.add_argument(
         "--hostname",
         type=str,
-        help="The hostname to use for sending collectd metrics",
+        help="The hostname to use for sending collectd or graphite metrics",
     )
     parser.add_argument(
         "--interval",
@@ -70,12 +167,115 @@ def get_args() -> argparse.Namespace:
         action="store_false",
         dest="debug",
     )
+    parser.add_argument(
+        "--ntpdata",
+        action="store_true",
+        default=False,
+        help="Report the packet and timestamping counters of each association, from chronyc ntpdata or ntpq pstats",
+    )
+    parser.add_argument(
+        "--org",
+        type=str,
+        help="InfluxDB organization in influxdb mode (default: ntpmon); the API token is read from the "
+        "INFLUX_TOKEN environment variable",
+        default="ntpmon",
+    )
+    parser.add_argument(
+        "--otlp-encoding",
+        type=str,
+        choices=["json", "protobuf"],
+        help="Encoding of OTLP/HTTP export requests in otlp mode (default: protobuf)",
+        default="protobuf",
+    )
+    parser.add_argument(
+        "--output-queue-size",
+        type=int,
+        help="Maximum number of pending updates for each output when more than one --mode is given; the oldest are "
+        "dropped first (default: 1000)",
+        default=1000,
+    )
     parser.add_argument(
         "--port",
         type=int,
         help="TCP port on which to listen when acting as a prometheus exporter (default: 9648)",
         default=9648,
     )
+    parser.add_argument(
+        "--queue-lines",
+        type=int,
+        help="Maximum number of lines to queue while telegraf or InfluxDB is unavailable; the oldest are dropped first "
+        "(default: 10000)",
+        default=10000,
+    )
+    parser.add_argument(
+        "--selectdata",
+        action="store_true",
+        default=False,
+        help="Label peer measurements and sources with the reason chronyd selected or rejected them, from chronyc "
+        "selectdata (requires chrony 4.2 or later)",
+    )
+    parser.add_argument(
+        "--serverstats",
+        action="store_true",
+        default=False,
+        help="Report the rates of requests handled by the local NTP server, from chronyc serverstats or ntpq "
+        "sysstats and iostats",
+    )
+    parser.add_argument(
+        "--signal",
+        type=str,
+        choices=["none", "stdin"],
+        help="How collection is triggered in execd mode: none (every --interval seconds) or stdin (whenever "
+        'telegraf writes a line to standard input, to match its signal = "STDIN" setting) (default: none)',
+        default="none",
+    )
+    parser.add_argument(
+        "--source-limit",
+        type=int,
+        help="Maximum number of sources for which to report individual metrics (default: 32)",
+        default=32,
+    )
+    parser.add_argument(
+        "--source-types",
+        type=str,
+        help="Comma-separated list of peer types (e.g. sync,survivor) for which to report the metrics of each source "
+        "from chronyc sources or ntpq -p, in order of preference when --source-limit is reached, or 'all' "
+        "(default: none)",
+        default="",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="Directory in which to store output which cannot be delivered when the queue is full, in the graphite "
+        "(plaintext), influxdb, otlp, remote_write, and telegraf (tcp or unix) modes; each mode uses its own "
+        "subdirectory (default: none)",
+    )
+    parser.add_argument(
+        "--spill-max-bytes",
+        type=int,
+        help="Maximum size of each mode's spill directory; the oldest data is discarded first (default: 67108864)",
+        default=64 * 1024 * 1024,
+    )
+    parser.add_argument(
+        "--spill-replay-rate",
+        type=int,
+        help="Maximum rate in bytes per second at which to resend spilled output (default: 65536)",
+        default=65536,
+    )
+    parser.add_argument(
+        "--textfile-dir",
+        type=str,
+        help="Directory in which to write ntpmon.prom for the node_exporter textfile collector in textfile mode "
+        "(default: /var/lib/prometheus/node-exporter)",
+        default="/var/lib/prometheus/node-exporter",
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        help="Base URL of the InfluxDB server in influxdb mode (default: http://127.0.0.1:8086), or the URL to "
+        "which metrics are sent in otlp mode (default: http://127.0.0.1:4318/v1/metrics) or remote_write mode "
+        "(default: http://127.0.0.1:9090/api/v1/write)",
+    )
     parser.add_argument(
         "--version",
         action="store_true",
@@ -88,17 +288,21 @@ def get_args() -> argparse.Namespace:
         print(version.get_version())
         sys.exit(0)
 
+    unknown = [t for t in get_source_types(args) if t not in PeerTable.sourcetypes]
+    if len(unknown):
+        parser.error(f"unknown peer types in --source-types: {', '.join(unknown)}")
+
     if "COLLECTD_INTERVAL" in os.environ:
         if args.interval is None:
             args.interval = float(os.environ["COLLECTD_INTERVAL"])
         if args.mode is None:
-            args.mode = "collectd"
+            args.mode = ["collectd"]
 
     if "COLLECTD_HOSTNAME" in os.environ:
         if args.hostname is None:
             args.hostname = os.environ["COLLECTD_HOSTNAME"]
         if args.mode is None:
-            args.mode = "collectd"
+            args.mode = ["collectd"]
 
     if args.hostname is None:
         args.hostname = socket.getfqdn()
@@ -114,25 +318,42 @@ def get_time_until(interval: int) -> float:
     return interval - now % interval
 
 
+def get_source_types(args: argparse.Namespace) -> List[str]:
+    """Return the peer types for which individual sources are reported, in order of preference."""
+    source_types = getattr(args, "source_types", "")
+    if source_types == "all":
+        return PeerTable.sourcetypes
+    return [t.strip() for t in source_types.split(",") if t.strip()]
+
+
 checkobjs = None
 
+# the labels for the measurements of each peer, rebuilt from each snapshot of the peers
+peerindex: Dict[str, dict] = {None: {"peertype": "unknown"}}
+
 
-def find_type(source: str, peerobjs: dict) -> str:
-    """Return the type of the given source based on the data already collected in peerobjs."""
-    # the order of these is significant, because pps is included in sync, and sync is included in survivor
-    try:
-        for type in ["pps", "sync", "invalid", "false", "excess", "backup", "outlier", "survivor", "unknown"]:
-            if type not in peerobjs:
-                continue
-            if source in peerobjs[type]["address"]:
-                return type
-    except Exception:
-        return "UNKNOWN"
+def index_peers(checkobjs: dict) -> Dict[str, dict]:
+    """
+    Return the peer type of each peer, and its selection state if selectdata was collected, indexed by address.
+    The entry for None holds the labels for peers which are not in the snapshot.
+    """
+    table = checkobjs["peers"].table
+    selectdata = checkobjs.get("selectdata")
+    index = {}
+    for i, address in enumerate(table.addresses):
+        index[address] = {"peertype": table.peertype(i)}
+        if selectdata is not None:
+            index[address]["selection"] = selectdata.selection(address)
+    index[None] = {"peertype": "unknown"}
+    if selectdata is not None:
+        index[None]["selection"] = "unknown"
+    return index
 
 
 async def peer_stats_task(args: argparse.Namespace, output: outputs.Output) -> None:
     """Tail the peer stats log file and send the measurements to the selected output"""
     global checkobjs
+    aggregator = PeerAggregator(args.aggregate_interval) if args.aggregate_interval else None
     implementation = None
     logfile = args.logfile
     tailer = None
@@ -163,30 +384,151 @@ async def peer_stats_task(args: argparse.Namespace, output: outputs.Output) -> N
             stats = peer_stats.parse_measurement(line)
             if stats is not None:
                 if "peertype" not in stats:
-                    stats["peertype"] = find_type(stats["source"], checkobjs["peers"].peers)
-                output.send_peer_measurements(stats, debug=args.debug)
-
-
-async def summary_stats_task(args: argparse.Namespace, output: outputs.Output) -> None:
-    global checkobjs
+                    stats.update(peerindex.get(stats["source"], peerindex[None]))
+                if aggregator is None:
+                    output.send_peer_measurements(stats, debug=args.debug)
+                else:
+                    for summary in aggregator.add(stats):
+                        output.send_peer_measurements(summary, debug=args.debug)
+        if aggregator is not None:
+            for summary in aggregator.expire(time.time_ns()):
+                output.send_peer_measurements(summary, debug=args.debug)
+        output.flush()
+
+
+async def open_stdin(pipe=sys.stdin) -> asyncio.StreamReader:
+    """Return a stream reader for standard input"""
+    reader = asyncio.StreamReader()
+    await asyncio.get_running_loop().connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+    return reader
+
+
+def send_sources(args: argparse.Namespace, output: outputs.Output, checkobjs: dict, sourcetypes: List[str]) -> None:
+    """Send the metrics of the selected sources, and their statistics if they were collected."""
+    table = checkobjs["peers"].table
+    timestamp_ns = time.time_ns()
+    labels = {}
+    selectdata = checkobjs.get("selectdata")
+    for source in table.sources(sourcetypes, args.source_limit):
+        source["timestamp_ns"] = timestamp_ns
+        labels[source["source"]] = {"peertype": source["peertype"]}
+        if selectdata is not None:
+            source.update(selectdata.sources.get(source["source"], {"selection": "unknown"}))
+            labels[source["source"]]["selection"] = source["selection"]
+        output.send_peer_source(source, debug=args.debug)
+    if "sourcestats" in checkobjs:
+        for stats in checkobjs["sourcestats"].stats:
+            if stats["source"] in labels:
+                metrics = dict(stats, **labels[stats["source"]], timestamp_ns=timestamp_ns)
+                output.send_source_stats(metrics, debug=args.debug)
+
+
+def send_clients(args: argparse.Namespace, output: outputs.Output, checkobjs: dict, seen: HyperLogLog) -> None:
+    """Send the summary statistics of the clients, and the metrics of the busiest clients."""
+    clients = checkobjs["clients"]
+    seen.merge(clients.distinct)
+    timestamp_ns = time.time_ns()
+    metrics = clients.summary()
+    metrics["distinct_seen"] = round(seen.estimate())
+    metrics["timestamp_ns"] = timestamp_ns
+    output.send_client_stats(metrics, debug=args.debug)
+    for client in clients.top.clients():
+        client["timestamp_ns"] = timestamp_ns
+        output.send_client(client, debug=args.debug)
+
+
+def send_ntpdata(args: argparse.Namespace, output: outputs.Output, checkobjs: dict, rates: Dict[str, CounterRates]) -> None:
+    """Send the rates of the packet and timestamping counters of each association since the last interval."""
+    timestamp_ns = time.time_ns()
+    sources = checkobjs["ntpdata"].sources
+    for source, counters in sources.items():
+        if source not in rates:
+            rates[source] = CounterRates(ntpdata.counters, ntpdata.gauges)
+        metrics = rates[source].update_metrics(counters, timestamp_ns)
+        metrics.update({k: v for (k, v) in counters.items() if k in ntpdata.labels or k in ntpdata.flags})
+        metrics.update(peerindex.get(source, peerindex[None]))
+        metrics["source"] = source
+        output.send_ntpdata(metrics, debug=args.debug)
+    # forget associations which have been removed
+    for source in [s for s in rates if s not in sources]:
+        del rates[source]
+
+
+async def summary_stats_task(args: argparse.Namespace, output: outputs.Output, stdin=sys.stdin) -> None:
+    global checkobjs, peerindex
     checks = ["proc", "info", "offset", "peers", "reach", "sync", "vars"]
+    sourcetypes = get_source_types(args)
+    if sourcetypes:
+        checks.append("sourcestats")
+    if getattr(args, "serverstats", False):
+        checks.append("serverstats")
+    if getattr(args, "clients", False):
+        checks.append("clients")
+    if getattr(args, "selectdata", False):
+        checks.append("selectdata")
+    if getattr(args, "ntpdata", False):
+        checks.append("ntpdata")
+    ntpdatarates = {}
+    rates = CounterRates()
+    seen = HyperLogLog()
     alerter = alert.NTPAlerter(checks)
+    differ = PeerDiffer()
+    signals = await open_stdin(stdin) if args.signal == "stdin" else None
     while True:
+        if signals is not None and not await signals.readline():
+            # telegraf has closed our standard input, so it is no longer listening
+            return
+
         implementation = process.get_implementation()
         if implementation:
-            # run the checks, returning their data
-            checkobjs = process.ntpchecks(checks, debug=False, implementation=implementation)
+            # run the checks in a separate thread, so that streaming a large client list
+            # does not stop the event loop from tailing logs and flushing outputs
+            checkobjs = await asyncio.to_thread(
+                process.ntpchecks,
+                checks,
+                debug=False,
+                implementation=implementation,
+                client_limit=getattr(args, "client_limit", 10),
+            )
             # alert on the data collected
             alerter.alert(checkobjs=checkobjs, output=output, debug=args.debug)
-
-        await asyncio.sleep(get_time_until(args.interval))
+            # report what changed in the peers since the last check
+            if "peers" in checkobjs:
+                peerindex = index_peers(checkobjs)
+                for event in differ.update(checkobjs["peers"].table):
+                    output.send_peer_event(event, debug=args.debug)
+                output.send_peer_events(dict(differ.counts), debug=args.debug)
+                if sourcetypes:
+                    send_sources(args, output, checkobjs, sourcetypes)
+            if "serverstats" in checkobjs:
+                output.send_server_stats(rates.update(checkobjs["serverstats"]), debug=args.debug)
+            if "clients" in checkobjs:
+                send_clients(args, output, checkobjs, seen)
+            if "ntpdata" in checkobjs:
+                send_ntpdata(args, output, checkobjs, ntpdatarates)
+            output.flush()
+
+        if signals is None:
+            await asyncio.sleep(get_time_until(args.interval))
+
+
+async def flush_task(args: argparse.Namespace, output: outputs.Output) -> None:
+    """Ensure that buffered output is never held for longer than the flush interval"""
+    while True:
+        await asyncio.sleep(args.flush_interval)
+        output.flush()
 
 
-async def start_tasks(args: argparse.Namespace) -> None:
-    output = outputs.get_output(args)
+async def run_tasks(args: argparse.Namespace, output: outputs.Output) -> None:
+    """Run the collection tasks until one of them exits"""
     peer_stats = asyncio.create_task(peer_stats_task(args, output), name="peerstats")
     summary_stats = asyncio.create_task(summary_stats_task(args, output), name="summarystats")
-    await asyncio.wait((peer_stats, summary_stats), return_when=asyncio.FIRST_COMPLETED)
+    flush = asyncio.create_task(flush_task(args, output), name="flush")
+    await asyncio.wait((peer_stats, summary_stats, flush), return_when=asyncio.FIRST_COMPLETED)
+
+
+async def start_tasks(args: argparse.Namespace) -> None:
+    await run_tasks(args, outputs.get_output(args))
     sys.exit(1)
 
 
@@ -0,0 +1,195 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Build OpenTelemetry (OTLP) metrics export requests.
+Ref: https://github.com/open-telemetry/opentelemetry-proto/blob/main/opentelemetry/proto/metrics/v1/metrics.proto
+"""
+
+import bisect
+import json
+import time
+
+from typing import Dict, List, Tuple
+
+import line_protocol
+import protobuf
+
+AGGREGATION_TEMPORALITY_DELTA = 1
+
+# The subset of the OTLP metrics protocol which we produce, using the field names of the JSON encoding
+schema: protobuf.Schema = {
+    "ExportMetricsServiceRequest": {
+        "resourceMetrics": (1, "ResourceMetrics"),
+    },
+    "ResourceMetrics": {
+        "resource": (1, "Resource"),
+        "scopeMetrics": (2, "ScopeMetrics"),
+    },
+    "Resource": {
+        "attributes": (1, "KeyValue"),
+    },
+    "ScopeMetrics": {
+        "scope": (1, "InstrumentationScope"),
+        "metrics": (2, "Metric"),
+    },
+    "InstrumentationScope": {
+        "name": (1, "string"),
+        "version": (2, "string"),
+    },
+    "Metric": {
+        "name": (1, "string"),
+        "gauge": (5, "Gauge"),
+        "histogram": (9, "Histogram"),
+    },
+    "Gauge": {
+        "dataPoints": (1, "NumberDataPoint"),
+    },
+    "NumberDataPoint": {
+        "timeUnixNano": (3, "fixed64"),
+        "asDouble": (4, "double"),
+        "asInt": (6, "sfixed64"),
+        "attributes": (7, "KeyValue"),
+    },
+    "Histogram": {
+        "dataPoints": (1, "HistogramDataPoint"),
+        "aggregationTemporality": (2, "enum"),
+    },
+    "HistogramDataPoint": {
+        "startTimeUnixNano": (2, "fixed64"),
+        "timeUnixNano": (3, "fixed64"),
+        "count": (4, "fixed64"),
+        "sum": (5, "double"),
+        "bucketCounts": (6, "fixed64"),
+        "explicitBounds": (7, "double"),
+        "attributes": (9, "KeyValue"),
+        "min": (11, "double"),
+        "max": (12, "double"),
+    },
+    "KeyValue": {
+        "key": (1, "string"),
+        "value": (2, "AnyValue"),
+    },
+    "AnyValue": {
+        "stringValue": (1, "string"),
+    },
+}
+
+# Histogram bucket boundaries for peer offsets, in seconds
+offset_bounds = [-1e-1, -1e-2, -1e-3, -1e-4, -1e-5, 0.0, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1]
+
+Attributes = Tuple[Tuple[str, str], ...]
+
+
+def attributes(attrs: Dict[str, str]) -> List[dict]:
+    return [{"key": k, "value": {"stringValue": v}} for (k, v) in sorted(attrs.items())]
+
+
+class Histogram:
+    """Distribution of values in explicit buckets."""
+
+    def __init__(self, bounds: List[float]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+
+class MetricsBatch:
+    """Collect data points between flushes.  Each numeric field becomes a gauge
+    data point named after the measurement and field, with the string fields as
+    its attributes and timestamp_ns (if present) as its time.  Selected fields
+    are also summarised in delta histograms covering the time since the
+    previous flush."""
+
+    histogram_fields: Dict[Tuple[str, str], List[float]] = {
+        ("ntpmon_peer", "offset"): offset_bounds,
+    }
+
+    def __init__(self) -> None:
+        self.reset(time.time_ns())
+
+    def reset(self, start_ns: int) -> None:
+        self.gauges: Dict[str, List[dict]] = {}
+        self.histograms: Dict[Tuple[str, Attributes], Histogram] = {}
+        self.points = 0
+        self.start_ns = start_ns
+
+    def add(self, which: str, metrics: dict) -> None:
+        timestamp_ns = metrics.get("timestamp_ns") or time.time_ns()
+        attrs = {k: v for (k, v) in metrics.items() if type(v) == str}
+        attr_list = attributes(attrs)
+        for field, value in metrics.items():
+            if field in line_protocol.exclude_fields or type(value) not in (bool, float, int):
+                continue
+            name = which + "_" + line_protocol.transform_identifier(field)
+            point = {"timeUnixNano": timestamp_ns, "attributes": attr_list}
+            if type(value) == float:
+                point["asDouble"] = value
+            else:
+                point["asInt"] = int(value)
+            self.gauges.setdefault(name, []).append(point)
+            self.points += 1
+
+            if (which, field) in self.histogram_fields:
+                key = (name, (("source", attrs["source"]),) if "source" in attrs else ())
+                if key not in self.histograms:
+                    self.histograms[key] = Histogram(self.histogram_fields[(which, field)])
+                self.histograms[key].add(value)
+
+    def empty(self) -> bool:
+        return self.points == 0
+
+    def request(self, resource: Dict[str, str], scope: Dict[str, str], now_ns: int) -> dict:
+        """Return an ExportMetricsServiceRequest for the data collected so far."""
+        metrics = [{"name": name, "gauge": {"dataPoints": points}} for (name, points) in self.gauges.items()]
+        histograms = {}
+        for (name, attrs), h in self.histograms.items():
+            point = {
+                "startTimeUnixNano": self.start_ns,
+                "timeUnixNano": now_ns,
+                "count": h.count,
+                "sum": h.sum,
+                "bucketCounts": h.counts,
+                "explicitBounds": h.bounds,
+                "attributes": attributes(dict(attrs)),
+                "min": h.min,
+                "max": h.max,
+            }
+            histograms.setdefault(name + "_histogram", []).append(point)
+        for name, points in histograms.items():
+            metrics.append(
+                {
+                    "name": name,
+                    "histogram": {"dataPoints": points, "aggregationTemporality": AGGREGATION_TEMPORALITY_DELTA},
+                }
+            )
+        return {
+            "resourceMetrics": [
+                {
+                    "resource": {"attributes": attributes(resource)},
+                    "scopeMetrics": [{"scope": scope, "metrics": metrics}],
+                }
+            ]
+        }
+
+    def encode(self, resource: Dict[str, str], scope: Dict[str, str], json_encoding: bool = False) -> bytes:
+        """Encode the data collected so far and start a new batch."""
+        now_ns = time.time_ns()
+        request = self.request(resource, scope, now_ns)
+        self.reset(now_ns)
+        if json_encoding:
+            return json.dumps(protobuf.to_json(schema, "ExportMetricsServiceRequest", request), allow_nan=False).encode()
+        return protobuf.encode(schema, "ExportMetricsServiceRequest", request)
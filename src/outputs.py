@@ -4,16 +4,77 @@
 
 
 import argparse
+import asyncio
 import datetime
+import hashlib
+import math
+import os
+import pickle
+import re
 import socket
+import struct
 import sys
-
-from io import TextIOWrapper
 import time
+import urllib.parse
+
 from typing import ClassVar, Dict, List, Tuple
 
 
+import clients
+import collectd_network
+import httppush
 import line_protocol
+import ntpdata
+import otlp
+import remote_write
+import serverstats
+import snappy_codec
+import transport
+import version
+
+from aggregator import PeerAggregator
+from batcher import BatchWriter
+from spill import SpillJournal
+
+
+def aggregate_collectd_types(types: Dict[str, str]) -> Dict[str, str]:
+    """Return the collectd types of the fields which PeerAggregator adds to each
+    peer measurement summary, based on the types of the measurements."""
+    result = {"samples": "samples/count"}
+    for field in PeerAggregator.fields:
+        (instance, typename) = types[field].split("/")
+        for statistic in PeerAggregator.statistics:
+            result[field + "_" + statistic] = "%s-%s/%s" % (instance, statistic, typename)
+    for flag in PeerAggregator.flags:
+        result[flag + "_count"] = types[flag].split("/")[0] + "-count/count"
+    return result
+
+
+aggregate_descriptions = {
+    "max": "Maximum",
+    "mean": "Mean",
+    "min": "Minimum",
+    "stddev": "Standard deviation",
+}
+
+
+def aggregate_prometheus_types(types: Dict[str, Tuple[str, str, str]]) -> Dict[str, Tuple[str, str, str]]:
+    """Return the prometheus types of the fields which PeerAggregator adds to each
+    peer measurement summary, based on the types of the measurements."""
+    result = {"samples": ("i", None, "Number of measurements from this peer in the aggregation interval")}
+    for field in PeerAggregator.fields:
+        (datatype, suffix, description) = types[field]
+        description = description[0].lower() + description[1:]
+        for statistic in PeerAggregator.statistics:
+            result[field + "_" + statistic] = (
+                datatype,
+                suffix,
+                "%s of %s over the aggregation interval" % (aggregate_descriptions[statistic], description),
+            )
+    for flag in PeerAggregator.flags:
+        description = types[flag][2].replace("Whether", "Number of measurements in the aggregation interval in which", 1)
+        result[flag + "_count"] = ("i", None, description)
+    return result
 
 
 class Output:
@@ -59,6 +120,81 @@ class Output:
         "sync_loop": "sync-loop/bool",
         "synchronized": "synchronized/bool",
     }
+    peerstatstypes.update(aggregate_collectd_types(peerstatstypes))
+
+    eventtypes: ClassVar[Dict[str, str]] = {
+        "added": "events/count-added",
+        "reach_lost": "events/count-reach-lost",
+        "removed": "events/count-removed",
+        "state_changed": "events/count-state-changed",
+        "sync_changed": "events/count-sync-changed",
+    }
+
+    sourcetypes: ClassVar[Dict[str, str]] = {
+        "authenticated": "sources/bool-authenticated",
+        "delay": "sources/time_offset-delay",
+        "error": "sources/time_offset-error",
+        "interval_hi": "sources/time_offset-interval-hi",
+        "interval_lo": "sources/time_offset-interval-lo",
+        "jitter": "sources/time_offset-jitter",
+        "last_sample": "sources/duration-last-sample",
+        "moffset": "sources/time_offset-moffset",
+        "noselect": "sources/bool-noselect",
+        "offset": "sources/time_offset-offset",
+        "poll": "sources/duration-poll",
+        "prefer": "sources/bool-prefer",
+        "reach": "sources/percent-reach",
+        "require": "sources/bool-require",
+        "score": "sources/gauge-score",
+        "stratum": "sources/clock_stratum",
+        "trust": "sources/bool-trust",
+        "when": "sources/duration-when",
+    }
+
+    clienttypes: ClassVar[Dict[str, str]] = {
+        "dropped": "clients/count-dropped",
+        "interval": "clients/duration-interval",
+        "last": "clients/duration-last",
+        "packets": "clients/count-packets",
+        "rank": "clients/gauge-rank",
+    }
+
+    clientstatstypes: ClassVar[Dict[str, str]] = dict(
+        [
+            ("count", "clients/count"),
+            ("distinct", "clients/count-distinct"),
+            ("distinct_seen", "clients/count-distinct-seen"),
+            ("limited", "clients/count-limited"),
+            ("ntp_dropped", "clients/count-ntp-dropped"),
+            ("ntp_packets", "clients/count-ntp-packets"),
+        ]
+        + [
+            (clients.bucketname(h, b), "clients/count-" + clients.bucketname(h, b).replace("_", "-"))
+            for (h, bounds) in clients.histograms.items()
+            for b in bounds
+        ]
+    )
+
+    ntpdatatypes: ClassVar[Dict[str, str]] = dict(
+        [(c + "_rate", "ntpdata/operations_per_second-" + c.replace("_", "-")) for c in ntpdata.counters]
+        + [(f, "ntpdata/bool-" + f) for f in ntpdata.flags]
+        + [("response_time", "ntpdata/duration-response-time")]
+    )
+
+    serverstatstypes: ClassVar[Dict[str, str]] = dict(
+        [(c + "_rate", "server/operations_per_second-" + c.replace("_", "-")) for c in serverstats.counters]
+        + [(g, "server/gauge-" + g.replace("_", "-")) for g in serverstats.gauges]
+    )
+
+    sourcestatstypes: ClassVar[Dict[str, str]] = {
+        "freq": "sourcestats/frequency_offset-freq",
+        "offset": "sourcestats/time_offset-offset",
+        "runs": "sourcestats/count-runs",
+        "samples": "sourcestats/count-samples",
+        "skew": "sourcestats/frequency_offset-skew",
+        "span": "sourcestats/duration-span",
+        "stdev": "sourcestats/time_offset-stdev",
+    }
 
     summarytypes: ClassVar[Dict[str, str]] = {
         "frequency": "frequency/frequency_offset",
@@ -72,18 +208,53 @@ class Output:
         "sysoffset": "sysoffset/time_offset",
     }
 
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        """Send the metrics of one of the busiest clients of the NTP server."""
+        pass
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        """Send the summary statistics of the clients of the NTP server."""
+        pass
+
     def send_info(self, metrics: dict, debug: bool = False) -> None:
         pass
 
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        """Send the packet and timestamping counter rates of one association."""
+        pass
+
     def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
         pass
 
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        pass
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        """Send the cumulative count of each type of peer change event."""
+        pass
+
     def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
         pass
 
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        """Send the state of one source as reported by chronyc sources or ntpq -p."""
+        pass
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        """Send the rates of the NTP server's request counters, and its other statistics."""
+        pass
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        """Send the statistics of one source as reported by chronyc sourcestats."""
+        pass
+
     def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
         pass
 
+    def flush(self) -> None:
+        """Deliver any buffered data; called at the end of each unit of work and periodically."""
+        pass
+
 
 class CollectdOutput(Output):
     def __init__(self, args: argparse.Namespace) -> None:
@@ -91,28 +262,162 @@ class CollectdOutput(Output):
 
     formatstr: ClassVar[str] = 'PUTVAL "%s/ntpmon-%s" interval=%d N:%.9f'
 
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.clienttypes, hostname=metrics["client"], debug=debug)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.clientstatstypes, debug=debug)
+
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.ntpdatatypes, hostname=metrics["source"], debug=debug)
+
     def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
         self.send_stats(metrics, self.peertypes, debug=debug)
 
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        severity = event_severity(metrics)
+        self.notify(self.args.hostname, metrics["event"], severity, event_message(metrics), metrics["timestamp_ns"])
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.eventtypes, debug=debug)
+
     def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
         self.send_stats(metrics, self.peerstatstypes, hostname=metrics["source"], debug=debug)
 
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.sourcetypes, hostname=metrics["source"], debug=debug)
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.serverstatstypes, debug=debug)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(metrics, self.sourcestatstypes, hostname=metrics["source"], debug=debug)
+
+    def notify(self, hostname: str, event: str, severity: str, message: str, timestamp_ns: int) -> None:
+        print(
+            'PUTNOTIF host=%s plugin=ntpmon plugin_instance=events type=%s severity=%s time=%d message="%s"'
+            % (hostname, event, severity, timestamp_ns // 1_000_000_000, message)
+        )
+
+    def putval(self, hostname: str, typename: str, value: float, timestamp_ns: int) -> None:
+        print(self.formatstr % (hostname, typename, self.args.interval, value))
+
     def send_stats(self, metrics: dict, types: dict, debug: bool = False, hostname: str = None) -> None:
         if hostname is None:
             hostname = self.args.hostname
+        timestamp_ns = metrics.get("timestamp_ns")
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
         for metric in sorted(types.keys()):
             if metric in metrics and types[metric] is not None:
-                print(self.formatstr % (hostname, types[metric], self.args.interval, metrics[metric]))
+                self.putval(hostname, types[metric], metrics[metric], timestamp_ns)
 
     def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
         self.send_stats(metrics, self.summarytypes, debug=debug)
 
 
+class CollectdNetworkOutput(CollectdOutput):
+    """Send values directly to a collectd network listener using its binary
+    protocol, with the timestamp at which each was measured."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(args)
+        size = args.datagram_size or collectd_network.DEFAULT_PACKET_SIZE
+        self.builder = collectd_network.PacketBuilder("ntpmon", args.interval, max_size=size)
+        (host, port) = transport.parse_connect(args.connect or "127.0.0.1:25826")
+        self.transport = transport.DatagramTransport(socket.AF_INET, (host, port), size)
+
+    def flush(self) -> None:
+        self.send_packets(self.builder.flush())
+
+    def notify(self, hostname: str, event: str, severity: str, message: str, timestamp_ns: int) -> None:
+        if self.args.debug:
+            super().notify(hostname, event, severity, message, timestamp_ns)
+        else:
+            packet = collectd_network.notification(hostname, "ntpmon", "events", event, severity, message, timestamp_ns)
+            self.send_packets([packet])
+
+    def putval(self, hostname: str, typename: str, value: float, timestamp_ns: int) -> None:
+        if self.args.debug:
+            super().putval(hostname, typename, value, timestamp_ns)
+        else:
+            self.send_packets(self.builder.add(hostname, typename, value, timestamp_ns))
+
+    def send_packets(self, packets: List[bytes]) -> None:
+        for packet in packets:
+            self.transport.send_packet(packet, 1)
+
+
+class GraphiteOutput(CollectdOutput):
+    """Send values to carbon using the same names as collectd's write_graphite
+    plugin, over a persistent TCP connection using either the plaintext or the
+    pickle protocol."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(args)
+        self.pickle = args.graphite_protocol == "pickle"
+        self.datapoints: List[Tuple[str, Tuple[int, float]]] = []
+        self.hosts: Dict[str, str] = {}
+        self.paths: Dict[Tuple[str, str], str] = {}
+        self.transport = None
+        if not args.debug:
+            default = "127.0.0.1:2004" if self.pickle else "127.0.0.1:2003"
+            (host, port) = transport.parse_connect(args.connect or default)
+            self.transport = transport.StreamTransport(
+                host,
+                port,
+                max_lines=args.queue_lines,
+                # pickled batches are not line-oriented, so they cannot be spilled
+                spill=None if self.pickle else get_spill_journal(args, "graphite"),
+                replay_rate=args.spill_replay_rate,
+            )
+
+    def escape(self, hostname: str) -> str:
+        """Replace characters which are significant in graphite paths, as write_graphite does."""
+        if hostname not in self.hosts:
+            self.hosts[hostname] = re.sub(r"[.\s:]", "_", hostname)
+        return self.hosts[hostname]
+
+    def flush(self) -> None:
+        if len(self.datapoints) == 0:
+            return
+        if self.pickle and self.transport is not None:
+            payload = pickle.dumps(self.datapoints, protocol=2)
+            data = struct.pack("!L", len(payload)) + payload
+        else:
+            data = "".join(f"{path} {value} {ts}\n" for (path, (ts, value)) in self.datapoints).encode()
+        if self.transport is None:
+            sys.stdout.write(data.decode())
+        else:
+            self.transport.send(data, len(self.datapoints))
+        self.datapoints = []
+
+    def notify(self, hostname: str, event: str, severity: str, message: str, timestamp_ns: int) -> None:
+        # carbon has no notion of events, so only their counts are sent
+        pass
+
+    def path(self, hostname: str, typename: str) -> str:
+        key = (hostname, typename)
+        if key not in self.paths:
+            (plugin_instance, type_name, type_instance) = collectd_network.split_type(typename)
+            path = f"{self.args.graphite_prefix}{self.escape(hostname)}.ntpmon-{plugin_instance}.{type_name}"
+            if type_instance:
+                path += "-" + type_instance
+            self.paths[key] = path
+        return self.paths[key]
+
+    def putval(self, hostname: str, typename: str, value: float, timestamp_ns: int) -> None:
+        self.datapoints.append((self.path(hostname, typename), (timestamp_ns // 1_000_000_000, float(value))))
+        if len(self.datapoints) >= self.args.batch_lines:
+            self.flush()
+
+
 class PrometheusOutput(Output):
     def __init__(self, args: argparse.Namespace) -> None:
         self.prometheus_objs = {}
         import prometheus_client
 
+        self.registry = prometheus_client.REGISTRY
         prometheus_client.start_http_server(addr=args.listen_address, port=args.port)
 
     infolabels: ClassVar[List[str]] = [
@@ -140,11 +445,26 @@ class PrometheusOutput(Output):
         "ntpmon_vms": "virtual_memory_size",
     }
 
+    ntpdatalabels: ClassVar[List[str]] = [
+        "peertype",
+        "rx_timestamping",
+        "selection",
+        "source",
+        "tx_timestamping",
+    ]
+
+    ntpdatatypes: ClassVar[Dict[str, Tuple[str, str, str]]] = dict(
+        [(c + "_rate", (None, "_per_second", "Rate of " + c.replace("_", " "))) for c in ntpdata.counters]
+        + [(f, ("i", None, "Whether this association is " + f)) for f in ntpdata.flags]
+        + [("response_time", (None, "_seconds", "Time taken by this source to respond to the last request"))]
+    )
+
     peerstatslabels: ClassVar[List[str]] = [
         "mode",
         "peertype",
         "refid",
         "rx_timestamp",
+        "selection",
         "source",
         "tx_timestamp",
     ]
@@ -179,6 +499,72 @@ class PrometheusOutput(Output):
         "sync_loop": ("i", None, "Whether a synchronization loop has been detected for this peer"),
         "synchronized": ("i", None, "Whether the peer reports as synchronized"),
     }
+    peerstatstypes.update(aggregate_prometheus_types(peerstatstypes))
+
+    clientbuckettypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
+        "dropped": ("i", None, "Number of clients with no more than le packets dropped"),
+        "interval": ("i", None, "Number of clients with an average interval between packets of no more than le seconds"),
+    }
+
+    clienttypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
+        "dropped": ("i", "_packets", "NTP packets from this client dropped by rate limiting"),
+        "interval": (None, "_seconds", "Average interval between NTP packets from this client"),
+        "last": ("i", "_seconds", "Time since the last NTP packet from this client"),
+        "packets": ("i", None, "NTP packets received from this client"),
+        "rank": ("i", None, "Rank of this client by NTP packets received"),
+    }
+
+    clientstatstypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
+        "count": ("i", None, "Number of clients known to the NTP server"),
+        "distinct": ("i", None, "Estimated number of distinct client addresses known to the NTP server"),
+        "distinct_seen": ("i", None, "Estimated number of distinct client addresses seen since ntpmon started"),
+        "limited": ("i", None, "Number of clients which have been rate limited"),
+        "ntp_dropped": ("i", "_packets", "NTP packets from known clients dropped by rate limiting"),
+        "ntp_packets": ("i", None, "NTP packets received from known clients"),
+    }
+
+    sourcelabels: ClassVar[List[str]] = [
+        "peertype",
+        "selection",
+        "source",
+    ]
+
+    sourcetypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
+        "authenticated": ("i", None, "Whether this source is authenticated"),
+        "delay": (None, "_seconds", "Network round trip delay to this source"),
+        "error": (None, "_seconds", "Estimated error bound of this source's offset"),
+        "interval_hi": (None, "_seconds", "Upper endpoint of the interval expected to contain the true offset"),
+        "interval_lo": (None, "_seconds", "Lower endpoint of the interval expected to contain the true offset"),
+        "jitter": (None, "_seconds", "RMS average of this source's offset differences"),
+        "last_sample": ("i", "_seconds", "Time since the last sample of this source"),
+        "moffset": (None, "_seconds", "Offset of this source in its most recent measurement"),
+        "noselect": ("i", None, "Whether this source is effectively configured with the noselect option"),
+        "offset": (None, "_seconds", "Offset of this source, adjusted for clock changes since its last measurement"),
+        "poll": (None, "_seconds", "Interval at which this source is polled"),
+        "prefer": ("i", None, "Whether this source is effectively configured with the prefer option"),
+        "reach": ("%", "_ratio", "Reachability of this source over the last 8 polls"),
+        "reach_register": ("i", None, "Reachability register of this source, with the most recent poll in bit 0"),
+        "require": ("i", None, "Whether this source is effectively configured with the require option"),
+        "score": (None, None, "Score of this source against the best source"),
+        "stratum": ("i", None, "The stratum reported by this source"),
+        "trust": ("i", None, "Whether this source is effectively configured with the trust option"),
+        "when": (None, "_seconds", "Time since this source was last polled"),
+    }
+
+    serverstatstypes: ClassVar[Dict[str, Tuple[str, str, str]]] = dict(
+        [(c + "_rate", (None, "_per_second", "Rate of " + c.replace("_", " "))) for c in serverstats.counters]
+        + [(g, (None, None, g.replace("_", " ").capitalize())) for g in serverstats.gauges]
+    )
+
+    sourcestatstypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
+        "freq": (None, "_ppm", "Estimated residual frequency of this source"),
+        "offset": (None, "_seconds", "Estimated offset of this source"),
+        "runs": ("i", None, "Number of runs of residuals with the same sign following the last regression"),
+        "samples": ("i", None, "Number of sample points retained for this source"),
+        "skew": (None, "_ppm", "Estimated error bounds of the frequency of this source"),
+        "span": ("i", "_seconds", "Interval between the oldest and newest samples of this source"),
+        "stdev": (None, "_seconds", "Estimated sample standard deviation of this source"),
+    }
 
     summarystatstypes: ClassVar[Dict[str, Tuple[str, str, str]]] = {
         "frequency": (None, "_hertz", "Frequency error of the local clock"),
@@ -192,6 +578,19 @@ class PrometheusOutput(Output):
         "sysoffset": (None, "_seconds", "Current clock offset of selected system peer"),
     }
 
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats("ntpmon_client", metrics, self.clienttypes, ["client"], [metrics["client"]], debug=debug)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats("ntpmon_clients", metrics, self.clientstatstypes, debug=debug)
+        # each histogram bucket is a series labelled with its upper bound
+        for h, bounds in clients.histograms.items():
+            for b in bounds:
+                name = clients.bucketname(h, b)
+                if name in metrics:
+                    bucket = {h: metrics[name], "timestamp_ns": metrics.get("timestamp_ns")}
+                    self.send_stats("ntpmon_clients_by", bucket, self.clientbuckettypes, ["le"], [str(b)], debug=debug)
+
     def send_info(self, metrics: dict, debug: bool = False) -> None:
         # rewrite info metric names for prometheus
         for i in self.info_rewrites:
@@ -208,6 +607,16 @@ class PrometheusOutput(Output):
             debug=debug,
         )
 
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(
+            "ntpmon_ntpdata",
+            metrics,
+            self.ntpdatatypes,
+            [x for x in self.ntpdatalabels if x in metrics],
+            [metrics[x] for x in self.ntpdatalabels if x in metrics],
+            debug=debug,
+        )
+
     def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
         for metric in sorted(self.peertypes.keys()):
             if metric in metrics:
@@ -221,6 +630,19 @@ class PrometheusOutput(Output):
                     debug=debug,
                 )
 
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        for event in sorted(self.eventtypes.keys()):
+            if event in metrics:
+                self.set_prometheus_metric(
+                    "ntpmon_peer_events",
+                    "Number of peer change events since ntpmon started",
+                    metrics[event],
+                    "%d",
+                    labelnames=["event"],
+                    labels=[event],
+                    debug=debug,
+                )
+
     def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
         self.send_stats(
             "ntpmon_peer",
@@ -231,6 +653,29 @@ class PrometheusOutput(Output):
             debug=debug,
         )
 
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(
+            "ntpmon_source",
+            metrics,
+            self.sourcetypes,
+            [x for x in self.sourcelabels if x in metrics],
+            [metrics[x] for x in self.sourcelabels if x in metrics],
+            debug=debug,
+        )
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats("ntpmon_server", metrics, self.serverstatstypes, debug=debug)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send_stats(
+            "ntpmon_sourcestats",
+            metrics,
+            self.sourcestatstypes,
+            [x for x in self.sourcelabels if x in metrics],
+            [metrics[x] for x in self.sourcelabels if x in metrics],
+            debug=debug,
+        )
+
     def send_stats(
         self,
         prefix: str,
@@ -280,7 +725,7 @@ class PrometheusOutput(Output):
             return
 
         if name not in self.prometheus_objs:
-            g = prometheus_client.Gauge(name, description, labelnames)
+            g = prometheus_client.Gauge(name, description, labelnames, registry=self.registry)
             self.prometheus_objs[name] = g
         else:
             g = self.prometheus_objs[name]
@@ -291,64 +736,559 @@ class PrometheusOutput(Output):
         g.set(value)
 
 
+class RemoteWriteOutput(PrometheusOutput):
+    """Push samples to a prometheus remote write receiver, keeping the time at
+    which each was measured rather than the time at which it was scraped."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.batch = remote_write.WriteBatch()
+        self.timestamp_ns = None
+        self.transport = None
+        if not args.debug:
+            self.transport = httppush.HTTPTransport(
+                args.url or "http://127.0.0.1:9090/api/v1/write",
+                remote_write.headers,
+                compress=snappy_codec.compress,
+                encoding="snappy",
+                max_lines=args.queue_lines,
+                spill=get_spill_journal(args, "remote_write"),
+                replay_rate=getattr(args, "spill_replay_rate", 65536),
+            )
+
+    def flush(self) -> None:
+        if self.batch.empty():
+            return
+        if self.transport is None:
+            print(self.batch.text())
+        else:
+            samples = self.batch.samples
+            self.transport.send(self.batch.encode(), samples)
+
+    def send_stats(self, prefix: str, metrics: dict, *args, **kwargs) -> None:
+        self.timestamp_ns = metrics.get("timestamp_ns")
+        try:
+            super().send_stats(prefix, metrics, *args, **kwargs)
+        finally:
+            self.timestamp_ns = None
+
+    def set_prometheus_metric(
+        self,
+        name: str,
+        description: str,
+        value: float,
+        fmt: str,
+        labelnames: List[str],
+        labels: List[str],
+        debug: bool = False,
+    ) -> None:
+        timestamp_ns = self.timestamp_ns or time.time_ns()
+        self.batch.add(name, dict(zip(labelnames, labels)), value, timestamp_ns)
+        if self.batch.samples >= self.args.batch_lines:
+            self.flush()
+
+
+class TextfileOutput(PrometheusOutput):
+    """Write metrics to a file for the node_exporter textfile collector,
+    rather than serving them over HTTP."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.prometheus_objs = {}
+        import prometheus_client
+
+        self.registry = prometheus_client.CollectorRegistry()
+        self.path = os.path.join(args.textfile_dir, "ntpmon.prom")
+        self.changed = False
+        self.digest = None
+
+    def flush(self) -> None:
+        """Replace the file if any metrics have been set and its content has changed."""
+        if not self.changed:
+            return
+        self.changed = False
+        import prometheus_client
+
+        content = prometheus_client.generate_latest(self.registry)
+        digest = hashlib.sha256(content).digest()
+        if digest == self.digest:
+            return
+        # node_exporter ignores files without the .prom suffix, and the rename
+        # ensures that it never sees a partially written file
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, self.path)
+        self.digest = digest
+
+    def set_prometheus_metric(self, *args, **kwargs) -> None:
+        super().set_prometheus_metric(*args, **kwargs)
+        self.changed = True
+
+
 class TelegrafOutput(Output):
     def __init__(self, args: argparse.Namespace) -> None:
         super().__init__()
         self.args = args
-        self.set_file()
-
-    @staticmethod
-    def get_telegraf_file(connect: str) -> TextIOWrapper:
-        """Return a TextIOWrapper for writing data to telegraf"""
-        (host, port) = connect.split(":")
-        port = int(port)
-        s = socket.socket()
-        s.connect((host, port))
-        return s.makefile(mode="w")
-
-    def send(self, name: str, metrics: dict, tries: int = 0) -> None:
-        telegraf_line = line_protocol.to_line_protocol(metrics, name)
-        if tries >= 5:
-            print("Reached maximum retries on telegraf connection", file=sys.stderr)
-            print(telegraf_line)
-            sys.exit(3)
-        try:
-            print(telegraf_line, file=self.file)
-        except BrokenPipeError as bpe:
-            # If we have lost our connection to telegraf, wait a little, then
-            # reopen the socket and try again.
-            time.sleep(0.1)
-            self.set_file()
-            self.send(name, metrics, tries + 1)
+        self.encoder = line_protocol.Encoder()
+        self.writer = BatchWriter(self.write, max_lines=args.batch_lines, max_bytes=args.batch_bytes)
+        self.transport = None if args.debug else self.get_transport(args)
+
+    def flush(self) -> None:
+        self.writer.flush()
+
+    def get_transport(self, args: argparse.Namespace):
+        return get_transport(args)
+
+    def send(self, name: str, metrics: dict) -> None:
+        self.writer.write(self.encoder.encode(metrics, name))
+
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_client", metrics)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_clients", metrics)
 
     def send_info(self, metrics: dict, debug: bool) -> None:
+        metrics.update(self.writer.getmetrics())
+        if self.transport is not None:
+            metrics.update(self.transport.getmetrics())
         self.send("ntpmon_info", metrics)
 
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_ntpdata", metrics)
+
     def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
         for metric in sorted(self.peertypes.keys()):
+            if metric not in metrics:
+                continue
             telegraf_metrics = {
                 "count": metrics[metric],
                 "peertype": metric,
             }
             self.send("ntpmon_peers", telegraf_metrics)
 
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_peer_event", metrics)
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        for event in sorted(self.eventtypes.keys()):
+            if event in metrics:
+                self.send("ntpmon_peer_events", {"count": metrics[event], "event": event})
+
     def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
         self.send("ntpmon_peer", metrics)
 
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_source", metrics)
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_server", metrics)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.send("ntpmon_sourcestats", metrics)
+
     def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
         telegraf_metrics = {k: metrics[k] for k in sorted(self.summarytypes.keys()) if k in metrics}
-        self.send("ntpmon", telegraf_metrics)
+        if telegraf_metrics:
+            self.send("ntpmon", telegraf_metrics)
+
+    def write(self, data: bytes) -> None:
+        """Hand a batch of lines to the transport, or print them in debug mode."""
+        if self.transport is None:
+            sys.stdout.write(data.decode())
+            sys.stdout.flush()
+        else:
+            self.transport.send(data, data.count(b"\n"))
+
+
+class ExecdOutput(TelegrafOutput):
+    """Write line protocol to standard output for telegraf's execd input plugin."""
+
+    def get_transport(self, args: argparse.Namespace) -> None:
+        return None
+
+
+class InfluxDBOutput(TelegrafOutput):
+    """Write line protocol directly to the InfluxDB v2 HTTP API, without telegraf."""
+
+    def get_transport(self, args: argparse.Namespace) -> httppush.HTTPTransport:
+        query = urllib.parse.urlencode({"org": args.org, "bucket": args.bucket, "precision": "ns"})
+        headers = {"Content-Type": "text/plain; charset=utf-8"}
+        token = os.environ.get("INFLUX_TOKEN")
+        if token:
+            headers["Authorization"] = "Token " + token
+        url = args.url or "http://127.0.0.1:8086"
+        return httppush.HTTPTransport(
+            url.rstrip("/") + "/api/v2/write?" + query,
+            headers,
+            max_lines=args.queue_lines,
+            spill=get_spill_journal(args, "influxdb"),
+            replay_rate=getattr(args, "spill_replay_rate", 65536),
+        )
+
+
+class OTLPOutput(Output):
+    """Export metrics to an OpenTelemetry collector using OTLP/HTTP, with one
+    export request per flush."""
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.batch = otlp.MetricsBatch()
+        self.json = args.debug or args.otlp_encoding == "json"
+        self.resource = {
+            "host.name": args.hostname,
+            "service.name": "ntpmon",
+            "service.version": version.get_version(),
+        }
+        self.scope = {"name": "ntpmon", "version": version.get_version()}
+        self.transport = None
+        if not args.debug:
+            content_type = "application/json" if self.json else "application/x-protobuf"
+            self.transport = httppush.HTTPTransport(
+                args.url or "http://127.0.0.1:4318/v1/metrics",
+                {"Content-Type": content_type},
+                max_lines=args.queue_lines,
+                spill=get_spill_journal(args, "otlp"),
+                replay_rate=getattr(args, "spill_replay_rate", 65536),
+            )
+
+    def flush(self) -> None:
+        if self.batch.empty():
+            return
+        points = self.batch.points
+        data = self.batch.encode(self.resource, self.scope, self.json)
+        if self.transport is None:
+            print(data.decode())
+        else:
+            self.transport.send(data, points)
+
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_client", metrics)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_clients", metrics)
+
+    def send_info(self, metrics: dict, debug: bool = False) -> None:
+        if self.transport is not None:
+            metrics.update(self.transport.getmetrics())
+        self.batch.add("ntpmon_info", metrics)
+
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_ntpdata", metrics)
+
+    def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
+        for metric in sorted(self.peertypes.keys()):
+            if metric in metrics:
+                self.batch.add("ntpmon_peers", {"count": metrics[metric], "peertype": metric})
+
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_peer_event", metrics)
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        for event in sorted(self.eventtypes.keys()):
+            if event in metrics:
+                self.batch.add("ntpmon_peer_events", {"count": metrics[event], "event": event})
+
+    def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_peer", metrics)
+
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_source", metrics)
 
-    def set_file(self) -> None:
-        self.file = sys.stdout if self.args.debug else self.get_telegraf_file(self.args.connect)
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_server", metrics)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.batch.add("ntpmon_sourcestats", metrics)
+
+    def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
+        summary = {k: metrics[k] for k in sorted(self.summarytypes.keys()) if k in metrics}
+        if summary:
+            self.batch.add("ntpmon", summary)
+
+
+def event_message(metrics: dict) -> str:
+    """Describe a peer change event for outputs which report events as text."""
+    if metrics["event"] == "sync_changed":
+        return f"sync peer changed from {metrics['old_source']} to {metrics['source']}"
+    if metrics["event"] == "reach_lost":
+        return f"peer {metrics['source']} ({metrics['peertype']}) did not respond to the most recent poll"
+    return f"peer {metrics['source']} {metrics['event'].replace('_', ' ')}: {metrics['old_peertype']} -> {metrics['peertype']}"
+
+
+def event_severity(metrics: dict) -> str:
+    """Return "warning" for events which indicate a peer has become unavailable or unusable, and "okay" otherwise."""
+    if metrics["event"] in ("reach_lost", "removed"):
+        return "warning"
+    if metrics["event"] == "added" or metrics["peertype"] in ("pps", "survivor", "sync"):
+        return "okay"
+    return "warning"
+
+
+def get_spill_journal(args: argparse.Namespace, mode: str) -> SpillJournal:
+    """Return the spill journal for the given mode's undeliverable output, or None
+    if one is not configured.  Each mode has its own subdirectory, since the
+    modes' records are not interchangeable."""
+    if getattr(args, "spill_dir", None) is None:
+        return None
+    return SpillJournal(os.path.join(args.spill_dir, mode), max_bytes=args.spill_max_bytes)
+
+
+def get_transport(args: argparse.Namespace, mode: str = "telegraf"):
+    """Return a transport for the connect URL in args, spilling undeliverable output to the given mode's journal."""
+    (scheme, address) = transport.parse_url(args.connect or "127.0.0.1:8094")
+    if scheme == "udp":
+        return transport.DatagramTransport(socket.AF_INET, transport.parse_connect(address), args.datagram_size or 1400)
+    elif scheme == "unixgram":
+        return transport.DatagramTransport(socket.AF_UNIX, address, args.datagram_size or 65536)
+
+    kwargs = {
+        "max_lines": args.queue_lines,
+        "spill": get_spill_journal(args, mode),
+        "replay_rate": args.spill_replay_rate,
+    }
+    if scheme == "unix":
+        return transport.UnixStreamTransport(address, **kwargs)
+    else:
+        (host, port) = transport.parse_connect(address)
+        return transport.StreamTransport(host, port, **kwargs)
+
+
+class FanoutOutput(Output):
+    """Send the same data to several outputs.  Each output has its own bounded
+    queue and worker task, so an output which falls behind (or fails) only
+    loses its own data: when its queue is full, its oldest pending update is
+    dropped."""
+
+    def __init__(self, sinks: Dict[str, Output], queue_size: int = 1000) -> None:
+        self.sinks = sinks
+        self.queue_size = queue_size
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.dropped = {name: 0 for name in sinks}
+        self.workers = []
+
+    def start(self) -> None:
+        """Start the worker tasks if they are not already running."""
+        if len(self.workers) == 0:
+            for name in self.sinks:
+                self.queues[name] = asyncio.Queue(maxsize=self.queue_size)
+                self.workers.append(asyncio.get_running_loop().create_task(self.run(name), name=f"output-{name}"))
+
+    def enqueue(self, method: str, metrics: dict = None, debug: bool = False) -> None:
+        self.start()
+        for name, queue in self.queues.items():
+            if queue.full():
+                queue.get_nowait()
+                self.dropped[name] += 1
+            # outputs may modify the metrics they are given, so each needs its own copy
+            queue.put_nowait((method, None if metrics is None else dict(metrics), debug))
+
+    async def run(self, name: str) -> None:
+        sink = self.sinks[name]
+        queue = self.queues[name]
+        while True:
+            (method, metrics, debug) = await queue.get()
+            try:
+                if metrics is None:
+                    getattr(sink, method)()
+                else:
+                    getattr(sink, method)(metrics, debug=debug)
+            except Exception as e:
+                print(f"Output {name} failed in {method}: {e}", file=sys.stderr)
+            # give the other outputs a turn
+            await asyncio.sleep(0)
+
+    def flush(self) -> None:
+        self.enqueue("flush")
+
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_client", metrics, debug)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_client_stats", metrics, debug)
+
+    def send_info(self, metrics: dict, debug: bool = False) -> None:
+        for name in self.sinks:
+            metrics[f"output_{line_protocol.transform_identifier(name)}_dropped"] = self.dropped[name]
+            metrics[f"output_{line_protocol.transform_identifier(name)}_queued"] = (
+                self.queues[name].qsize() if name in self.queues else 0
+            )
+        self.enqueue("send_info", metrics, debug)
+
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_ntpdata", metrics, debug)
+
+    def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_peer_counts", metrics, debug)
+
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_peer_event", metrics, debug)
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_peer_events", metrics, debug)
+
+    def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_peer_measurements", metrics, debug)
+
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_peer_source", metrics, debug)
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_server_stats", metrics, debug)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_source_stats", metrics, debug)
+
+    def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.enqueue("send_summary_stats", metrics, debug)
+
+
+class DeltaOutput(Output):
+    """Pass on only those info, summary, peer count, event count, source,
+    client, and association metrics which have changed since they were last
+    sent, but send each at least once every heartbeat intervals.  Float values
+    are considered unchanged if they differ from the last value sent by no more
+    than the deadband (as a fraction of that value).  String values are treated
+    as labels and always passed on with any changed metrics.  Peer measurements
+    and events are always passed on."""
+
+    def __init__(self, output: Output, heartbeat: int, deadband: float = 0.0) -> None:
+        self.output = output
+        self.heartbeat = heartbeat
+        self.deadband = deadband
+        self.last: Dict[Tuple[str, str], object] = {}
+        self.skipped: Dict[Tuple[str, str], int] = {}
+
+    def changed(self, series: Tuple[str, str], value) -> bool:
+        """Return True if the value should be sent, recording it as the last value sent if so."""
+        skipped = self.skipped.get(series, 0)
+        if series in self.last and skipped + 1 < self.heartbeat and self.same(self.last[series], value):
+            self.skipped[series] = skipped + 1
+            return False
+        self.last[series] = value
+        self.skipped[series] = 0
+        return True
+
+    def same(self, last, value) -> bool:
+        if type(value) == float and type(last) == float:
+            if math.isnan(value) or math.isnan(last):
+                # NaN never equals itself, but an unchanged NaN is still unchanged
+                return math.isnan(value) and math.isnan(last)
+            if self.deadband:
+                return abs(value - last) <= self.deadband * abs(last)
+        return value == last
+
+    def filter(self, which: str, metrics: dict) -> dict:
+        """Return the metrics which should be sent, or None if there are none."""
+        result = {}
+        send = False
+        for k, v in metrics.items():
+            if type(v) not in (bool, float, int) or k in line_protocol.exclude_fields:
+                result[k] = v
+            elif self.changed((which, k), v):
+                result[k] = v
+                send = True
+        return result if send else None
+
+    def flush(self) -> None:
+        self.output.flush()
+
+    def send_client(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("client " + metrics["client"], metrics)
+        if metrics is not None:
+            self.output.send_client(metrics, debug)
+
+    def send_client_stats(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("clients", metrics)
+        if metrics is not None:
+            self.output.send_client_stats(metrics, debug)
+
+    def send_info(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("info", metrics)
+        if metrics is not None:
+            self.output.send_info(metrics, debug)
+
+    def send_ntpdata(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("ntpdata " + metrics["source"], metrics)
+        if metrics is not None:
+            self.output.send_ntpdata(metrics, debug)
+
+    def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("peers", {k: metrics[k] for k in self.peertypes if k in metrics})
+        if metrics is not None:
+            self.output.send_peer_counts(metrics, debug)
+
+    def send_peer_event(self, metrics: dict, debug: bool = False) -> None:
+        self.output.send_peer_event(metrics, debug)
+
+    def send_peer_events(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("events", {k: metrics[k] for k in self.eventtypes if k in metrics})
+        if metrics is not None:
+            self.output.send_peer_events(metrics, debug)
+
+    def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
+        self.output.send_peer_measurements(metrics, debug)
+
+    def send_peer_source(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("source " + metrics["source"], metrics)
+        if metrics is not None:
+            self.output.send_peer_source(metrics, debug)
+
+    def send_server_stats(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("server", metrics)
+        if metrics is not None:
+            self.output.send_server_stats(metrics, debug)
+
+    def send_source_stats(self, metrics: dict, debug: bool = False) -> None:
+        metrics = self.filter("sourcestats " + metrics["source"], metrics)
+        if metrics is not None:
+            self.output.send_source_stats(metrics, debug)
+
+    def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
+        # only the summary metrics are sent by the outputs, so changes in the others (e.g. alert metrics) are ignored
+        relevant = {k: v for (k, v) in metrics.items() if k in self.summarytypes or k in line_protocol.exclude_fields}
+        metrics = self.filter("summary", relevant)
+        if metrics is not None:
+            self.output.send_summary_stats(metrics, debug)
 
 
 def get_output(args: argparse.Namespace) -> Output:
-    if args.mode == "collectd":
+    """Return the output for the selected mode, or a fan-out output if more than one mode was selected,
+    suppressing unchanged metrics if a heartbeat is configured."""
+    if not isinstance(args.mode, list):
+        output = create_output(args, args.mode)
+    else:
+        modes = list(dict.fromkeys(args.mode))
+        if len(modes) == 1:
+            output = create_output(args, modes[0])
+        else:
+            output = FanoutOutput({mode: create_output(args, mode) for mode in modes}, queue_size=args.output_queue_size)
+    heartbeat = getattr(args, "heartbeat", 0)
+    if heartbeat:
+        output = DeltaOutput(output, heartbeat, args.deadband)
+    return output
+
+
+def create_output(args: argparse.Namespace, mode: str) -> Output:
+    if mode == "collectd":
         return CollectdOutput(args)
-    elif args.mode == "prometheus":
+    elif mode == "collectd-network":
+        return CollectdNetworkOutput(args)
+    elif mode == "prometheus":
         return PrometheusOutput(args)
-    elif args.mode == "telegraf":
+    elif mode == "telegraf":
         return TelegrafOutput(args)
+    elif mode == "textfile":
+        return TextfileOutput(args)
+    elif mode == "execd":
+        return ExecdOutput(args)
+    elif mode == "graphite":
+        return GraphiteOutput(args)
+    elif mode == "influxdb":
+        return InfluxDBOutput(args)
+    elif mode == "otlp":
+        return OTLPOutput(args)
+    elif mode == "remote_write":
+        return RemoteWriteOutput(args)
     else:
         raise ValueError("Unknown output mode")
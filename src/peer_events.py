@@ -0,0 +1,85 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Compare successive snapshots of the peers and report what changed between them.
+"""
+
+import time
+
+from typing import Dict, List
+
+from peers import PeerTable
+
+# The event types reported, each of which is also counted
+events = ["added", "reach_lost", "removed", "state_changed", "sync_changed"]
+
+
+class PeerDiffer:
+    """Keep the state of each peer from the previous snapshot, and return
+    change events for the peers which differ in the next.  The first snapshot
+    only establishes the baseline, so restarting ntpmon does not report every
+    peer as added.  The counts of each event type are cumulative."""
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, int] = {e: 0 for e in events}
+        self.previous: PeerTable = None
+        self.state: Dict[str, tuple] = {}
+        self.sync: str = None
+
+    def event(self, event: str, source: str, old: tuple, new: tuple, timestamp_ns: int) -> dict:
+        self.counts[event] += 1
+        return {
+            "event": event,
+            "source": source,
+            "old_peertype": old[0] if old else "none",
+            "peertype": new[0] if new else "none",
+            "old_reach": old[2] if old else 0.0,
+            "reach": new[2] if new else 0.0,
+            "timestamp_ns": timestamp_ns,
+        }
+
+    def unchanged(self, table: PeerTable) -> bool:
+        """Return True if the table is identical to the previous one, without examining individual peers."""
+        previous = self.previous
+        return (
+            previous is not None
+            and previous.masks == table.masks
+            and previous.registers == table.registers
+            and previous.addresses == table.addresses
+        )
+
+    def update(self, table: PeerTable, timestamp_ns: int = None) -> List[dict]:
+        """Return the events which happened between the previous table and this one."""
+        if self.unchanged(table):
+            return []
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        reach = table.columns["reach"]
+        state = {address: (table.peertype(row), table.registers[row], reach[row]) for (address, row) in table.index().items()}
+        sync = table.first("sync")
+        result = []
+        if self.previous is not None:
+            for address, new in state.items():
+                old = self.state.get(address)
+                if old is None:
+                    result.append(self.event("added", address, old, new, timestamp_ns))
+                    continue
+                if old[0] != new[0]:
+                    result.append(self.event("state_changed", address, old, new, timestamp_ns))
+                # the least significant bit of the register records whether the most recent poll succeeded
+                if old[1] & 1 and not new[1] & 1:
+                    result.append(self.event("reach_lost", address, old, new, timestamp_ns))
+            for address, old in self.state.items():
+                if address not in state:
+                    result.append(self.event("removed", address, old, None, timestamp_ns))
+            if sync != self.sync:
+                # the peer types are those of the new sync peer, before and after
+                event = self.event("sync_changed", sync or "none", self.state.get(sync), state.get(sync), timestamp_ns)
+                event["old_source"] = self.sync or "none"
+                result.append(event)
+        self.previous = table
+        self.state = state
+        self.sync = sync
+        return result
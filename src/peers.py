@@ -7,11 +7,19 @@
 Parse 'ntpq -pn' or 'chronyc -c sources' output and extract metrics.
 """
 
+import array
 import math
 import re
 import statistics
 import sys
 
+from aggregator import Accumulator
+
+NAN = float("nan")
+
+# the reachability percentage of each 8-bit reachability register
+REACH = [bin(register).count("1") * 100 / 8 for register in range(256)]
+
 
 class NTPPeers:
     @staticmethod
@@ -112,7 +120,8 @@ class NTPPeers:
     def peerline(cls, line):
         """
         Return a list containing the peer type and the 10 peer fields,
-        if the line is a correctly-formatted peer line.
+        if the line is a correctly-formatted peer line.  Reference implementation
+        only; see parse().
         """
         if cls.isnoiseline(line):
             return None
@@ -319,6 +328,12 @@ class NTPPeers:
     def parse(cls, lines):
         """
         Return a dictionary of peers, parsed from the provided lines.
+
+        This is the original implementation, kept only as the reference against
+        which the unit tests and benchmarks/bench_peers.py check parsetable() and
+        parsefast(); ntpmon itself uses parsetable().  The same applies to
+        peerline(), isnoiseline(), chrony_peerline(), ntpd_peerline(),
+        appendpeer(), and the validate_*() methods, which only parse() uses.
         """
         peers = cls.newpeerdict()
         if isinstance(lines, str):
@@ -344,43 +359,303 @@ class NTPPeers:
             cls.appendpeer(peers, peer)
         return peers
 
+    # A single compiled search for all of the noise lines
+    noiseregex = re.compile("|".join(noiselines))
+
+    tallies = None
+
+    @classmethod
+    def tallytable(cls):
+        """
+        Return a list mapping each 8-bit tally code to its PeerTable type mask (0 if the code is unknown).
+        """
+        if cls.tallies is None:
+            cls.tallies = [PeerTable.typemask(cls.tallytotype(chr(i))) for i in range(256)]
+        return cls.tallies
+
+    @classmethod
+    def fastpeerline(cls, line, tallies, table):
+        """
+        Append the peer on the line to the PeerTable, returning False if the line is
+        not a valid peer line.  Equivalent to peerline(), but the fields are written
+        straight into the table's columns without building intermediate dicts.
+        """
+        fields = line.split(",")
+        if len(fields) == 10:
+            chrony = True
+            tally, address, stratum, when, poll, reach = fields[1], fields[2], fields[3], fields[6], fields[4], fields[5]
+        else:
+            fields = line[1:].split()
+            if len(fields) != 10 or fields[1] in cls.ignorerefids:
+                return False
+            chrony = False
+            tally, address, stratum, when, poll, reach = line[0], fields[0], fields[2], fields[4], fields[5], fields[6]
+
+        if len(tally) == 1 and ord(tally) < 256:
+            mask = tallies[ord(tally)]
+        else:
+            mask = PeerTable.typemask(cls.tallytotype(tally))
+        if mask == 0:
+            return False
+        try:
+            stratum = int(stratum)
+            if stratum < 0 or stratum > 15:
+                return False
+            if when.isdigit():
+                when = int(when)
+            else:
+                when = cls.time2seconds(when) if when != "-" else NAN
+            register = int(reach, 8)
+            reach = REACH[register] if register < 256 else bin(register).count("1") * 100 / 8
+            if chrony:
+                poll = 2.0 ** int(poll)
+                error = round(float(fields[9]), 6)
+                moffset = round(float(fields[7]), 6)
+                offset = round(float(fields[8]), 6)
+                mask |= PeerTable.CHRONY
+                table.addrow(mask, address, stratum, register, poll, when, NAN, error, NAN, moffset, offset, reach)
+            else:
+                poll = int(poll)
+                delay = round(float(fields[7]) / 1000.0, 6)
+                jitter = round(float(fields[9]) / 1000.0, 6)
+                offset = round(float(fields[8]) / 1000.0, 6)
+                table.addrow(mask, address, stratum, register, poll, when, delay, NAN, jitter, NAN, offset, reach)
+            return True
+        except (OverflowError, ValueError):
+            return False
+
+    @classmethod
+    def parsetable(cls, lines):
+        """
+        Return a PeerTable of the peers parsed from the provided lines, in a single pass over each line.
+        """
+        table = PeerTable()
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        noise = cls.noiseregex.search
+        tallies = cls.tallytable()
+        fastpeerline = cls.fastpeerline
+        for l in lines:
+            if noise(l) is not None:
+                continue
+            table.associations += 1
+            fastpeerline(l, tallies, table)
+        return table
+
+    @classmethod
+    def parsefast(cls, lines):
+        """
+        Return a dictionary of peers, parsed from the provided lines.  The result is
+        the same as parse(), but it is produced in a single pass over each line.
+        """
+        return cls.parsetable(lines).todict()
+
     def getmetrics(self, peers=None):
         """
         Return a set of metrics based on the data in peers.
-        If peers is None, use self.peers.
+        If peers is None, use the peers parsed when this object was created.
         """
         if peers is None:
-            peers = self.peers
+            accumulators = self.table.accumulate()
+        else:
+            accumulators = {}
+            for t in NTPPeers.peertypes:
+                accumulators[t] = (Accumulator(), Accumulator())
+                for x in peers[t]["offset"]:
+                    accumulators[t][0].add(x)
+                for x in peers[t]["reach"]:
+                    accumulators[t][1].add(x)
+
+        nan = float("nan")
         metrics = {}
         for t in NTPPeers.peertypes:
+            offset, reach = accumulators[t]
             # number of peers of this type
-            metrics[t] = len(peers[t]["address"])
+            metrics[t] = offset.count
 
             # offset of peers of this type
-            metrics[t + "-offset-mean"] = NTPPeers.getmean(peers[t]["offset"])
-            metrics[t + "-offset-stdev"] = NTPPeers.getstdev(peers[t]["offset"], metrics[t + "-offset-mean"])
-            metrics[t + "-offset-rms"] = NTPPeers.rms(peers[t]["offset"])
+            metrics[t + "-offset-mean"] = offset.mean if offset.count > 0 else nan
+            metrics[t + "-offset-stdev"] = offset.stddev() if offset.count > 0 else nan
+            metrics[t + "-offset-rms"] = offset.rms() if offset.count > 0 else nan
 
             # reachability of peers of this type
-            metrics[t + "-reach-mean"] = NTPPeers.getmean(peers[t]["reach"])
-            metrics[t + "-reach-stdev"] = NTPPeers.getstdev(peers[t]["reach"], metrics[t + "-reach-mean"])
+            metrics[t + "-reach-mean"] = reach.mean if reach.count > 0 else nan
+            metrics[t + "-reach-stdev"] = reach.stddev() if reach.count > 0 else nan
             # The rms of reachability is not very useful, because it's always positive
             # (so it should be very close to the mean), but we include it for completeness.
-            metrics[t + "-reach-rms"] = NTPPeers.rms(peers[t]["reach"])
+            metrics[t + "-reach-rms"] = reach.rms() if reach.count > 0 else nan
 
         return metrics
 
     def syncpeer(self):
-        try:
-            return self.peers["sync"]["address"][0]
-        except Exception:
-            return None
+        return self.table.first("sync")
+
+    @property
+    def peers(self):
+        """The dictionary of peers as returned by parse(), created on first use."""
+        if self._peers is None:
+            self._peers = self.table.todict()
+        return self._peers
 
     def __init__(self, lines, elapsed=0):
-        self.peers = self.parse(lines)
+        self.table = self.parsetable(lines)
+        self._peers = None
         self.elapsed = elapsed  # unused at present
 
 
+class PeerTable:
+    """
+    Peers stored in columns, one row per peer, with a bitmask of the peer types
+    to which each peer belongs.  Bits beyond the peer types record which source
+    the row came from, since chronyc and ntpq report different fields.
+    """
+
+    numeric = ["delay", "error", "jitter", "moffset", "offset", "reach"]
+    typebits = {t: 1 << i for (i, t) in enumerate(NTPPeers.peertypes)}
+    CHRONY = 1 << len(NTPPeers.peertypes)
+
+    # the other peer types each type is also counted as
+    alsotypes = {
+        "pps": ("sync", "survivor", "all"),
+        "sync": ("survivor", "all"),
+    }
+
+    # the order in which a peer's own type is chosen, since pps peers are also sync peers, and so on
+    primarytypes = ["pps", "sync", "invalid", "false", "excess", "backup", "outlier", "survivor"]
+
+    # the order in which peers are chosen when reporting individual sources
+    sourcetypes = ["pps", "sync", "survivor", "outlier", "backup", "excess", "false", "invalid"]
+
+    # the fields reported by chronyc and ntpq
+    chronyfields = ["address", "error", "moffset", "offset", "reach", "stratum"]
+    ntpdfields = ["address", "delay", "jitter", "offset", "reach", "stratum"]
+
+    def __init__(self):
+        # the number of lines which might be peers, including those which are ignored
+        self.associations = 0
+        self.addresses = []
+        self.columns = {f: array.array("d") for f in self.numeric + ["poll", "when"]}
+        # each column is also an attribute, so that rows can be added quickly
+        (self.delay, self.error, self.jitter, self.moffset, self.offset, self.reach, self.poll, self.when) = (
+            self.columns[f] for f in self.numeric + ["poll", "when"]
+        )
+        self.masks = array.array("L")
+        self.registers = array.array("L")
+        self.strata = array.array("b")
+
+    def __len__(self):
+        return len(self.masks)
+
+    @classmethod
+    def typemask(cls, peertype):
+        """Return the mask of a peer of the given type, including the types it is also counted as, or 0 if it is unknown."""
+        if peertype == "unknown":
+            return 0
+        mask = cls.typebits[peertype]
+        for t in cls.alsotypes.get(peertype, ("all",)):
+            mask |= cls.typebits[t]
+        return mask
+
+    def addrow(self, mask, address, stratum, register, poll, when, delay, error, jitter, moffset, offset, reach):
+        """Append a peer with the given type mask; fields which were not reported are NaN."""
+        self.masks.append(mask)
+        self.registers.append(register)
+        self.addresses.append(address)
+        self.strata.append(stratum)
+        self.delay.append(delay)
+        self.error.append(error)
+        self.jitter.append(jitter)
+        self.moffset.append(moffset)
+        self.offset.append(offset)
+        self.reach.append(reach)
+        self.poll.append(poll)
+        self.when.append(when)
+
+    def rows(self, peertype):
+        """Return the indexes of the rows with the given peer type."""
+        bit = self.typebits[peertype]
+        return [i for (i, mask) in enumerate(self.masks) if mask & bit]
+
+    def first(self, peertype):
+        """Return the address of the first peer of the given type, or None if there are none."""
+        rows = self.rows(peertype)
+        return self.addresses[rows[0]] if len(rows) else None
+
+    def index(self):
+        """Return a dict mapping each peer's address to its row."""
+        return {address: i for (i, address) in enumerate(self.addresses)}
+
+    def peertype(self, row):
+        """Return the peer type of the given row, ignoring the types it is also counted as."""
+        mask = self.masks[row]
+        for t in self.primarytypes:
+            if mask & self.typebits[t]:
+                return t
+        return "unknown"
+
+    def sources(self, peertypes=None, limit=None):
+        """
+        Return a dict of metrics for each peer with one of the given types (all types if None),
+        choosing up to limit peers in the order of the given types.
+        """
+        if peertypes is None:
+            peertypes = self.sourcetypes
+        types = [self.peertype(i) for i in range(len(self))]
+        chosen = sorted((peertypes.index(t), i) for (i, t) in enumerate(types) if t in peertypes)[:limit]
+        result = []
+        for i in sorted(i for (_, i) in chosen):
+            source = {
+                "source": self.addresses[i],
+                "peertype": types[i],
+                "reach_register": self.registers[i],
+                "stratum": self.strata[i],
+            }
+            for f in self.chronyfields if self.masks[i] & self.CHRONY else self.ntpdfields:
+                if f in self.columns and not math.isnan(self.columns[f][i]):
+                    source[f] = self.columns[f][i]
+            for f in ("poll", "when"):
+                if not math.isnan(self.columns[f][i]):
+                    source[f] = self.columns[f][i]
+            result.append(source)
+        return result
+
+    def accumulate(self):
+        """
+        Return a tuple of offset and reachability accumulators for each peer type,
+        calculated in a single pass over the table.
+        """
+        accumulators = {t: (Accumulator(), Accumulator()) for t in NTPPeers.peertypes}
+        # the accumulators for each combination of peer types seen
+        bymask = {}
+        for mask, offset, reach in zip(self.masks, self.columns["offset"], self.columns["reach"]):
+            accs = bymask.get(mask)
+            if accs is None:
+                accs = bymask[mask] = [accumulators[t] for (t, bit) in self.typebits.items() if mask & bit]
+            for o, r in accs:
+                o.add(offset)
+                r.add(reach)
+        return accumulators
+
+    def todict(self):
+        """Return the peers in the dictionary format returned by NTPPeers.parse()."""
+        peers = NTPPeers.newpeerdict()
+        # the per-type dicts for each combination of peer types seen
+        bymask = {}
+        for i, mask in enumerate(self.masks):
+            dicts = bymask.get(mask)
+            if dicts is None:
+                dicts = bymask[mask] = [peers[t] for (t, bit) in self.typebits.items() if mask & bit]
+            values = [("address", self.addresses[i])]
+            for f in self.chronyfields if mask & self.CHRONY else self.ntpdfields:
+                if f in self.columns:
+                    values.append((f, self.columns[f][i]))
+            values.append(("stratum", self.strata[i]))
+            for d in dicts:
+                for f, v in values:
+                    d[f].append(v)
+        return peers
+
+
 if __name__ == "__main__":
     import pprint
 
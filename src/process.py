@@ -5,14 +5,20 @@
 
 import subprocess
 import sys
+import threading
 import time
 
 import psutil
 
 import info
 
+from clients import ClientStats
 from peers import NTPPeers
+from ntpdata import NTPData, pstats_args
 from readvar import NTPVars
+from selectdata import SelectData
+from serverstats import ServerStats
+from sourcestats import SourceStats
 
 
 _logfiles = {
@@ -22,12 +28,25 @@ _logfiles = {
 
 _progs = {
     "chronyd": {
+        "clients": "chronyc -c clients",
+        "ntpdata": "chronyc -n ntpdata",
         "peers": "chronyc -c sources",
+        # several sets of output in a single chronyc invocation
+        "peers+selectdata": "chronyc -c -m sources selectdata",
+        "peers+sourcestats": "chronyc -c -m sources sourcestats",
+        "peers+sourcestats+selectdata": "chronyc -c -m sources sourcestats selectdata",
+        "selectdata": "chronyc -c selectdata",
+        "serverstats": "chronyc -c serverstats",
+        "sourcestats": "chronyc -c sourcestats",
         "vars": "chronyc -c tracking",
         "version": "chronyd --version",
     },
     "ntpd": {
+        "clients": "ntpq -n -c mrulist",
+        # followed by a pstats command for each association
+        "ntpdata": "ntpq -n -c associations",
         "peers": "ntpq -pn",
+        "serverstats": "ntpq -n -c sysstats -c iostats",
         "vars": "ntpq -nc readvar",
         "version": "ntpd --version",
     },
@@ -133,12 +152,54 @@ def execute(prog, timeout=30, debug=False, errfatal=False, implementation=None):
         return [output.split("\n"), elapsed]
 
 
+def execute_stream(prog, consumer, timeout=30, debug=False, implementation=None, args=[]):
+    """
+    Execute a predefined external command with any additional args, passing each line of its output to consumer
+    as it is read, so that the output is never held in memory.  Return the elapsed time in seconds.
+    """
+    progs = get_progs(implementation)
+    if progs is None or prog not in progs:
+        return None
+
+    cmd = progs[prog].split() + args
+    start = time.time()
+    lines = 0
+    try:
+        proc = subprocess.Popen(
+            cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except OSError as ose:
+        if debug:
+            print(ose)
+        return None
+    timer = threading.Timer(timeout, proc.kill)
+    timer.start()
+    try:
+        for line in proc.stdout:
+            consumer(line)
+            lines += 1
+    finally:
+        timer.cancel()
+        proc.stdout.close()
+        proc.wait()
+    elapsed = time.time() - start
+
+    if debug:
+        print("%s: %d lines" % (progs[prog], lines))
+        print("elapsed time: %.3f seconds" % (elapsed,))
+    return elapsed
+
+
 def fatal(msg):
     print("UNKNOWN: " + msg, file=sys.stderr)
     sys.exit(3)
 
 
-def ntpchecks(checks, debug, implementation=None):
+def ntpchecks(checks, debug, implementation=None, client_limit=10):
     """
     Run all of the checks required by the argument list
     and return the resulting objects in a hash.
@@ -154,12 +215,47 @@ def ntpchecks(checks, debug, implementation=None):
     if implementation is None:
         return objs
 
+    # source statistics and selection data are only available from chronyd
+    progs = get_progs(implementation) or {}
+    sourcechecks = {"sourcestats": SourceStats, "selectdata": SelectData}
+    extras = [c for c in sourcechecks if c in checks and c in progs]
+
     for check in checks:
         if (check in ["offset", "peers", "reach", "sync"]) and "peers" not in objs:
-            (output, elapsed) = execute("peers", debug=debug, implementation=implementation)
+            # each parser ignores the others' lines, so they can share the output
+            (output, elapsed) = execute("+".join(["peers"] + extras), debug=debug, implementation=implementation)
+            for c in extras:
+                objs[c] = sourcechecks[c](output, elapsed)
             objs["peers"] = NTPPeers(output, elapsed)
             break
 
+    for c in extras:
+        if c not in objs:
+            (output, elapsed) = execute(c, debug=debug, implementation=implementation)
+            objs[c] = sourcechecks[c](output, elapsed)
+
+    if "serverstats" in checks:
+        (output, elapsed) = execute("serverstats", debug=debug, implementation=implementation)
+        objs["serverstats"] = ServerStats(output, elapsed)
+
+    if "clients" in checks:
+        clients = ClientStats(client_limit)
+        elapsed = execute_stream("clients", clients.add, debug=debug, implementation=implementation)
+        if elapsed is not None:
+            clients.elapsed = elapsed
+            objs["clients"] = clients
+
+    if "ntpdata" in checks:
+        ntpdata = NTPData()
+        args = []
+        if implementation == "ntpd":
+            # ntpq can only fetch the statistics of one association per command, so number them from the peers
+            args = pstats_args(objs["peers"].table.associations if "peers" in objs else 0)
+        elapsed = execute_stream("ntpdata", ntpdata.add, debug=debug, implementation=implementation, args=args)
+        if elapsed is not None:
+            ntpdata.elapsed = elapsed
+            objs["ntpdata"] = ntpdata
+
     if "vars" in checks:
         (output, elapsed) = execute("vars", debug=debug, implementation=implementation)
         objs["vars"] = NTPVars(output, elapsed)
@@ -0,0 +1,146 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+A minimal protocol buffers encoder, sufficient for the metrics export formats
+we use, without requiring the protobuf package and generated code.
+Ref: https://protobuf.dev/programming-guides/encoding/
+"""
+
+import math
+import struct
+
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LEN = 2
+WIRE_FIXED32 = 5
+
+# A schema maps each message name to its fields: {message: {field name: (field number, type)}},
+# where the type is either one of the scalar types below or the name of another message.
+Schema = Dict[str, Dict[str, Tuple[int, str]]]
+
+
+def varint(value: int) -> bytes:
+    """Encode an unsigned integer (or a negative int64 as its two's complement) as a varint."""
+    value &= 0xFFFFFFFFFFFFFFFF
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def tag(field: int, wire_type: int) -> bytes:
+    return varint(field << 3 | wire_type)
+
+
+def length_delimited(data: bytes) -> bytes:
+    return varint(len(data)) + data
+
+
+_scalars: Dict[str, Tuple[int, Callable[[Any], bytes]]] = {
+    "bool": (WIRE_VARINT, lambda v: varint(int(v))),
+    "bytes": (WIRE_LEN, length_delimited),
+    "double": (WIRE_FIXED64, struct.Struct("<d").pack),
+    "enum": (WIRE_VARINT, varint),
+    "fixed64": (WIRE_FIXED64, struct.Struct("<Q").pack),
+    "int64": (WIRE_VARINT, varint),
+    "sfixed64": (WIRE_FIXED64, struct.Struct("<q").pack),
+    "string": (WIRE_LEN, lambda v: length_delimited(v.encode())),
+    "uint64": (WIRE_VARINT, varint),
+}
+
+# 64-bit integer types are represented as strings in the protobuf JSON mapping
+_json_strings = ("fixed64", "int64", "sfixed64", "uint64")
+
+# so are non-finite floating point values, which JSON cannot represent
+_json_floats = ("double", "float")
+
+
+def json_float(value: float):
+    """Return a floating point value as represented in the protobuf JSON mapping."""
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    return value
+
+
+def encode(schema: Schema, message: str, value: dict) -> bytes:
+    """Encode a message, given as a dict keyed by field name.  Lists are
+    encoded as repeated fields; repeated scalars other than strings and bytes
+    are packed."""
+    out = bytearray()
+    for name, v in value.items():
+        field, typename = schema[message][name]
+        if typename in schema:
+            for item in v if isinstance(v, list) else [v]:
+                out += tag(field, WIRE_LEN) + length_delimited(encode(schema, typename, item))
+            continue
+        wire_type, pack = _scalars[typename]
+        if not isinstance(v, list):
+            out += tag(field, wire_type) + pack(v)
+        elif wire_type == WIRE_LEN:
+            for item in v:
+                out += tag(field, wire_type) + pack(item)
+        elif len(v):
+            out += tag(field, WIRE_LEN) + length_delimited(b"".join(pack(item) for item in v))
+    return bytes(out)
+
+
+def to_json(schema: Schema, message: str, value: dict) -> dict:
+    """Convert a message as accepted by encode() to the protobuf JSON mapping."""
+    out = {}
+    for name, v in value.items():
+        field, typename = schema[message][name]
+        if typename in schema:
+            if isinstance(v, list):
+                out[name] = [to_json(schema, typename, item) for item in v]
+            else:
+                out[name] = to_json(schema, typename, v)
+        elif typename in _json_strings:
+            out[name] = [str(item) for item in v] if isinstance(v, list) else str(v)
+        elif typename in _json_floats:
+            out[name] = [json_float(item) for item in v] if isinstance(v, list) else json_float(v)
+        else:
+            out[name] = v
+    return out
+
+
+def decode(data: bytes) -> Iterator[Tuple[int, int, Any]]:
+    """Yield the field number, wire type, and raw value of each field in a
+    message.  Varints are returned as unsigned integers, and other values as
+    bytes."""
+    pos = 0
+    while pos < len(data):
+        key, pos = read_varint(data, pos)
+        field, wire_type = (key >> 3, key & 7)
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(data, pos)
+        elif wire_type == WIRE_FIXED64:
+            value, pos = (data[pos : pos + 8], pos + 8)
+        elif wire_type == WIRE_LEN:
+            length, pos = read_varint(data, pos)
+            value, pos = (data[pos : pos + length], pos + length)
+        elif wire_type == WIRE_FIXED32:
+            value, pos = (data[pos : pos + 4], pos + 4)
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        yield (field, wire_type, value)
+
+
+def read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """Return the varint at pos, and the position following it."""
+    value = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        value |= (b & 0x7F) << shift
+        if b < 0x80:
+            return (value, pos)
+        shift += 7
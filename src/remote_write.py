@@ -0,0 +1,87 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Build prometheus remote write requests.
+Ref: https://prometheus.io/docs/concepts/remote_write_spec/
+"""
+
+from typing import Dict, List, Tuple
+
+import protobuf
+
+schema: protobuf.Schema = {
+    "WriteRequest": {
+        "timeseries": (1, "TimeSeries"),
+    },
+    "TimeSeries": {
+        "labels": (1, "Label"),
+        "samples": (2, "Sample"),
+    },
+    "Label": {
+        "name": (1, "string"),
+        "value": (2, "string"),
+    },
+    "Sample": {
+        "value": (1, "double"),
+        "timestamp": (2, "int64"),
+    },
+}
+
+headers = {
+    "Content-Type": "application/x-protobuf",
+    "X-Prometheus-Remote-Write-Version": "0.1.0",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class WriteBatch:
+    """Collect samples by series between flushes."""
+
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self.series: Dict[Labels, List[Tuple[int, float]]] = {}
+        self.samples = 0
+
+    def add(self, name: str, labels: Dict[str, str], value: float, timestamp_ns: int) -> None:
+        key = tuple(sorted(dict(labels, __name__=name).items()))
+        self.series.setdefault(key, []).append((timestamp_ns // 1_000_000, float(value)))
+        self.samples += 1
+
+    def empty(self) -> bool:
+        return self.samples == 0
+
+    def request(self) -> dict:
+        """Return a WriteRequest with each series' samples in time order, as the protocol requires."""
+        return {
+            "timeseries": [
+                {
+                    "labels": [{"name": k, "value": v} for (k, v) in key],
+                    "samples": [{"value": v, "timestamp": t} for (t, v) in sorted(samples)],
+                }
+                for (key, samples) in sorted(self.series.items())
+            ]
+        }
+
+    def encode(self) -> bytes:
+        """Encode the samples collected so far and start a new batch."""
+        data = protobuf.encode(schema, "WriteRequest", self.request())
+        self.reset()
+        return data
+
+    def text(self) -> str:
+        """Return the samples collected so far in the prometheus exposition format, and start a new batch."""
+        lines = []
+        for key, samples in sorted(self.series.items()):
+            labels = dict(key)
+            name = labels.pop("__name__")
+            labelstr = ",".join(f'{k}="{v}"' for (k, v) in labels.items())
+            if len(labelstr):
+                labelstr = "{" + labelstr + "}"
+            lines += [f"{name}{labelstr} {v} {t}" for (t, v) in sorted(samples)]
+        self.reset()
+        return "\n".join(lines)
@@ -0,0 +1,95 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Parse 'chronyc -c selectdata' output, which explains why chronyd selected or
+rejected each source.  Requires chrony 4.2 or later.
+"""
+
+from typing import Dict
+
+# chronyc selectdata docs:
+# 1. S: the state of the source, as below. [D]
+# 2. Name/IP address: the name or IP address of the source. [192.0.2.1]
+# 3. Auth: whether the source is authenticated (Y or N). [N]
+# 4. COpts: the configured selection options, one character each. [-----]
+# 5. EOpts: the effective selection options, which may differ from the configured
+#    options because of the options of other sources. [-----]
+# 6. Last: the time since the last sample of the source, in seconds. [11]
+# 7. Score: the current score of the source against the best source. [1.0]
+# 8. Interval: the lower and upper endpoints of the interval which is expected to
+#    contain the true offset of the local clock. [-61ms +34ms]
+# 9. Leap: the leap status of the source. [N]
+# In CSV mode, each character of the options is a separate field.
+
+states = {
+    "N": "noselect",
+    "s": "unsynchronised",
+    "M": "few_samples",
+    "d": "max_distance",
+    "~": "max_jitter",
+    "w": "waiting_samples",
+    "S": "stale",
+    "O": "orphan",
+    "T": "untrusted",
+    "x": "falseticker",
+    "W": "waiting_sources",
+    "P": "not_preferred",
+    "U": "waiting_update",
+    "D": "combine_limit",
+    "+": "combined",
+    "*": "selected",
+}
+
+options = {
+    "N": "noselect",
+    "P": "prefer",
+    "R": "require",
+    "T": "trust",
+}
+
+
+def parse_selectdata(line: str) -> dict:
+    """Return the selection state and options of one source, or None if the line is
+    not a valid selectdata line."""
+    f = line.strip().split(",")
+    if len(f) < 10 or len(f) % 2 or f[0] not in states or f[2] not in ("N", "Y"):
+        return None
+    half = (len(f) - 8) // 2
+    effective = "".join(f[3 + half : 3 + 2 * half])
+    try:
+        result = {
+            "source": f[1],
+            "selection": states[f[0]],
+            "authenticated": f[2] == "Y",
+            "last_sample": int(f[-5]),
+            "score": float(f[-4]),
+            "interval_lo": float(f[-3]),
+            "interval_hi": float(f[-2]),
+        }
+    except ValueError:
+        return None
+    for c, name in options.items():
+        result[name] = c in effective
+    return result
+
+
+class SelectData:
+    def __init__(self, lines, elapsed=0):
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        self.sources: Dict[str, dict] = {}
+        for line in lines:
+            source = parse_selectdata(line)
+            if source is not None:
+                self.sources[source["source"]] = source
+        self.elapsed = elapsed
+
+    def getmetrics(self):
+        """Selection data is reported per source rather than as summary metrics."""
+        return {}
+
+    def selection(self, source: str) -> str:
+        """Return the selection state of the given source, or 'unknown' if it was not reported."""
+        return self.sources[source]["selection"] if source in self.sources else "unknown"
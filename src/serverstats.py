@@ -0,0 +1,143 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Parse 'chronyc -c serverstats' or 'ntpq -c sysstats -c iostats' output, and
+turn the server's counters into rates.
+"""
+
+import re
+import time
+
+from typing import Dict, List
+
+# The fields of chronyc serverstats, in order; older versions of chrony report only the first few.
+chrony_fields = [
+    "ntp_packets_received",
+    "ntp_packets_dropped",
+    "command_packets_received",
+    "command_packets_dropped",
+    "client_log_records_dropped",
+    "nts_ke_connections_accepted",
+    "nts_ke_connections_dropped",
+    "authenticated_ntp_packets",
+    "interleaved_ntp_packets",
+    "ntp_timestamps_held",
+    "ntp_timestamp_span",
+    "ntp_daemon_rx_timestamps",
+    "ntp_daemon_tx_timestamps",
+    "ntp_kernel_rx_timestamps",
+    "ntp_kernel_tx_timestamps",
+    "ntp_hardware_rx_timestamps",
+    "ntp_hardware_tx_timestamps",
+]
+
+# The fields of ntpq sysstats and iostats which are not counters
+ntpd_gauges = [
+    "free_receive_buffers",
+    "receive_buffers",
+    "sysstats_reset",
+    "time_since_reset",
+    "uptime",
+    "used_receive_buffers",
+]
+
+ntpd_counters = [
+    "authentication_failed",
+    "bad_length_or_format",
+    "current_version",
+    "declined",
+    "dropped_packets",
+    "ignored_packets",
+    "input_wakeups",
+    "kod_responses",
+    "low_water_refills",
+    "older_version",
+    "packet_send_failures",
+    "packets_received",
+    "packets_sent",
+    "processed_for_time",
+    "rate_limited",
+    "received_packets",
+    "restricted",
+    "useful_input_wakeups",
+]
+
+gauges = ["ntp_timestamps_held", "ntp_timestamp_span"] + ntpd_gauges
+counters = [f for f in chrony_fields if f not in gauges] + ntpd_counters
+
+
+def parse_chrony_serverstats(line: str) -> Dict[str, int]:
+    return {name: int(value) for (name, value) in zip(chrony_fields, line.split(","))}
+
+
+def parse_ntpd_stats(lines: List[str]) -> Dict[str, int]:
+    """Turn the lines of the form "name: value" from ntpq into metrics, ignoring unknown names."""
+    metrics = {}
+    for line in lines:
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        name = re.sub(r"[^a-z0-9]+", "_", name.strip().lower())
+        if name in ntpd_counters or name in ntpd_gauges:
+            try:
+                metrics[name] = int(value)
+            except ValueError:
+                pass
+    return metrics
+
+
+class ServerStats:
+    def __init__(self, lines, elapsed=0):
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        lines = [line.strip() for line in lines if line.strip()]
+        self.metrics = {}
+        try:
+            if len(lines) == 1 and ":" not in lines[0]:
+                self.metrics = parse_chrony_serverstats(lines[0])
+            else:
+                self.metrics = parse_ntpd_stats(lines)
+        except ValueError:
+            pass
+        self.elapsed = elapsed
+
+    def getmetrics(self):
+        """Server statistics are reported as rates by CounterRates rather than as summary metrics."""
+        return {}
+
+
+class CounterRates:
+    """Convert the counters from successive ServerStats into per-second rates
+    named <counter>_rate.  A counter which has decreased is assumed to have
+    been reset (e.g. by a restart of the NTP server), and its current value
+    is used as the increase since the previous sample."""
+
+    def __init__(self, counters: List[str] = counters, gauges: List[str] = gauges) -> None:
+        self.counters = counters
+        self.gauges = gauges
+        self.last: Dict[str, int] = {}
+        self.last_ns: int = None
+
+    def update(self, stats: ServerStats, timestamp_ns: int = None) -> dict:
+        """Return the gauges and the rates of the counters since the previous update."""
+        return self.update_metrics(stats.metrics, timestamp_ns)
+
+    def update_metrics(self, metrics: dict, timestamp_ns: int = None) -> dict:
+        """Return the gauges and the rates of the counters in metrics since the previous update."""
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+        result = {k: v for (k, v) in metrics.items() if k in self.gauges}
+        seconds = (timestamp_ns - self.last_ns) / 1_000_000_000 if self.last_ns is not None else 0
+        current = {k: v for (k, v) in metrics.items() if k in self.counters}
+        if seconds > 0:
+            for name, value in current.items():
+                if name in self.last:
+                    increase = value - self.last[name] if value >= self.last[name] else value
+                    result[name + "_rate"] = increase / seconds
+        if len(current):
+            self.last = current
+            self.last_ns = timestamp_ns
+        result["timestamp_ns"] = timestamp_ns
+        return result
@@ -0,0 +1,109 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Snappy block compression, as required by the prometheus remote write protocol.
+The python-snappy package is used if it is installed; otherwise we fall back
+to a simple pure-python implementation.
+Ref: https://github.com/google/snappy/blob/main/format_description.txt
+"""
+
+import protobuf
+
+try:
+    import snappy
+except ImportError:
+    snappy = None
+
+TAG_LITERAL = 0
+TAG_COPY1 = 1
+TAG_COPY2 = 2
+TAG_COPY4 = 3
+
+MAX_OFFSET = 65535
+
+
+def literal(data: bytes) -> bytes:
+    n = len(data) - 1
+    if n < 60:
+        return bytes([n << 2 | TAG_LITERAL]) + data
+    size = (n.bit_length() + 7) // 8
+    return bytes([(59 + size) << 2 | TAG_LITERAL]) + n.to_bytes(size, "little") + data
+
+
+def copy(offset: int, length: int) -> bytes:
+    """Encode a back reference as a series of 2-byte offset copies, which may be up to 64 bytes long."""
+    out = bytearray()
+    while length > 0:
+        n = min(length, 64)
+        out.append((n - 1) << 2 | TAG_COPY2)
+        out += offset.to_bytes(2, "little")
+        length -= n
+    return bytes(out)
+
+
+def compress_python(data: bytes) -> bytes:
+    """Greedily replace repeated 4-byte sequences with back references."""
+    out = bytearray(protobuf.varint(len(data)))
+    table = {}
+    pos = 0
+    start = 0
+    while pos + 4 <= len(data):
+        key = data[pos : pos + 4]
+        candidate = table.get(key)
+        table[key] = pos
+        if candidate is None or pos - candidate > MAX_OFFSET:
+            pos += 1
+            continue
+        length = 4
+        while pos + length < len(data) and data[candidate + length] == data[pos + length]:
+            length += 1
+        if start < pos:
+            out += literal(data[start:pos])
+        out += copy(pos - candidate, length)
+        pos += length
+        start = pos
+    if start < len(data):
+        out += literal(data[start:])
+    return bytes(out)
+
+
+def compress(data: bytes) -> bytes:
+    if snappy is not None:
+        return snappy.compress(data)
+    return compress_python(data)
+
+
+def decompress(data: bytes) -> bytes:
+    length, pos = protobuf.read_varint(data, 0)
+    out = bytearray()
+    while pos < len(data):
+        tag = data[pos]
+        pos += 1
+        kind = tag & 3
+        if kind == TAG_LITERAL:
+            n = tag >> 2
+            if n >= 60:
+                size = n - 59
+                n = int.from_bytes(data[pos : pos + size], "little")
+                pos += size
+            out += data[pos : pos + n + 1]
+            pos += n + 1
+            continue
+        if kind == TAG_COPY1:
+            n = ((tag >> 2) & 7) + 4
+            offset = (tag >> 5) << 8 | data[pos]
+            pos += 1
+        else:
+            size = 2 if kind == TAG_COPY2 else 4
+            n = (tag >> 2) + 1
+            offset = int.from_bytes(data[pos : pos + size], "little")
+            pos += size
+        if offset == 0 or offset > len(out):
+            raise ValueError("Invalid snappy copy offset")
+        for i in range(n):
+            out.append(out[-offset])
+    if len(out) != length:
+        raise ValueError("Snappy data length mismatch")
+    return bytes(out)
@@ -0,0 +1,53 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Parse 'chronyc -c sourcestats' output and extract per-source statistics.
+"""
+
+from typing import List
+
+# chronyc sourcestats docs:
+# 1. The name or IP address of the source. [192.0.2.1]
+# 2. NP: the number of sample points currently being retained for the source. [11]
+# 3. NR: the number of runs of residuals having the same sign following the last regression. [5]
+# 4. Span: the interval between the oldest and newest samples, in seconds. [46m]
+# 5. Frequency: the estimated residual frequency for the source, in parts per million. [-0.001]
+# 6. Freq Skew: the estimated error bounds on Freq, in parts per million. [0.040]
+# 7. Offset: the estimated offset of the source, in seconds. [+9.2e-06]
+# 8. Std Dev: the estimated sample standard deviation, in seconds. [2.6e-05]
+
+
+def parse_sourcestats(line: str) -> dict:
+    """Return the statistics for one source, using the same names as
+    peer_stats.extract_chrony_statistics(), or None if the line is not a
+    valid sourcestats line."""
+    f = line.strip().split(",")
+    if len(f) != 8:
+        return None
+    try:
+        return {
+            "source": f[0],
+            "samples": int(f[1]),
+            "runs": int(f[2]),
+            "span": int(f[3]),
+            "freq": float(f[4]),
+            "skew": float(f[5]),
+            "offset": float(f[6]),
+            "stdev": float(f[7]),
+        }
+    except ValueError:
+        return None
+
+
+class SourceStats:
+    def __init__(self, lines, elapsed=0):
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        self.stats: List[dict] = [s for s in map(parse_sourcestats, lines) if s is not None]
+        self.elapsed = elapsed
+
+    def getmetrics(self):
+        """Source statistics are reported per source rather than as summary metrics."""
+        return {}
@@ -0,0 +1,139 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Disk-backed journal for output which could not be delivered.
+"""
+
+import os
+import sys
+
+from typing import Dict, List, Tuple
+
+
+class SpillJournal:
+    """An append-only journal of newline-terminated records, stored as a
+    sequence of numbered segment files in a directory.  Records are read back
+    in the order they were written, and each segment is deleted once it has
+    been completely read.  When the total size exceeds max_bytes, the oldest
+    segments are discarded.
+
+    The read position within the oldest segment is only held in memory, so
+    after a restart part of that segment may be delivered a second time.  This
+    is harmless for time series sinks, since each line carries its original
+    timestamp."""
+
+    suffix = ".spill"
+
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, segment_bytes: int = 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[int] = sorted(
+            int(f[: -len(self.suffix)])
+            for f in os.listdir(directory)
+            if f.endswith(self.suffix) and f[: -len(self.suffix)].isdigit()
+        )
+        self.sizes = {seq: os.path.getsize(self.path(seq)) for seq in self.segments}
+        self.read_offset = 0
+        self.file = None
+
+        # statistics
+        self.dropped_bytes = 0
+        self.replayed_bytes = 0
+        self.spilled_bytes = 0
+
+    def path(self, seq: int) -> str:
+        return os.path.join(self.directory, "%012d%s" % (seq, self.suffix))
+
+    def size(self) -> int:
+        """Return the number of bytes in the journal which have not yet been read."""
+        return sum(self.sizes.values()) - self.read_offset
+
+    def empty(self) -> bool:
+        return self.size() == 0
+
+    def append(self, data: bytes) -> None:
+        """Append complete records to the journal."""
+        if self.file is None or self.sizes[self.segments[-1]] >= self.segment_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.sizes[self.segments[-1]] += len(data)
+        self.spilled_bytes += len(data)
+        self.trim()
+
+    def rotate(self) -> None:
+        """Start a new segment file."""
+        if self.file is not None:
+            self.file.close()
+        seq = self.segments[-1] + 1 if len(self.segments) else 0
+        self.segments.append(seq)
+        self.sizes[seq] = 0
+        self.file = open(self.path(seq), "ab")
+
+    def trim(self) -> None:
+        """Discard the oldest segments until the journal is within its size limit."""
+        while len(self.segments) > 1 and sum(self.sizes.values()) > self.max_bytes:
+            seq = self.segments[0]
+            self.dropped_bytes += self.sizes[seq] - self.read_offset
+            print(f"Spill journal full; discarding {self.path(seq)}", file=sys.stderr)
+            self.remove(seq)
+
+    def remove(self, seq: int) -> None:
+        self.segments.remove(seq)
+        del self.sizes[seq]
+        self.read_offset = 0
+        try:
+            os.unlink(self.path(seq))
+        except OSError:
+            pass
+
+    def read(self, max_bytes: int) -> Tuple[int, bytes]:
+        """Return the sequence number of the oldest segment and up to max_bytes
+        of complete records from the front of it, without removing them.  Call
+        commit() with both once they have been delivered.  At least one record
+        is returned if the journal is not empty, even if it is longer than
+        max_bytes."""
+        while len(self.segments):
+            if self.read_offset >= self.sizes[self.segments[0]]:
+                if len(self.segments) == 1:
+                    # never remove the segment we are writing to
+                    break
+                self.remove(self.segments[0])
+                continue
+            with open(self.path(self.segments[0]), "rb") as f:
+                f.seek(self.read_offset)
+                data = f.read(max_bytes)
+                end = data.rfind(b"\n") + 1
+                if end == 0:
+                    data += f.readline()
+                    end = data.rfind(b"\n") + 1
+            if end == 0:
+                # skip the partial record left by an interrupted write
+                self.dropped_bytes += len(data)
+                self.read_offset += len(data)
+                continue
+            return (self.segments[0], data[:end])
+        return (None, b"")
+
+    def commit(self, seq: int, nbytes: int) -> None:
+        """Mark nbytes read from the front of segment seq as delivered."""
+        if len(self.segments) == 0 or self.segments[0] != seq:
+            # the segment was discarded by trim() while the data was being delivered
+            return
+        self.read_offset += nbytes
+        self.replayed_bytes += nbytes
+        if len(self.segments) > 1 and self.read_offset >= self.sizes[self.segments[0]]:
+            self.remove(self.segments[0])
+
+    def getmetrics(self) -> Dict[str, int]:
+        """Return journal statistics."""
+        return {
+            "spill_bytes": self.size(),
+            "spill_dropped_bytes": self.dropped_bytes,
+            "spill_replayed_bytes": self.replayed_bytes,
+            "spill_spilled_bytes": self.spilled_bytes,
+        }
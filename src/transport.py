@@ -0,0 +1,324 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+"""
+Non-blocking delivery of batches of encoded lines to a remote sink.
+"""
+
+import asyncio
+import collections
+import socket
+import sys
+
+from typing import Deque, Dict, Iterator, Tuple
+
+from spill import SpillJournal
+
+
+def parse_connect(connect: str) -> Tuple[str, int]:
+    """Split a host:port connect string into its parts.  IPv6 addresses may be enclosed in square brackets."""
+    host, port = connect.rsplit(":", 1)
+    return (host.strip("[]"), int(port))
+
+
+def parse_url(connect: str) -> Tuple[str, str]:
+    """Split a connect URL into its scheme and address.  A plain host:port is treated as tcp."""
+    if "://" in connect:
+        scheme, address = connect.split("://", 1)
+        scheme = scheme.lower()
+    else:
+        scheme, address = ("tcp", connect)
+    if scheme not in ("tcp", "udp", "unix", "unixgram"):
+        raise ValueError(f"Unknown connection scheme {scheme}")
+    return (scheme, address)
+
+
+class StreamTransport:
+    """Send data over a TCP connection from a background asyncio task.
+
+    Pending data is held in a queue bounded by the number of lines it contains;
+    when the queue is full, the oldest data is moved to the spill journal (if
+    one is configured) or dropped.  Spilled data is replayed at a limited rate
+    whenever the queue is empty.  The connection is (re)established as needed,
+    with exponential backoff between attempts."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        max_lines: int = 10000,
+        min_backoff: float = 0.1,
+        max_backoff: float = 30.0,
+        spill: SpillJournal = None,
+        replay_rate: int = 65536,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.max_lines = max_lines
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.spill = spill
+        self.replay_rate = replay_rate
+        self.next_replay = 0.0
+
+        self.queue: Deque[Tuple[bytes, int]] = collections.deque()
+        self.queued_lines = 0
+        self.inflight = None
+        self.reader = None
+        self.writer = None
+        self.task = None
+        self.wakeup = None
+
+        # statistics
+        self.connects = 0
+        self.connect_failures = 0
+        self.dropped_lines = 0
+        self.sent_bytes = 0
+        self.sent_lines = 0
+
+    def send(self, data: bytes, lines: int) -> None:
+        """Queue data for delivery, dropping the oldest queued data if the queue is full.
+        Must be called from within the running event loop."""
+        self.queue.append((data, lines))
+        self.queued_lines += lines
+        while self.queued_lines > self.max_lines and len(self.queue) > 0:
+            old, dropped = self.queue.popleft()
+            self.queued_lines -= dropped
+            if old is self.inflight:
+                # it is being sent now, so spilling it would send it twice
+                continue
+            if self.spill is None:
+                self.dropped_lines += dropped
+            else:
+                self.spill.append(old)
+        self.start()
+        self.wakeup.set()
+
+    def start(self) -> None:
+        """Start the background delivery task if it is not already running."""
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run(), name="transport")
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    def connected(self) -> bool:
+        """Return true if we have a connection which the remote end has not closed.
+        The sink never sends us any data, so EOF on the reader means the
+        connection is no longer usable."""
+        return self.writer is not None and not self.reader.at_eof() and not self.writer.is_closing()
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def next_batch(self) -> Tuple[bytes, int, int]:
+        """Wait for the next batch of data to send, and return it along with
+        its line count and the spill journal segment it came from (or None if
+        it came from the queue)."""
+        while True:
+            if len(self.queue) > 0:
+                data, lines = self.queue[0]
+                return (data, lines, None)
+
+            self.wakeup.clear()
+            if self.spill is None or self.spill.empty():
+                await self.wakeup.wait()
+                continue
+
+            # replay spilled data at a limited rate, but send new data as soon as it arrives
+            delay = self.next_replay - asyncio.get_running_loop().time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            seq, data = self.spill.read(self.replay_rate)
+            if len(data):
+                return (data, data.count(b"\n"), seq)
+
+    async def run(self) -> None:
+        backoff = self.min_backoff
+        while True:
+            try:
+                backoff = await self.deliver(backoff)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # keep the task alive whatever goes wrong, or nothing will ever be sent again
+                print(f"Unexpected error sending to {self.name}: {e!r}; retrying in {backoff:.1f}s", file=sys.stderr)
+                self.close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+            finally:
+                self.inflight = None
+
+    def queued(self, data: bytes) -> bool:
+        """Return true if data is still at the front of the queue, i.e. it has not
+        been moved to the spill journal or dropped because the queue was full."""
+        return len(self.queue) > 0 and self.queue[0][0] is data
+
+    async def deliver(self, backoff: float) -> float:
+        """Send the next batch, (re)connecting first if necessary.  Return the
+        backoff to use before the next connection attempt."""
+        data, lines, seq = await self.next_batch()
+        spilled = seq is not None
+
+        if not self.connected():
+            self.close()
+            try:
+                await self.connect()
+                self.connects += 1
+                backoff = self.min_backoff
+            except OSError as ose:
+                self.connect_failures += 1
+                print(f"Cannot connect to {self.name}: {ose}; retrying in {backoff:.1f}s", file=sys.stderr)
+                await asyncio.sleep(backoff)
+                return min(backoff * 2, self.max_backoff)
+            if not spilled and not self.queued(data):
+                # the queue overflowed while we were connecting
+                return backoff
+
+        # mark the batch so that it is not spilled if the queue overflows while we are draining
+        self.inflight = data
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+        except OSError as ose:
+            print(f"Lost connection to {self.name}: {ose}", file=sys.stderr)
+            self.close()
+            if not spilled and not self.queued(data):
+                self.dropped_lines += lines
+            return backoff
+
+        if spilled:
+            self.spill.commit(seq, len(data))
+            self.next_replay = asyncio.get_running_loop().time() + len(data) / self.replay_rate
+        elif self.queued(data):
+            # The queue may have been trimmed while we were draining.
+            self.queue.popleft()
+            self.queued_lines -= lines
+        self.sent_bytes += len(data)
+        self.sent_lines += lines
+        return backoff
+
+    def getmetrics(self) -> Dict[str, int]:
+        """Return delivery statistics."""
+        metrics = {} if self.spill is None else self.spill.getmetrics()
+        metrics.update(
+            {
+                "transport_connect_failures": self.connect_failures,
+                "transport_dropped_lines": self.dropped_lines,
+                "transport_queued_lines": self.queued_lines,
+                "transport_reconnects": max(0, self.connects - 1),
+                "transport_sent_bytes": self.sent_bytes,
+                "transport_sent_lines": self.sent_lines,
+            }
+        )
+        return metrics
+
+
+class UnixStreamTransport(StreamTransport):
+    """Send data over a unix domain stream socket."""
+
+    def __init__(self, path: str, **kwargs) -> None:
+        super().__init__(None, None, **kwargs)
+        self.path = path
+        self.name = path
+
+    async def connect(self) -> None:
+        self.reader, self.writer = await asyncio.open_unix_connection(self.path)
+
+
+class DatagramTransport:
+    """Send data over a UDP or unix datagram socket, packing as many complete
+    lines as will fit into each datagram.  Delivery is fire-and-forget: data
+    which cannot be sent immediately is dropped rather than queued."""
+
+    def __init__(self, family: int, address, max_size: int) -> None:
+        self.family = family
+        self.address = address
+        self.max_size = max_size
+        self.sock = None
+
+        # statistics
+        self.dropped_lines = 0
+        self.sent_bytes = 0
+        self.sent_lines = 0
+        self.sent_packets = 0
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+
+    def connect(self) -> None:
+        if self.family == socket.AF_UNIX:
+            family, address = (socket.AF_UNIX, self.address)
+        else:
+            family, _, _, _, address = socket.getaddrinfo(*self.address, type=socket.SOCK_DGRAM)[0]
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        try:
+            self.sock.connect(address)
+        except OSError:
+            self.close()
+            raise
+
+    def packets(self, data: bytes) -> Iterator[Tuple[int, int]]:
+        """Split data into packets of complete lines no larger than max_size,
+        returning the start and end offset of each.  Lines which are too long
+        to fit into a packet on their own are dropped."""
+        start = 0
+        while start < len(data):
+            end = start + self.max_size
+            if end >= len(data):
+                end = len(data)
+            else:
+                end = data.rfind(b"\n", start, end) + 1
+                if end == 0:
+                    self.dropped_lines += 1
+                    start = data.index(b"\n", start) + 1
+                    continue
+            yield (start, end)
+            start = end
+
+    def send(self, data: bytes, lines: int) -> None:
+        for start, end in self.packets(data):
+            if not self.send_packet(data[start:end], data.count(b"\n", start, end)):
+                # drop the rest of this batch
+                self.dropped_lines += data.count(b"\n", end)
+                break
+
+    def send_packet(self, packet: bytes, lines: int) -> bool:
+        """Send a single datagram containing the given number of lines or other
+        items.  Return False if it could not be sent."""
+        try:
+            if self.sock is None:
+                self.connect()
+            self.sock.send(packet)
+        except OSError:
+            # Nobody is listening, or the socket buffer is full; try again with
+            # a fresh socket next time.
+            self.dropped_lines += lines
+            self.close()
+            return False
+        self.sent_bytes += len(packet)
+        self.sent_lines += lines
+        self.sent_packets += 1
+        return True
+
+    def getmetrics(self) -> Dict[str, int]:
+        """Return delivery statistics."""
+        return {
+            "transport_dropped_lines": self.dropped_lines,
+            "transport_sent_bytes": self.sent_bytes,
+            "transport_sent_lines": self.sent_lines,
+            "transport_sent_packets": self.sent_packets,
+        }
@@ -0,0 +1,90 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import random
+import statistics
+
+import outputs
+import peer_stats
+
+from aggregator import Accumulator, PeerAggregator
+
+line = "2021-12-30 11:28:%02d 192.0.2.1 N  2 111 111 %s   6  6 0.00 %s  1.0e-03  4.0e-06  0.0e+00  1.0e-04 47505373 4B K K"
+
+
+def measurement(second: int, offset: str, tests: str = "1111") -> dict:
+    return peer_stats.parse_measurement(line % (second, tests, offset))
+
+
+def test_accumulator() -> None:
+    values = [random.gauss(0, 1e-3) for i in range(1000)]
+    acc = Accumulator()
+    for v in values:
+        acc.add(v)
+    assert acc.count == 1000
+    assert acc.last == values[-1]
+    assert acc.min == min(values)
+    assert acc.max == max(values)
+    assert abs(acc.mean - statistics.fmean(values)) < 1e-12
+    assert abs(acc.stddev() - statistics.pstdev(values)) < 1e-12
+    assert Accumulator().stddev() == 0.0
+
+
+def test_windows() -> None:
+    agg = PeerAggregator(10)
+    assert agg.add(measurement(1, "1.0e-03")) == []
+    assert agg.add(measurement(5, "-3.0e-03", tests="0111")) == []
+    assert agg.add(measurement(9, "2.0e-03")) == []
+
+    # the next window completes the first
+    [summary] = agg.add(measurement(10, "5.0e-03"))
+    assert summary["samples"] == 3
+    assert summary["offset"] == 2.0e-03
+    assert summary["offset_min"] == -3.0e-03
+    assert summary["offset_max"] == 2.0e-03
+    assert abs(summary["offset_mean"]) < 1e-18
+    assert abs(summary["offset_stddev"] - statistics.pstdev([1e-3, -3e-3, 2e-3])) < 1e-12
+    assert summary["delay_mean"] == 1.0e-03
+    assert summary["exceeded_max_delay"] == 1
+    assert summary["exceeded_max_delay_count"] == 1
+    assert summary["bogus"] == 0
+    assert summary["bogus_count"] == 0
+    assert summary["timestamp_ns"] == measurement(9, "0")["timestamp_ns"]
+    assert summary["source"] == "192.0.2.1"
+
+    # windows are only expired once they have ended
+    now = measurement(10, "0")["timestamp_ns"]
+    assert agg.expire(now) == []
+    [summary] = agg.expire(now + 10_000_000_000)
+    assert summary["samples"] == 1
+    assert summary["offset"] == 5.0e-03
+    assert agg.windows == {}
+
+
+def test_outputs(capsys) -> None:
+    """Every field of a summary is sent by the outputs which only send known fields."""
+    agg = PeerAggregator(10)
+    agg.add(measurement(1, "1.0e-03", tests="0111"))
+    [summary] = agg.add(measurement(10, "5.0e-03"))
+    summary.pop("source")
+    summary.pop("timestamp_ns")
+    expected = {k for (k, v) in summary.items() if type(v) in (int, float)}
+
+    args = argparse.Namespace(debug=True, hostname="localhost", interval=60)
+    collectd = outputs.CollectdOutput(args)
+    assert expected <= set(collectd.peerstatstypes)
+    collectd.send_peer_measurements(dict(summary, source="192.0.2.1"))
+    lines = capsys.readouterr().out.splitlines()
+    assert 'PUTVAL "192.0.2.1/ntpmon-offset-stddev/time_offset" interval=60 N:0.000000000' in lines
+    assert 'PUTVAL "192.0.2.1/ntpmon-exceeded-max-delay-count/count" interval=60 N:1.000000000' in lines
+    assert 'PUTVAL "192.0.2.1/ntpmon-samples/count" interval=60 N:1.000000000' in lines
+
+    args = argparse.Namespace(debug=True, mode="remote_write", batch_lines=1000, queue_lines=100, url=None)
+    remote = outputs.get_output(args)
+    assert expected <= set(remote.peerstatstypes)
+    remote.send_peer_measurements(dict(summary, source="192.0.2.1", timestamp_ns=1_000_000_000))
+    remote.flush()
+    names = {line.split("{")[0] for line in capsys.readouterr().out.splitlines()}
+    assert {"ntpmon_peer_offset_stddev_seconds", "ntpmon_peer_exceeded_max_delay_count", "ntpmon_peer_samples"} <= names
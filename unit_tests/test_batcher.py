@@ -0,0 +1,84 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+from batcher import BatchWriter
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        self.now += 0.5
+        return self.now
+
+
+def test_flush_on_line_threshold() -> None:
+    sent = []
+    writer = BatchWriter(sent.append, max_lines=3)
+    writer.write(b"a")
+    writer.write(b"b")
+    assert sent == []
+    writer.write(b"c")
+    assert sent == [b"a\nb\nc\n"]
+    writer.write(b"d")
+    assert sent == [b"a\nb\nc\n"]
+
+
+def test_flush_on_byte_threshold() -> None:
+    sent = []
+    writer = BatchWriter(sent.append, max_bytes=10)
+    writer.write(b"12345")
+    assert sent == []
+    writer.write(b"6789")
+    assert sent == [b"12345\n6789\n"]
+
+
+def test_explicit_flush() -> None:
+    sent = []
+    writer = BatchWriter(sent.append)
+    writer.flush()
+    assert sent == []
+    writer.write(b"x=1")
+    writer.write(b"y=2")
+    writer.flush()
+    writer.flush()
+    assert sent == [b"x=1\ny=2\n"]
+
+
+def test_metrics() -> None:
+    sent = []
+    writer = BatchWriter(sent.append, clock=FakeClock())
+    assert "batch_lines_mean" not in writer.getmetrics()
+    for i in range(3):
+        writer.write(b"abc")
+    writer.flush()
+    writer.write(b"d")
+    writer.flush()
+    metrics = writer.getmetrics()
+    assert metrics["batch_flushes"] == 2
+    assert metrics["batch_lines_total"] == 4
+    assert metrics["batch_bytes_total"] == 14
+    assert metrics["batch_lines_mean"] == 2
+    assert metrics["batch_bytes_mean"] == 7
+    assert metrics["batch_flush_seconds_mean"] == 0.5
+    assert metrics["batch_flush_seconds_max"] == 0.5
+
+
+def test_flush_latency() -> None:
+    """The latency is how long the oldest line waited in the buffer, not how long the sink took."""
+    now = [10.0]
+    writer = BatchWriter(lambda data: now.__setitem__(0, now[0] + 100), clock=lambda: now[0])
+    writer.write(b"a")
+    now[0] = 12.0
+    writer.write(b"b")
+    now[0] = 13.0
+    writer.flush()
+    # the sink took 100 seconds, but that is not counted
+    writer.write(b"c")
+    now[0] += 1.0
+    writer.flush()
+    metrics = writer.getmetrics()
+    assert metrics["batch_flush_seconds_max"] == 3.0
+    assert metrics["batch_flush_seconds_mean"] == 2.0
@@ -0,0 +1,202 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import asyncio
+import os
+import time
+
+from unittest import mock
+
+import ntpmon
+import outputs
+import process
+
+from clients import ClientStats, HyperLogLog, parse_chrony_client, parse_ntpd_client
+
+# the output of chronyc -c clients
+chrony_output = """\
+192.0.2.1,34,0,6,-,23,0,0,-,-
+192.0.2.2,5000,100,0,-1,1,0,0,-,-
+192.0.2.3,1200,20,4,4,3,0,0,-,-
+127.0.0.1,0,0,-,-,-,7,0,3,12
+2001:db8::1,9,0,10,-,600,0,0,-,-
+"""
+
+# the output of ntpq -n -c mrulist
+ntpd_output = """\
+Ctrl-C will stop MRU retrieval and display partial results.
+Retrieved 4 unique MRU entries and 0 updates.
+lstint avgint rstr r m v  count rport remote address
+==============================================================================
+     0     64    0 . 3 4    220   123 192.0.2.1
+     2      1   d0 L 3 4   4000 41234 192.0.2.2
+     5      1   d0 L 3 4   3000 41235 192.0.2.2
+    30    512    0 . 3 4      8   123 192.0.2.4
+"""
+
+
+def stats(output: str, limit: int = 10) -> ClientStats:
+    clients = ClientStats(limit)
+    for line in output.split("\n"):
+        clients.add(line)
+    return clients
+
+
+def test_parse() -> None:
+    assert parse_chrony_client("192.0.2.1,34,0,6,-,23,0,0,-,-") == ("192.0.2.1", 34, 0, 64.0, 23)
+    assert parse_chrony_client("192.0.2.2,5000,100,0,-1,1,0,0,-,-") == ("192.0.2.2", 5000, 100, 1.0, 1)
+    # older versions of chrony don't report IntL
+    assert parse_chrony_client("192.0.2.1,34,0,6,23,0,0,-,-") == ("192.0.2.1", 34, 0, 64.0, 23)
+    # command clients are ignored
+    assert parse_chrony_client("127.0.0.1,0,0,-,-,-,7,0,3,12") is None
+    assert parse_chrony_client("") is None
+    assert parse_ntpd_client("     2      1   d0 L 3 4   4000 41234 192.0.2.2") == ("192.0.2.2", 4000, None, 1.0, 2, True)
+    assert parse_ntpd_client("lstint avgint rstr r m v  count rport remote address") is None
+    assert parse_ntpd_client("Retrieved 4 unique MRU entries and 0 updates.") is None
+
+
+def test_chrony_summary() -> None:
+    clients = stats(chrony_output)
+    summary = clients.summary()
+    assert summary["count"] == 4
+    assert summary["distinct"] == 4
+    assert summary["limited"] == 2
+    assert summary["ntp_packets"] == 6243
+    assert summary["ntp_dropped"] == 120
+    # the histograms are cumulative
+    assert [summary[f"interval_le_{b}"] for b in (1, 2, 16, 64, 1024)] == [1, 1, 2, 3, 4]
+    assert [summary[f"dropped_le_{b}"] for b in (0, 1, 10, 100, 10000)] == [2, 2, 2, 4, 4]
+    assert clients.getmetrics() == {}
+
+
+def test_ntpd_summary() -> None:
+    summary = stats(ntpd_output).summary()
+    assert summary["count"] == 4
+    assert summary["distinct"] == 3
+    assert summary["limited"] == 2
+    assert summary["ntp_packets"] == 7228
+    assert "ntp_dropped" not in summary
+    assert "dropped_le_0" not in summary
+    assert summary["interval_le_1"] == 2
+    assert summary["interval_le_512"] == 4
+
+
+def test_top_clients() -> None:
+    top = stats(chrony_output, limit=2).top.clients()
+    assert [(c["client"], c["rank"], c["packets"]) for c in top] == [("192.0.2.2", 1, 5000), ("192.0.2.3", 2, 1200)]
+    assert top[0] == {"client": "192.0.2.2", "packets": 5000, "dropped": 100, "interval": 1.0, "last": 1, "rank": 1}
+    assert stats(chrony_output, limit=0).top.clients() == []
+
+
+def test_top_clients_merged() -> None:
+    """ntpd lists each port of a client separately."""
+    top = stats(ntpd_output, limit=2).top.clients()
+    assert [(c["client"], c["packets"]) for c in top] == [("192.0.2.2", 7000), ("192.0.2.1", 220)]
+
+
+def test_top_clients_bounded() -> None:
+    clients = ClientStats(5)
+    for i in range(10000):
+        clients.add(f"10.{i // 65536}.{i // 256 % 256}.{i % 256},{(i * 7919) % 10007},0,6,-,1,0,0,-,-")
+    assert len(clients.top.heap) == len(clients.top.entries) == 5
+    assert [c["packets"] for c in clients.top.clients()] == [10006, 10005, 10004, 10003, 10002]
+
+
+def test_hyperloglog() -> None:
+    hll = HyperLogLog()
+    assert hll.estimate() == 0
+    for i in range(20000):
+        hll.add(f"192.0.2.{i}")
+    assert abs(hll.estimate() - 20000) < 20000 * 0.05
+
+    other = HyperLogLog()
+    for i in range(10000, 30000):
+        other.add(f"192.0.2.{i}")
+    hll.merge(other)
+    assert abs(hll.estimate() - 30000) < 30000 * 0.05
+
+
+def test_execute_stream(tmp_path) -> None:
+    path = tmp_path / "clients"
+    path.write_text(chrony_output)
+    clients = ClientStats()
+    with mock.patch("process.get_progs", return_value={"clients": f"cat {path}"}):
+        elapsed = process.execute_stream("clients", clients.add)
+        assert process.execute_stream("vars", clients.add) is None
+    assert elapsed > 0
+    assert clients.clients == 4
+
+    with mock.patch("process.get_progs", return_value={"clients": "sleep 10"}):
+        start = time.time()
+        process.execute_stream("clients", clients.add, timeout=0.1)
+        assert time.time() - start < 5
+
+
+def test_ntpchecks() -> None:
+    def execute_stream(prog, consumer, **kwargs):
+        for line in chrony_output.split("\n"):
+            consumer(line)
+        return 0.1
+
+    with mock.patch("process.execute_stream", side_effect=execute_stream) as stream:
+        objs = process.ntpchecks(["clients"], debug=False, implementation="chronyd", client_limit=3)
+    assert stream.call_args.args[0] == "clients"
+    assert objs["clients"].elapsed == 0.1
+    assert len(objs["clients"].top.clients()) == 3
+
+
+def test_checks_do_not_block() -> None:
+    """Slow checks (e.g. a long client list) run in a thread, so other tasks continue meanwhile."""
+    args = argparse.Namespace(signal="stdin", interval=60, debug=False)
+    read_fd, write_fd = os.pipe()
+
+    def ntpchecks(*args, **kwargs):
+        time.sleep(0.3)
+        return {}
+
+    async def run() -> int:
+        ticks = 0
+
+        async def ticker() -> None:
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        with open(read_fd, "rb") as stdin, mock.patch("process.get_implementation", return_value="chronyd"):
+            with mock.patch("process.ntpchecks", side_effect=ntpchecks) as checks:
+                tick = asyncio.create_task(ticker())
+                task = asyncio.create_task(ntpmon.summary_stats_task(args, outputs.Output(), stdin))
+                os.write(write_fd, b"\n")
+                os.close(write_fd)
+                await asyncio.wait_for(task, 5)
+                tick.cancel()
+                assert checks.call_count == 1
+        return ticks
+
+    assert asyncio.run(run()) >= 10
+
+
+def test_send_clients() -> None:
+    output = mock.MagicMock(spec=outputs.Output)
+    args = argparse.Namespace(debug=False)
+    seen = HyperLogLog()
+    ntpmon.send_clients(args, output, {"clients": stats(chrony_output, limit=2)}, seen)
+    ntpmon.send_clients(args, output, {"clients": stats(ntpd_output, limit=2)}, seen)
+    summary = output.send_client_stats.call_args.args[0]
+    assert (summary["distinct"], summary["distinct_seen"]) == (3, 5)
+    assert output.send_client.call_count == 4
+    assert output.send_client.call_args.args[0]["timestamp_ns"] == summary["timestamp_ns"]
+
+
+def test_prometheus_buckets(capsys) -> None:
+    output = outputs.PrometheusOutput.__new__(outputs.PrometheusOutput)
+    output.send_client_stats({"count": 2, "interval_le_1": 1, "interval_le_2": 2}, debug=True)
+    lines = [line for line in capsys.readouterr().out.splitlines() if not line.startswith("#")]
+    assert lines == [
+        "ntpmon_clients_count 2",
+        'ntpmon_clients_by_interval{le="1"} 1',
+        'ntpmon_clients_by_interval{le="2"} 2',
+    ]
@@ -0,0 +1,126 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import socket
+import struct
+
+from typing import List
+
+import collectd_network
+import outputs
+
+from collectd_network import PacketBuilder
+
+
+def decode(packet: bytes) -> List[dict]:
+    """Decode a packet into a list of value lists, as collectd's network plugin would."""
+    state = {}
+    values = []
+    pos = 0
+    while pos < len(packet):
+        part_type, length = struct.unpack("!HH", packet[pos : pos + 4])
+        body = packet[pos + 4 : pos + length]
+        if part_type == collectd_network.PART_VALUES:
+            (count,) = struct.unpack("!H", body[:2])
+            assert count == 1 and body[2] == collectd_network.VALUE_GAUGE
+            (value,) = struct.unpack("<d", body[3:11])
+            values.append(dict(state, value=value))
+        elif part_type in (collectd_network.PART_TIME_HR, collectd_network.PART_INTERVAL_HR):
+            (state[part_type],) = struct.unpack("!Q", body)
+        else:
+            assert body[-1] == 0
+            state[part_type] = body[:-1].decode()
+        pos += length
+    return values
+
+
+def test_split_type() -> None:
+    assert collectd_network.split_type("peers/count-backup") == ("peers", "count", "backup")
+    assert collectd_network.split_type("offset/time_offset") == ("offset", "time_offset", "")
+    assert collectd_network.split_type("exceeded-max-delay/bool") == ("exceeded-max-delay", "bool", "")
+
+
+def test_to_hires() -> None:
+    assert collectd_network.to_hires(1_000_000_000) == 1 << 30
+    assert collectd_network.to_hires(1_500_000_000) == 3 << 29
+
+
+def test_packet_builder() -> None:
+    builder = PacketBuilder("ntpmon", 60)
+    assert builder.add("host1", "peers/count-backup", 2, 1_000_000_000) == []
+    assert builder.add("host1", "peers/count-sync", 1, 1_000_000_000) == []
+    assert builder.add("host1", "offset/time_offset", 0.25, 2_000_000_000) == []
+    [packet] = builder.flush()
+    assert builder.flush() == []
+
+    values = decode(packet)
+    assert [v["value"] for v in values] == [2, 1, 0.25]
+    assert values[0][collectd_network.PART_HOST] == "host1"
+    assert values[0][collectd_network.PART_PLUGIN] == "ntpmon"
+    assert values[0][collectd_network.PART_PLUGIN_INSTANCE] == "peers"
+    assert values[0][collectd_network.PART_INTERVAL_HR] == 60 << 30
+    assert values[1][collectd_network.PART_TYPE_INSTANCE] == "sync"
+    assert values[2][collectd_network.PART_PLUGIN_INSTANCE] == "offset"
+    assert values[2][collectd_network.PART_TYPE] == "time_offset"
+    assert values[2][collectd_network.PART_TYPE_INSTANCE] == ""
+    assert values[2][collectd_network.PART_TIME_HR] == 2 << 30
+
+
+def test_state_elision() -> None:
+    builder = PacketBuilder("ntpmon", 60)
+    builder.add("host1", "peers/count-backup", 2, 1_000_000_000)
+    first = len(builder.buffer)
+    builder.add("host1", "peers/count-sync", 1, 1_000_000_000)
+    # the second value only needs the changed type instance and the value
+    assert len(builder.buffer) - first == len(collectd_network.string_part(collectd_network.PART_TYPE_INSTANCE, "sync")) + 15
+
+
+def test_packet_size() -> None:
+    builder = PacketBuilder("ntpmon", 60, max_size=200)
+    packets = []
+    for i in range(100):
+        packets += builder.add("192.0.2.%d" % i, "offset/time_offset", i, i * 1_000_000_000)
+    packets += builder.flush()
+    assert len(packets) > 1
+    assert all(len(p) <= 200 for p in packets)
+    values = [v for p in packets for v in decode(p)]
+    assert [v["value"] for v in values] == list(range(100))
+    assert all(v[collectd_network.PART_HOST] == "192.0.2.%d" % i for i, v in enumerate(values))
+
+
+def test_output() -> None:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    args = argparse.Namespace(
+        mode="collectd-network",
+        debug=False,
+        hostname="ntp1",
+        interval=60,
+        connect="127.0.0.1:%d" % receiver.getsockname()[1],
+        datagram_size=None,
+    )
+    output = outputs.get_output(args)
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.5, "timestamp_ns": 3_000_000_000})
+    output.send_summary_stats({"offset": 0.1, "stratum": 2})
+    output.flush()
+    values = decode(receiver.recv(65536))
+    assert [(v[collectd_network.PART_HOST], v["value"]) for v in values] == [("192.0.2.1", 0.5), ("ntp1", 0.1), ("ntp1", 2)]
+    assert values[0][collectd_network.PART_TIME_HR] == 3 << 30
+    receiver.close()
+
+
+def test_notification() -> None:
+    packet = collectd_network.notification("host1", "ntpmon", "events", "added", "okay", "peer added", 1_000_000_000)
+    parts = {}
+    pos = 0
+    while pos < len(packet):
+        part_type, length = struct.unpack("!HH", packet[pos : pos + 4])
+        parts[part_type] = packet[pos + 4 : pos + length]
+        pos += length
+    assert parts[collectd_network.PART_HOST] == b"host1\0"
+    assert parts[collectd_network.PART_TYPE] == b"added\0"
+    assert parts[collectd_network.PART_MESSAGE] == b"peer added\0"
+    assert struct.unpack("!Q", parts[collectd_network.PART_SEVERITY]) == (4,)
+    assert struct.unpack("!Q", parts[collectd_network.PART_TIME_HR]) == (1 << 30,)
@@ -0,0 +1,110 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import sys
+import types
+
+from unittest import mock
+
+
+class Values:
+    dispatched = []
+
+    def __init__(self, **kwargs) -> None:
+        self.__dict__.update(kwargs)
+
+    def dispatch(self) -> None:
+        self.dispatched.append(self)
+
+
+class Notification(Values):
+    dispatched = []
+
+
+class Config:
+    def __init__(self, key: str, *values, children=()) -> None:
+        self.key = key
+        self.values = values
+        self.children = children
+
+
+# a stand-in for the module which collectd provides to its python plugins
+collectd = types.ModuleType("collectd")
+collectd.Values = Values
+collectd.Notification = Notification
+collectd.NOTIF_OKAY = 4
+collectd.NOTIF_WARNING = 2
+collectd.error = mock.MagicMock()
+collectd.warning = mock.MagicMock()
+collectd.register_config = mock.MagicMock()
+collectd.register_init = mock.MagicMock()
+collectd.register_read = mock.MagicMock()
+sys.modules["collectd"] = collectd
+
+import collectd_plugin  # noqa: E402
+
+
+def test_registration() -> None:
+    collectd.register_config.assert_called_once_with(collectd_plugin.config)
+    collectd.register_init.assert_called_once_with(collectd_plugin.init)
+    collectd.register_read.assert_called_once_with(collectd_plugin.read)
+
+
+def test_config() -> None:
+    collectd_plugin.config(
+        Config(
+            "Module",
+            children=(
+                Config("Hostname", "ntp1"),
+                Config("Interval", 30.0),
+                Config("LogFile", "/var/log/chrony/statistics.log"),
+                Config("Bogus", "x"),
+            ),
+        )
+    )
+    assert collectd_plugin.args.hostname == "ntp1"
+    assert collectd_plugin.args.interval == 30
+    assert collectd_plugin.args.logfile == "/var/log/chrony/statistics.log"
+    collectd.warning.assert_called_once()
+
+
+def test_dispatch() -> None:
+    Values.dispatched.clear()
+    output = collectd_plugin.CollectdPluginOutput(collectd_plugin.args)
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.5, "timestamp_ns": 3_500_000_000})
+    output.send_peer_counts({"sync": 1, "backup": 2})
+    assert Values.dispatched == []
+    assert output.dispatch() == 3
+    assert output.dispatch() == 0
+
+    [offset, backup, sync] = Values.dispatched
+    assert offset.host == "192.0.2.1"
+    assert offset.plugin == "ntpmon"
+    assert offset.plugin_instance == "offset"
+    assert offset.type == "time_offset"
+    assert offset.type_instance == ""
+    assert offset.time == 3.5
+    assert offset.values == [0.5]
+    assert (backup.plugin_instance, backup.type, backup.type_instance, backup.values) == ("peers", "count", "backup", [2])
+    assert sync.type_instance == "sync"
+    assert sync.host == collectd_plugin.args.hostname
+
+
+def test_notification() -> None:
+    Notification.dispatched.clear()
+    output = collectd_plugin.CollectdPluginOutput(collectd_plugin.args)
+    event = {
+        "event": "removed",
+        "source": "192.0.2.1",
+        "old_peertype": "survivor",
+        "peertype": "none",
+        "timestamp_ns": 2_000_000_000,
+    }
+    output.send_peer_event(event)
+    assert output.dispatch() == 0
+    [notification] = Notification.dispatched
+    assert notification.type == "removed"
+    assert notification.severity == collectd.NOTIF_WARNING
+    assert notification.message == "peer 192.0.2.1 removed: survivor -> none"
+    assert notification.time == 2.0
@@ -0,0 +1,100 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+import outputs
+
+
+class Recorder(outputs.Output):
+    def __init__(self) -> None:
+        self.calls = []
+
+    def send_info(self, metrics: dict, debug: bool = False) -> None:
+        self.calls.append(("info", metrics))
+
+    def send_peer_counts(self, metrics: dict, debug: bool = False) -> None:
+        self.calls.append(("peers", metrics))
+
+    def send_peer_measurements(self, metrics: dict, debug: bool = False) -> None:
+        self.calls.append(("peer", metrics))
+
+    def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
+        self.calls.append(("summary", metrics))
+
+
+def test_suppression_and_heartbeat() -> None:
+    r = Recorder()
+    output = outputs.DeltaOutput(r, heartbeat=3)
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    for i in range(4):
+        output.send_summary_stats({"offset": 0.25, "stratum": 2})
+    assert r.calls == [
+        ("summary", {"offset": 0.5, "stratum": 2}),
+        ("summary", {"offset": 0.25}),
+        # stratum's heartbeat is due
+        ("summary", {"stratum": 2}),
+        # offset's heartbeat is due
+        ("summary", {"offset": 0.25}),
+    ]
+
+
+def test_labels_and_measurements() -> None:
+    r = Recorder()
+    output = outputs.DeltaOutput(r, heartbeat=10)
+    info = {"ntpmon_version": "3.1", "ntpmon_rss": 100}
+    output.send_info(dict(info))
+    output.send_info(dict(info))
+    output.send_info(dict(info, ntpmon_rss=200))
+    assert r.calls == [("info", info), ("info", {"ntpmon_version": "3.1", "ntpmon_rss": 200})]
+
+    r.calls.clear()
+    output.send_peer_counts({"sync": 1, "backup": 2, "offset": 0.1})
+    output.send_peer_counts({"sync": 1, "backup": 3, "offset": 0.1})
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.1})
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.1})
+    assert r.calls == [
+        ("peers", {"sync": 1, "backup": 2}),
+        ("peers", {"backup": 3}),
+        ("peer", {"source": "192.0.2.1", "offset": 0.1}),
+        ("peer", {"source": "192.0.2.1", "offset": 0.1}),
+    ]
+
+
+def test_deadband() -> None:
+    r = Recorder()
+    output = outputs.DeltaOutput(r, heartbeat=10, deadband=0.1)
+    for offset in (1.0, 1.05, 0.95, 1.08, 1.15, 1.2, 1.3):
+        output.send_summary_stats({"offset": offset})
+    assert [c[1]["offset"] for c in r.calls] == [1.0, 1.15, 1.3]
+
+
+def test_get_output(capsys) -> None:
+    args = argparse.Namespace(mode="execd", debug=True, batch_lines=1000, batch_bytes=65536, heartbeat=5, deadband=0.0)
+    output = outputs.get_output(args)
+    assert isinstance(output, outputs.DeltaOutput)
+    output.send_peer_counts({"sync": 1})
+    output.send_peer_counts({"sync": 1})
+    output.flush()
+    assert capsys.readouterr().out.count("\n") == 1
+
+
+def test_nan_unchanged(capsys) -> None:
+    """Alert metrics which are NaN on every interval must not cause empty summary lines."""
+    telegraf = outputs.TelegrafOutput(argparse.Namespace(batch_bytes=65536, batch_lines=100, debug=True))
+    output = outputs.DeltaOutput(telegraf, heartbeat=10)
+    for i in range(3):
+        output.send_summary_stats({"offset": 0.5, "pps-offset-mean": float("nan")})
+        output.flush()
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert lines[0].startswith("ntpmon offset=0.5 ")
+
+    r = Recorder()
+    output = outputs.DeltaOutput(r, heartbeat=10)
+    output.send_summary_stats({"offset": float("nan")})
+    output.send_summary_stats({"offset": float("nan")})
+    output.send_summary_stats({"offset": 0.5})
+    assert [c[1] for c in r.calls][1:] == [{"offset": 0.5}]
@@ -0,0 +1,41 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import asyncio
+import os
+
+from unittest import mock
+
+import ntpmon
+import outputs
+
+
+def test_execd_output(capsys) -> None:
+    args = argparse.Namespace(mode="execd", debug=False, batch_lines=1000, batch_bytes=65536)
+    output = outputs.get_output(args)
+    assert output.transport is None
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    assert capsys.readouterr().out == ""
+    output.flush()
+    assert capsys.readouterr().out.startswith("ntpmon offset=0.5,stratum=2i ")
+
+
+def test_stdin_signal() -> None:
+    args = argparse.Namespace(signal="stdin", interval=60)
+    read_fd, write_fd = os.pipe()
+
+    async def run() -> int:
+        with open(read_fd, "rb") as stdin, mock.patch("process.get_implementation", return_value=None) as impl:
+            task = asyncio.create_task(ntpmon.summary_stats_task(args, outputs.Output(), stdin))
+            await asyncio.sleep(0.05)
+            assert impl.call_count == 0
+            os.write(write_fd, b"\n\n")
+            await asyncio.sleep(0.05)
+            assert impl.call_count == 2
+            os.close(write_fd)
+            await asyncio.wait_for(task, 1)
+            return impl.call_count
+
+    assert asyncio.run(run()) == 2
@@ -0,0 +1,98 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import asyncio
+
+import outputs
+
+
+class Recorder(outputs.Output):
+    def __init__(self, fail: bool = False) -> None:
+        self.calls = []
+        self.fail = fail
+
+    def flush(self) -> None:
+        self.calls.append(("flush", None))
+
+    def send_summary_stats(self, metrics: dict, debug: bool = False) -> None:
+        if self.fail:
+            raise RuntimeError("broken")
+        self.calls.append(("summary", metrics))
+        metrics["modified"] = True
+
+
+def test_get_output() -> None:
+    args = argparse.Namespace(mode=["execd", "execd"], debug=True, batch_lines=1000, batch_bytes=65536)
+    assert isinstance(outputs.get_output(args), outputs.ExecdOutput)
+
+    args = argparse.Namespace(
+        mode=["execd", "textfile"],
+        debug=True,
+        batch_lines=1000,
+        batch_bytes=65536,
+        textfile_dir="/nonexistent",
+        output_queue_size=10,
+    )
+    output = outputs.get_output(args)
+    assert isinstance(output, outputs.FanoutOutput)
+    assert list(output.sinks) == ["execd", "textfile"]
+    assert isinstance(output.sinks["textfile"], outputs.TextfileOutput)
+
+
+def test_fanout() -> None:
+    async def run() -> None:
+        a = Recorder()
+        b = Recorder(fail=True)
+        output = outputs.FanoutOutput({"a": a, "b": b}, queue_size=2)
+        for i in range(5):
+            output.send_summary_stats({"offset": i})
+        output.flush()
+        assert a.calls == []
+        await asyncio.sleep(0.01)
+
+        # only the newest updates were kept, and a's changes to its copy were not seen by b
+        assert a.calls == [("summary", {"offset": 4, "modified": True}), ("flush", None)]
+        assert output.dropped == {"a": 4, "b": 4}
+
+        # b's failure does not stop a from receiving data
+        output.send_summary_stats({"offset": 5})
+        await asyncio.sleep(0.01)
+        assert a.calls[-1] == ("summary", {"offset": 5, "modified": True})
+
+        info = {}
+        output.send_info(info)
+        assert info == {"output_a_dropped": 4, "output_a_queued": 0, "output_b_dropped": 4, "output_b_queued": 0}
+        for worker in output.workers:
+            worker.cancel()
+
+    asyncio.run(run())
+
+
+def test_spill_dirs(tmp_path) -> None:
+    """Each output has its own spill journal, since their records are not interchangeable."""
+    args = argparse.Namespace(
+        mode=["telegraf", "influxdb", "remote_write"],
+        debug=False,
+        batch_lines=1000,
+        batch_bytes=65536,
+        connect=None,
+        queue_lines=1,
+        url=None,
+        org="ntp",
+        bucket="ntp",
+        output_queue_size=10,
+        spill_dir=str(tmp_path),
+        spill_max_bytes=4096,
+        spill_replay_rate=65536,
+    )
+    output = outputs.get_output(args)
+    journals = {mode: sink.transport.spill for (mode, sink) in output.sinks.items()}
+    assert {mode: j.directory for (mode, j) in journals.items()} == {
+        mode: str(tmp_path / mode) for mode in ("telegraf", "influxdb", "remote_write")
+    }
+    assert all(j.max_bytes == 4096 for j in journals.values())
+    journals["telegraf"].append(b"ntpmon offset=0.5 1\n")
+    assert journals["influxdb"].empty() and journals["remote_write"].empty()
+    assert outputs.get_spill_journal(argparse.Namespace(spill_dir=None), "telegraf") is None
@@ -0,0 +1,77 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import asyncio
+import pickle
+import struct
+
+import outputs
+
+from test_transport import Receiver, wait_for
+
+
+def get_args(**kwargs) -> argparse.Namespace:
+    args = argparse.Namespace(
+        mode="graphite",
+        debug=False,
+        batch_lines=1000,
+        connect=None,
+        graphite_prefix="",
+        graphite_protocol="plaintext",
+        hostname="ntp1.example.com",
+        interval=60,
+        queue_lines=100,
+        spill_dir=None,
+        spill_replay_rate=65536,
+    )
+    for k, v in kwargs.items():
+        setattr(args, k, v)
+    return args
+
+
+def test_paths() -> None:
+    output = outputs.get_output(get_args(debug=True, graphite_prefix="site1."))
+    assert output.escape("2001:db8::1") == "2001_db8__1"
+    assert output.path("192.0.2.1", "offset/time_offset") == "site1.192_0_2_1.ntpmon-offset.time_offset"
+    assert output.path("ntp1.example.com", "peers/count-sync") == "site1.ntp1_example_com.ntpmon-peers.count-sync"
+    assert output.hosts == {"2001:db8::1": "2001_db8__1", "192.0.2.1": "192_0_2_1", "ntp1.example.com": "ntp1_example_com"}
+
+
+def test_plaintext(capsys) -> None:
+    output = outputs.get_output(get_args(debug=True))
+    output.send_peer_measurements(
+        {"source": "192.0.2.1", "offset": 0.5, "leap": False, "timestamp_ns": 1_700_000_000_900_000_000}
+    )
+    assert capsys.readouterr().out == ""
+    output.flush()
+    assert capsys.readouterr().out == (
+        "192_0_2_1.ntpmon-leap.bool 0.0 1700000000\n" "192_0_2_1.ntpmon-offset.time_offset 0.5 1700000000\n"
+    )
+
+
+def test_send() -> None:
+    async def run(protocol: str) -> bytes:
+        receiver = Receiver()
+        port = await receiver.start()
+        output = outputs.get_output(get_args(connect="127.0.0.1:%d" % port, graphite_protocol=protocol))
+        output.send_summary_stats({"offset": 0.25, "stratum": 2, "timestamp_ns": 1_700_000_000_000_000_000})
+        output.flush()
+        await wait_for(lambda: output.transport.sent_lines == 2)
+        output.transport.close()
+        await receiver.stop()
+        return bytes(receiver.data)
+
+    assert asyncio.run(run("plaintext")) == (
+        b"ntp1_example_com.ntpmon-offset.time_offset 0.25 1700000000\n"
+        b"ntp1_example_com.ntpmon-stratum.clock_stratum 2.0 1700000000\n"
+    )
+
+    data = asyncio.run(run("pickle"))
+    (length,) = struct.unpack("!L", data[:4])
+    assert length == len(data) - 4
+    assert pickle.loads(data[4:]) == [
+        ("ntp1_example_com.ntpmon-offset.time_offset", (1700000000, 0.25)),
+        ("ntp1_example_com.ntpmon-stratum.clock_stratum", (1700000000, 2.0)),
+    ]
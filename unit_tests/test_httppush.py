@@ -0,0 +1,151 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import gzip
+import http.server
+import threading
+import time
+
+from typing import List
+
+import httppush
+import outputs
+
+from spill import SpillJournal
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, dict(self.headers), body, self.client_address))
+        status = self.server.responses.pop(0) if len(self.server.responses) else 204
+        self.send_response(status)
+        if status in (429, 503):
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+class Receiver(http.server.ThreadingHTTPServer):
+    """A local stand-in for an HTTP metrics receiver."""
+
+    daemon_threads = True
+
+    def __init__(self, responses: List[int] = []) -> None:
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.requests = []
+        self.responses = list(responses)
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path: str) -> str:
+        return "http://127.0.0.1:%d%s" % (self.server_address[1], path)
+
+
+def wait_for(condition, timeout: float = 5) -> None:
+    for i in range(int(timeout / 0.01)):
+        if condition():
+            return
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_retry_after() -> None:
+    assert httppush.retry_after(None) is None
+    assert httppush.retry_after("2") == 2
+    assert httppush.retry_after("-1") == 0
+    assert httppush.retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470) == 10
+    assert httppush.retry_after("soon") is None
+
+
+def test_keepalive_and_gzip() -> None:
+    receiver = Receiver()
+    t = httppush.HTTPTransport(receiver.url("/write?x=1"), {"X-Test": "yes"})
+    t.send(b"a 1\n", 1)
+    t.send(b"b 2\nc 3\n", 2)
+    wait_for(lambda: t.sent_lines == 3)
+    assert [r[0] for r in receiver.requests] == ["/write?x=1", "/write?x=1"]
+    assert [gzip.decompress(r[2]) for r in receiver.requests] == [b"a 1\n", b"b 2\nc 3\n"]
+    assert all(r[1]["Content-Encoding"] == "gzip" and r[1]["X-Test"] == "yes" for r in receiver.requests)
+    # both requests used the same connection
+    assert receiver.requests[0][3] == receiver.requests[1][3]
+    assert t.getmetrics()["transport_reconnects"] == 0
+    receiver.shutdown()
+
+
+def test_retry_and_reject() -> None:
+    receiver = Receiver(responses=[429, 503, 500, 400])
+    t = httppush.HTTPTransport(receiver.url("/"), compress=None, encoding=None, min_backoff=0.01)
+    t.send(b"retried\n", 1)
+    t.send(b"rejected\n", 1)
+    t.send(b"accepted\n", 1)
+    wait_for(lambda: t.sent_lines == 2)
+    assert [r[2] for r in receiver.requests] == [b"retried\n"] * 4 + [b"rejected\n", b"accepted\n"]
+    metrics = t.getmetrics()
+    assert metrics["transport_retries"] == 3
+    assert metrics["transport_rejected_lines"] == 1
+    assert metrics["transport_queued_lines"] == 0
+    receiver.shutdown()
+
+
+def test_spill_and_replay(tmp_path) -> None:
+    assert httppush.parse_spill_record(httppush.spill_record(b"\x00\n\xff", 3)) == (b"\x00\n\xff", 3)
+    receiver = Receiver(responses=[500, 500, 500])
+    journal = SpillJournal(str(tmp_path))
+    t = httppush.HTTPTransport(
+        receiver.url("/"), compress=None, encoding=None, max_lines=1, min_backoff=0.02, max_backoff=0.05, spill=journal
+    )
+    t.send(b"\x00first", 1)
+    wait_for(lambda: len(receiver.requests) > 0)
+    # the first batch is in flight, so it is not spilled when it leaves the queue
+    t.send(b"\x00second\n", 1)
+    t.send(b"\x00third", 1)
+    assert journal.getmetrics()["spill_spilled_bytes"] > 0
+    wait_for(lambda: t.sent_lines == 3)
+    assert [r[2] for r in receiver.requests if r[2] != b"\x00first"] == [b"\x00third", b"\x00second\n"]
+    metrics = t.getmetrics()
+    assert metrics["spill_bytes"] == 0
+    assert metrics["spill_replayed_bytes"] == metrics["spill_spilled_bytes"]
+    assert metrics["transport_dropped_lines"] == 0
+    receiver.shutdown()
+
+
+def test_influxdb_output(monkeypatch, tmp_path) -> None:
+    monkeypatch.setenv("INFLUX_TOKEN", "secret")
+    receiver = Receiver()
+    args = argparse.Namespace(
+        mode="influxdb",
+        debug=False,
+        batch_lines=1000,
+        batch_bytes=65536,
+        queue_lines=100,
+        url=receiver.url("/"),
+        org="my org",
+        bucket="ntp",
+    )
+    output = outputs.get_output(args)
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    output.send_peer_counts({t: 1 for t in output.peertypes})
+    assert len(receiver.requests) == 0
+    output.flush()
+    wait_for(lambda: len(receiver.requests) == 1)
+    path, headers, body, _ = receiver.requests[0]
+    assert path == "/api/v2/write?org=my+org&bucket=ntp&precision=ns"
+    assert headers["Authorization"] == "Token secret"
+    lines = gzip.decompress(body).decode().splitlines()
+    assert lines[0].startswith("ntpmon offset=0.5,stratum=2i ")
+    assert len(lines) == 9
+    assert output.transport.spill is None
+    receiver.shutdown()
+
+    args.spill_dir = str(tmp_path)
+    args.spill_max_bytes = 1024
+    args.spill_replay_rate = 100
+    transport = outputs.get_output(args).transport
+    assert (transport.spill.max_bytes, transport.replay_rate) == (1024, 100)
@@ -63,3 +63,41 @@ def test_transform_identifier() -> None:
     assert line_protocol.transform_identifier("hello, world") == "hello_world"
     assert line_protocol.transform_identifier("a = hello(world)") == "a_hello_world"
     assert line_protocol.transform_identifier("def hello(world) -> str:") == "def_hello_world_str"
+
+
+def test_encoder() -> None:
+    encoder = line_protocol.Encoder()
+    samples = [
+        ({"count": 3, "peertype": "sync"}, "ntpmon_peers", {}),
+        ({"count": 0, "peertype": "backup"}, "ntpmon_peers", {}),
+        ({"offset": 0.001, "stratum": 2, "frequency": -1e-7}, "ntpmon", {}),
+        ({"offset": 1, "stratum": 2.0, "frequency": None}, "ntpmon", {}),
+        ({}, "empty", {}),
+        ({"a b": "x,y=z", "leap": False, "c": 1}, "ntpmon", {"hostname": "ntp1", "a b": "overridden", "d": 4}),
+        ({"a b": "p q", "leap": True, "c": 2}, "ntpmon", {"hostname": "ntp2", "a b": "overridden", "d": 5}),
+        ({"a b": 1.5, "leap": True, "c": 2}, "ntpmon", {"hostname": "ntp2", "a b": "not overridden"}),
+        ({"timestamp_ns": 1, "{brace}": 2}, "{measurement}", {}),
+    ]
+    for i in range(2):
+        for metrics, which, tags in samples:
+            metrics["timestamp_ns"] = time.time_ns()
+            expected = line_protocol.to_line_protocol(dict(metrics), which, additional_tags=tags)
+            assert encoder.encode(metrics, which, additional_tags=tags) == expected.encode()
+
+
+def test_encoder_measurements() -> None:
+    import peer_stats
+    from test_peer_stats import peerstats, sample_measurements
+
+    encoder = line_protocol.Encoder()
+    for line in (sample_measurements + peerstats).strip().split("\n"):
+        metrics = peer_stats.parse_measurement(line)
+        if metrics is None:
+            continue
+        assert encoder.encode(dict(metrics), "ntpmon_peer") == line_protocol.to_line_protocol(metrics, "ntpmon_peer").encode()
+
+
+def test_encoder_timestamp() -> None:
+    metrics = {"offset": 0.1}
+    line = line_protocol.Encoder().encode(metrics, "ntpmon")
+    assert line == b"ntpmon offset=0.1 %d" % metrics["timestamp_ns"]
@@ -0,0 +1,197 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+from unittest import mock
+
+import ntpmon
+import outputs
+import process
+
+from ntpdata import NTPData, pstats_args
+
+# the output of chronyc -n ntpdata, from a recent and an older version of chrony
+chrony_output = """\
+
+Remote address  : 192.0.2.1 (C0000201)
+Remote port     : 123
+Local address   : 192.0.2.100 (C0000264)
+Leap status     : Normal
+Version         : 4
+Mode            : Server
+Stratum         : 1
+Poll interval   : 4 (16 seconds)
+Precision       : -24 (0.000000060 seconds)
+Root delay      : 0.000000 seconds
+Root dispersion : 0.000015 seconds
+Reference ID    : 47505300 (GPS)
+Reference time  : Fri Nov 25 15:22:12 2016
+Offset          : -0.000060878 seconds
+Peer delay      : 0.000175634 seconds
+Peer dispersion : 0.000000681 seconds
+Response time   : 0.000053050 seconds
+Jitter asymmetry: +0.00
+NTP tests       : 111 111 1111
+Interleaved     : Yes
+Authenticated   : No
+TX timestamping : Hardware
+RX timestamping : Hardware
+Total TX        : 1000
+Total RX        : 1000
+Total valid RX  : 998
+Total good RX   : 998
+Total kernel TX : 0
+Total kernel RX : 0
+Total HW TX     : 1000
+Total HW RX     : 996
+
+Remote address  : 2001:db8::1 (D5A1B21C)
+Remote port     : 123
+Response time   : 0.000412000 seconds
+Interleaved     : No
+Authenticated   : Yes
+TX timestamping : Daemon
+RX timestamping : Kernel
+Total TX        : 20
+Total RX        : 19
+Total valid RX  : 19
+"""
+
+# the output of ntpq -n -c associations -c "pstats &1" -c "pstats &2" -c "pstats &3"
+ntpd_output = """\
+
+ind assid status  conf reach auth condition  last_event cnt
+===========================================================
+  1 40308  8811   yes  none  none    reject    mobilize  1
+  2 40309  961a    no   yes  none  sys.peer    sys_peer  1
+  3 40310  941a    no   yes  none candidate    sys_peer  1
+remote host:          0.0.0.0
+local address:        0.0.0.0
+time last received:   1004s
+packets sent:         0
+packets received:     0
+remote host:          192.0.2.1
+local address:        192.0.2.100
+time last received:   35s
+time until next send: 29s
+reachability change:  2431s
+packets sent:         40
+packets received:     39
+bad authentication:   0
+bogus origin:         1
+duplicate:            0
+bad dispersion:       0
+bad reference time:   0
+candidate order:      0
+remote host:          192.0.2.2
+local address:        192.0.2.100
+packets sent:         40
+packets received:     40
+"""
+
+ntpd_peers = """\
+     remote           refid      st t when poll reach   delay   offset  jitter
+==============================================================================
+ 0.ubuntu.pool.n .POOL.          16 p    -   64    0    0.000    0.000   0.000
+*192.0.2.1       .GPS.            1 u   35   64  377    0.175   -0.060   0.010
++192.0.2.2       .GPS.            1 u   30   64  377    0.211    0.020   0.012
+"""
+
+
+def parse(output: str) -> NTPData:
+    ntpdata = NTPData()
+    for line in output.split("\n"):
+        ntpdata.add(line)
+    return ntpdata
+
+
+def test_chrony() -> None:
+    ntpdata = parse(chrony_output)
+    assert list(ntpdata.sources) == ["192.0.2.1", "2001:db8::1"]
+    assert ntpdata.sources["192.0.2.1"] == {
+        "response_time": 0.00005305,
+        "interleaved": True,
+        "authenticated": False,
+        "tx_timestamping": "hardware",
+        "rx_timestamping": "hardware",
+        "total_tx": 1000,
+        "total_rx": 1000,
+        "total_valid_rx": 998,
+        "total_good_rx": 998,
+        "total_kernel_tx": 0,
+        "total_kernel_rx": 0,
+        "total_hw_tx": 1000,
+        "total_hw_rx": 996,
+    }
+    assert ntpdata.sources["2001:db8::1"]["rx_timestamping"] == "kernel"
+    assert "total_hw_rx" not in ntpdata.sources["2001:db8::1"]
+    assert ntpdata.getmetrics() == {}
+
+
+def test_ntpd() -> None:
+    ntpdata = parse(ntpd_output)
+    assert list(ntpdata.sources) == ["0.0.0.0", "192.0.2.1", "192.0.2.2"]
+    assert ntpdata.sources["192.0.2.1"] == {
+        "packets_sent": 40,
+        "packets_received": 39,
+        "bad_authentication": 0,
+        "bogus_origin": 1,
+        "duplicate": 0,
+        "bad_dispersion": 0,
+        "bad_reference_time": 0,
+    }
+
+
+def test_ntpchecks() -> None:
+    def execute_stream(prog, consumer, **kwargs):
+        for line in ntpd_output.split("\n"):
+            consumer(line)
+        return 0.1
+
+    assert pstats_args(2) == ["-c", "pstats &1", "-c", "pstats &2"]
+    # the pool association is not a peer, but it still has to be counted
+    with mock.patch("process.execute", return_value=[ntpd_peers.split("\n"), 0.1]):
+        with mock.patch("process.execute_stream", side_effect=execute_stream) as stream:
+            objs = process.ntpchecks(["peers", "ntpdata"], debug=False, implementation="ntpd")
+    assert stream.call_args.args[0] == "ntpdata"
+    assert stream.call_args.kwargs["args"] == pstats_args(3)
+    assert len(objs["ntpdata"].sources) == 3
+
+    with mock.patch("process.execute_stream", return_value=0.1) as stream:
+        objs = process.ntpchecks(["ntpdata"], debug=False, implementation="chronyd")
+    assert stream.call_args.kwargs["args"] == []
+
+
+def test_send_ntpdata() -> None:
+    output = mock.MagicMock(spec=outputs.Output)
+    args = argparse.Namespace(debug=False)
+    rates = {}
+    first = parse(chrony_output)
+    second = parse(chrony_output.replace("1000", "1600").replace("996", "1596"))
+    del second.sources["2001:db8::1"]
+    with mock.patch("time.time_ns", side_effect=[0, 60_000_000_000]):
+        ntpmon.send_ntpdata(args, output, {"ntpdata": first}, rates)
+        ntpmon.send_ntpdata(args, output, {"ntpdata": second}, rates)
+    assert output.send_ntpdata.call_count == 3
+    metrics = output.send_ntpdata.call_args.args[0]
+    assert metrics["source"] == "192.0.2.1"
+    assert metrics["peertype"] == "unknown"
+    assert metrics["tx_timestamping"] == "hardware"
+    assert metrics["total_hw_rx_rate"] == 10.0
+    assert metrics["total_kernel_rx_rate"] == 0.0
+    assert metrics["response_time"] == 0.00005305
+    assert metrics["timestamp_ns"] == 60_000_000_000
+    assert list(rates) == ["192.0.2.1"]
+
+
+def test_telegraf(capsys) -> None:
+    output = outputs.TelegrafOutput(argparse.Namespace(batch_bytes=65536, batch_lines=100, debug=True))
+    output.send_ntpdata(
+        {"source": "192.0.2.1", "rx_timestamping": "hardware", "interleaved": True, "total_rx_rate": 1.5, "timestamp_ns": 5}
+    )
+    output.flush()
+    assert capsys.readouterr().out == (
+        "ntpmon_ntpdata,rx_timestamping=hardware,source=192.0.2.1 total_rx_rate=1.5,interleaved=1i 5\n"
+    )
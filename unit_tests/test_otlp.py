@@ -0,0 +1,127 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import gzip
+import json
+import struct
+
+import pytest
+
+import otlp
+import outputs
+import protobuf
+
+from test_httppush import Receiver, wait_for
+
+resource = {"service.name": "ntpmon"}
+scope = {"name": "ntpmon"}
+
+
+def fields(data: bytes) -> dict:
+    """Decode a message into a dict of field number to list of raw values"""
+    result = {}
+    for field, _, value in protobuf.decode(data):
+        result.setdefault(field, []).append(value)
+    return result
+
+
+def test_histogram() -> None:
+    h = otlp.Histogram([0.0, 1.0])
+    for value in (-1, 0, 0.5, 1, 2, 3):
+        h.add(value)
+    assert h.counts == [2, 2, 2]
+    assert (h.count, h.sum, h.min, h.max) == (6, 5.5, -1, 3)
+
+
+def test_batch_json() -> None:
+    batch = otlp.MetricsBatch()
+    assert batch.empty()
+    batch.add("ntpmon_peer", {"source": "192.0.2.1", "offset": 0.002, "stratum": 2, "timestamp_ns": 1_000_000_000})
+    batch.add("ntpmon_peer", {"source": "192.0.2.1", "offset": -0.002, "stratum": 2, "timestamp_ns": 2_000_000_000})
+    batch.add("ntpmon", {"offset": 0.5})
+    assert batch.points == 5
+    request = json.loads(batch.encode(resource, scope, json_encoding=True))
+    assert batch.empty()
+
+    [rm] = request["resourceMetrics"]
+    assert rm["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "ntpmon"}}]
+    [sm] = rm["scopeMetrics"]
+    metrics = {m["name"]: m for m in sm["metrics"]}
+    assert sorted(metrics) == ["ntpmon_offset", "ntpmon_peer_offset", "ntpmon_peer_offset_histogram", "ntpmon_peer_stratum"]
+
+    points = metrics["ntpmon_peer_offset"]["gauge"]["dataPoints"]
+    assert [(p["timeUnixNano"], p["asDouble"]) for p in points] == [("1000000000", 0.002), ("2000000000", -0.002)]
+    assert points[0]["attributes"] == [{"key": "source", "value": {"stringValue": "192.0.2.1"}}]
+    assert metrics["ntpmon_peer_stratum"]["gauge"]["dataPoints"][0]["asInt"] == "2"
+
+    histogram = metrics["ntpmon_peer_offset_histogram"]["histogram"]
+    assert histogram["aggregationTemporality"] == otlp.AGGREGATION_TEMPORALITY_DELTA
+    [point] = histogram["dataPoints"]
+    assert point["count"] == "2"
+    assert point["bucketCounts"] == ["0", "0", "1", "0", "0", "0", "0", "0", "0", "1", "0", "0"]
+    assert int(point["startTimeUnixNano"]) < int(point["timeUnixNano"])
+
+
+def test_batch_json_nan() -> None:
+    """NaN summary metrics (e.g. when there are no peers) must still produce valid JSON."""
+    batch = otlp.MetricsBatch()
+    batch.add("ntpmon", {"offset": float("nan"), "reach": 0.0})
+    data = batch.encode(resource, scope, json_encoding=True)
+    request = json.loads(data, parse_constant=lambda c: pytest.fail(f"invalid JSON constant {c}"))
+    metrics = {m["name"]: m for m in request["resourceMetrics"][0]["scopeMetrics"][0]["metrics"]}
+    assert metrics["ntpmon_offset"]["gauge"]["dataPoints"][0]["asDouble"] == "NaN"
+    assert metrics["ntpmon_reach"]["gauge"]["dataPoints"][0]["asDouble"] == 0.0
+
+
+def test_batch_protobuf() -> None:
+    batch = otlp.MetricsBatch()
+    batch.add("ntpmon_peers", {"count": 3, "peertype": "sync", "timestamp_ns": 5})
+    request = fields(batch.encode(resource, scope))
+    [rm] = request[1]
+    [sm] = fields(rm)[2]
+    [metric] = fields(sm)[2]
+    metric = fields(metric)
+    assert metric[1] == [b"ntpmon_peers_count"]
+    [point] = fields(metric[5][0])[1]
+    point = fields(point)
+    assert point[3] == [struct.pack("<Q", 5)]
+    assert point[6] == [struct.pack("<q", 3)]
+    [attribute] = point[7]
+    assert fields(attribute)[1] == [b"peertype"]
+
+
+def test_otlp_output() -> None:
+    receiver = Receiver()
+    args = argparse.Namespace(
+        mode="otlp",
+        debug=False,
+        hostname="ntp1",
+        otlp_encoding="json",
+        queue_lines=100,
+        url=receiver.url("/v1/metrics"),
+    )
+    output = outputs.get_output(args)
+    output.flush()
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    output.send_peer_counts({"sync": 1, "backup": 2})
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.001, "timestamp_ns": 1_700_000_000_000_000_000})
+    assert len(receiver.requests) == 0
+    output.flush()
+    wait_for(lambda: len(receiver.requests) == 1)
+    path, headers, body, _ = receiver.requests[0]
+    assert path == "/v1/metrics"
+    assert headers["Content-Type"] == "application/json"
+    request = json.loads(gzip.decompress(body))
+    [rm] = request["resourceMetrics"]
+    assert {"key": "host.name", "value": {"stringValue": "ntp1"}} in rm["resource"]["attributes"]
+    names = [m["name"] for m in rm["scopeMetrics"][0]["metrics"]]
+    assert names == [
+        "ntpmon_offset",
+        "ntpmon_stratum",
+        "ntpmon_peers_count",
+        "ntpmon_peer_offset",
+        "ntpmon_peer_offset_histogram",
+    ]
+    receiver.shutdown()
@@ -0,0 +1,91 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+import outputs
+
+from peer_events import PeerDiffer
+from peers import NTPPeers
+
+
+def table(*lines: str):
+    return NTPPeers.parsetable(list(lines))
+
+
+def chrony(tally: str, address: str, reach: str = "377") -> str:
+    return f"^,{tally},{address},2,6,{reach},10,0.001,0.002,0.003"
+
+
+def test_baseline() -> None:
+    differ = PeerDiffer()
+    assert differ.update(table(chrony("*", "192.0.2.1"), chrony("+", "192.0.2.2"))) == []
+    assert set(differ.counts.values()) == {0}
+
+
+def test_unchanged() -> None:
+    differ = PeerDiffer()
+    lines = [chrony("*", "192.0.2.1"), chrony("+", "192.0.2.2")]
+    differ.update(table(*lines))
+    assert differ.update(table(*lines)) == []
+    assert differ.update(table(*lines)) == []
+
+
+def test_events() -> None:
+    differ = PeerDiffer()
+    differ.update(table(chrony("*", "192.0.2.1"), chrony("+", "192.0.2.2"), chrony("-", "192.0.2.3")))
+    events = differ.update(
+        table(chrony("x", "192.0.2.1", "376"), chrony("*", "192.0.2.2"), chrony("+", "192.0.2.4")),
+        timestamp_ns=1_000_000_000,
+    )
+    summary = sorted((e["event"], e["source"], e["old_peertype"], e["peertype"]) for e in events)
+    assert summary == [
+        ("added", "192.0.2.4", "none", "survivor"),
+        ("reach_lost", "192.0.2.1", "sync", "false"),
+        ("removed", "192.0.2.3", "outlier", "none"),
+        ("state_changed", "192.0.2.1", "sync", "false"),
+        ("state_changed", "192.0.2.2", "survivor", "sync"),
+        ("sync_changed", "192.0.2.2", "survivor", "sync"),
+    ]
+    sync = [e for e in events if e["event"] == "sync_changed"][0]
+    assert sync["old_source"] == "192.0.2.1"
+    assert sync["timestamp_ns"] == 1_000_000_000
+    assert differ.counts == {"added": 1, "reach_lost": 1, "removed": 1, "state_changed": 2, "sync_changed": 1}
+
+
+def test_reach_lost_once() -> None:
+    """Only a transition from a successful to a failed poll is reported."""
+    differ = PeerDiffer()
+    differ.update(table(chrony("+", "192.0.2.1", "377")))
+    assert [e["event"] for e in differ.update(table(chrony("+", "192.0.2.1", "376")))] == ["reach_lost"]
+    assert differ.update(table(chrony("+", "192.0.2.1", "374"))) == []
+    assert differ.update(table(chrony("+", "192.0.2.1", "351"))) == []
+    assert [e["event"] for e in differ.update(table(chrony("+", "192.0.2.1", "322")))] == ["reach_lost"]
+
+
+def test_sync_lost() -> None:
+    differ = PeerDiffer()
+    differ.update(table(chrony("*", "192.0.2.1")))
+    events = differ.update(table(chrony("+", "192.0.2.1")))
+    sync = [e for e in events if e["event"] == "sync_changed"][0]
+    assert (sync["source"], sync["old_source"]) == ("none", "192.0.2.1")
+    assert outputs.event_severity(sync) == "warning"
+    assert outputs.event_message(sync) == "sync peer changed from 192.0.2.1 to none"
+
+
+def test_telegraf_events(capsys) -> None:
+    args = argparse.Namespace(batch_bytes=65536, batch_lines=100, debug=True)
+    output = outputs.TelegrafOutput(args)
+    differ = PeerDiffer()
+    differ.update(table(chrony("+", "192.0.2.1")))
+    for event in differ.update(table(chrony("+", "192.0.2.1"), chrony("+", "192.0.2.2")), timestamp_ns=5):
+        output.send_peer_event(event)
+    output.send_peer_events(dict(differ.counts))
+    output.flush()
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == (
+        "ntpmon_peer_event,event=added,old_peertype=none,peertype=survivor,source=192.0.2.2 old_reach=0.0,reach=100.0 5"
+    )
+    assert lines[1].startswith("ntpmon_peer_events,event=added count=1i ")
+    assert len(lines) == 6
@@ -4,6 +4,7 @@
 # License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
 
 import math
+import os
 import unittest
 
 from peers import NTPPeers
@@ -361,6 +362,109 @@ class TestNTPPeers(unittest.TestCase):
             parsed = NTPPeers.parse(t)
             self.assertEqual(len(parsed["all"]["address"]), testdata[t])
 
+    def test_parsefast(self):
+        """Ensure the fast parser gives the same results as the original on all the test data."""
+        edgecases = [
+            "^,,192.0.2.1,2,6,377,10,0.1,0.2,0.3",
+            "^,*,192.0.2.1,2,-3,377,2d,1e-3,-2e-3,nan",
+            "#,o,192.0.2.1,16,6,377,10,0.1,0.2,0.3",
+            "^, ~,192.0.2.1,2,6,377,10,0.1,0.2,0.3",
+            "^,*,192.0.2.1,2,x,377,10,0.1,0.2,0.3",
+            "o192.0.2.1       .PPS.            0 l    3   16  377    0.000   -0.001   0.001",
+            "\u0101192.0.2.1       .GPS.            0 l    3   16  377    0.000   -0.001   0.001",
+            "*192.0.2.1       .GPS.            0 l    3y   16  378    0.000   -0.001   0.001",
+            "*192.0.2.1       .GPS.            0 l    3y   16  377    0.000   -0.001   0.001",
+        ]
+        inputs = [alllines, noiselines, "\n".join(edgecases)] + list(testdata) + edgecases
+        testdir = os.path.join(os.path.dirname(__file__), "..", "testdata", "OK")
+        for f in sorted(os.listdir(testdir)):
+            with open(os.path.join(testdir, f)) as fd:
+                lines = fd.readlines()
+            inputs.append(lines)
+            inputs.append([x.rstrip() for x in lines])
+        for i in inputs:
+            # compare representations, since NaN != NaN
+            self.assertEqual(repr(NTPPeers.parsefast(i)), repr(NTPPeers.parse(i)))
+
+    def test_getmetrics_streaming(self):
+        """Ensure the single-pass metrics match those calculated from the lists of peer values."""
+        testdir = os.path.join(os.path.dirname(__file__), "..", "testdata", "OK")
+        inputs = [alllines] + list(testdata)
+        for f in sorted(os.listdir(testdir)):
+            with open(os.path.join(testdir, f)) as fd:
+                inputs.append(fd.read())
+        for i in inputs:
+            p = NTPPeers(i)
+            expected = {}
+            for t in NTPPeers.peertypes:
+                expected[t] = len(p.peers[t]["address"])
+                for field in ("offset", "reach"):
+                    values = p.peers[t][field]
+                    mean = NTPPeers.getmean(values)
+                    expected[f"{t}-{field}-mean"] = mean
+                    expected[f"{t}-{field}-stdev"] = NTPPeers.getstdev(values, mean)
+                    expected[f"{t}-{field}-rms"] = NTPPeers.rms(values)
+            for metrics in (p.getmetrics(), p.getmetrics(p.peers)):
+                self.assertEqual(metrics.keys(), expected.keys())
+                for k in expected:
+                    if math.isnan(expected[k]):
+                        self.assertTrue(math.isnan(metrics[k]), k)
+                    else:
+                        self.assertTrue(math.isclose(metrics[k], expected[k], rel_tol=1e-9, abs_tol=1e-12), k)
+
+    def test_sources(self):
+        """Ensure the metrics of individual sources are reported, subject to the type and limit."""
+        lines = [
+            "^,+,192.0.2.1,2,6,377,10,0.001,0.002,0.003",
+            "^,*,192.0.2.2,1,-2,376,-,0.004,0.005,0.006",
+            "*192.0.2.3       .GPS.            1 u    2h   64  377    0.500   -0.250   0.125",
+            "x192.0.2.4       .GPS.            1 u    3   64    1    0.500   -0.250   0.125",
+        ]
+        table = NTPPeers.parsetable(lines)
+        sources = table.sources()
+        self.assertEqual(
+            sources[0],
+            {
+                "source": "192.0.2.1",
+                "peertype": "survivor",
+                "reach_register": 0o377,
+                "stratum": 2,
+                "error": 0.003,
+                "moffset": 0.001,
+                "offset": 0.002,
+                "reach": 100.0,
+                "poll": 64.0,
+                "when": 10.0,
+            },
+        )
+        self.assertNotIn("when", sources[1])
+        self.assertEqual(sources[1]["poll"], 0.25)
+        self.assertEqual(sources[1]["reach_register"], 0o376)
+        self.assertEqual(
+            sources[2],
+            {
+                "source": "192.0.2.3",
+                "peertype": "sync",
+                "reach_register": 0o377,
+                "stratum": 1,
+                "delay": 0.0005,
+                "jitter": 0.000125,
+                "offset": -0.00025,
+                "reach": 100.0,
+                "poll": 64.0,
+                "when": 7200.0,
+            },
+        )
+        self.assertEqual(sources[3]["peertype"], "false")
+        # the preferred types are chosen first, but the sources stay in their original order
+        self.assertEqual([s["source"] for s in table.sources(["sync", "false"], 2)], ["192.0.2.2", "192.0.2.3"])
+        self.assertEqual([s["source"] for s in table.sources(["false", "survivor"], 2)], ["192.0.2.1", "192.0.2.4"])
+        self.assertEqual(table.sources(["backup"]), [])
+
+    def test_syncpeer(self):
+        self.assertEqual(NTPPeers(alllines).syncpeer(), NTPPeers.parse(alllines)["sync"]["address"][0])
+        self.assertIsNone(NTPPeers(noiselines).syncpeer())
+
     def test_rootmeansquare(self):
         """Test root mean square function."""
         self.assertTrue(math.isnan(NTPPeers.rms([])))
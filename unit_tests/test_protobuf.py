@@ -0,0 +1,60 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import struct
+
+import protobuf
+
+schema = {
+    "Outer": {
+        "name": (1, "string"),
+        "inner": (2, "Inner"),
+        "values": (3, "double"),
+        "count": (4, "int64"),
+    },
+    "Inner": {
+        "time": (1, "fixed64"),
+        "flag": (2, "bool"),
+    },
+}
+
+
+def test_varint() -> None:
+    assert protobuf.varint(0) == b"\x00"
+    assert protobuf.varint(1) == b"\x01"
+    assert protobuf.varint(150) == b"\x96\x01"
+    assert protobuf.varint(-1) == b"\xff" * 9 + b"\x01"
+    for value in (0, 1, 127, 128, 300, 2**63):
+        [(field, wire_type, decoded)] = protobuf.decode(protobuf.tag(1, protobuf.WIRE_VARINT) + protobuf.varint(value))
+        assert (field, wire_type, decoded) == (1, protobuf.WIRE_VARINT, value)
+
+
+def test_encode() -> None:
+    message = {
+        "name": "ntp",
+        "inner": [{"time": 5, "flag": True}, {"time": 6}],
+        "values": [0.5, 1.5],
+        "count": -2,
+    }
+    fields = list(protobuf.decode(protobuf.encode(schema, "Outer", message)))
+    assert [(f, w) for (f, w, _) in fields] == [(1, 2), (2, 2), (2, 2), (3, 2), (4, 0)]
+    assert fields[0][2] == b"ntp"
+    assert list(protobuf.decode(fields[1][2])) == [(1, 1, struct.pack("<Q", 5)), (2, 0, 1)]
+    assert list(protobuf.decode(fields[2][2])) == [(1, 1, struct.pack("<Q", 6))]
+    # repeated doubles are packed
+    assert struct.unpack("<2d", fields[3][2]) == (0.5, 1.5)
+    assert fields[4][2] == 2**64 - 2
+
+
+def test_to_json() -> None:
+    message = {"name": "ntp", "inner": [{"time": 5, "flag": True}], "values": [0.5], "count": 3}
+    assert protobuf.to_json(schema, "Outer", message) == {
+        "name": "ntp",
+        "inner": [{"time": "5", "flag": True}],
+        "values": [0.5],
+        "count": "3",
+    }
+    # non-finite values are not valid JSON, so they are represented as strings
+    message = {"values": [float("nan"), float("inf"), -float("inf"), 1.0]}
+    assert protobuf.to_json(schema, "Outer", message) == {"values": ["NaN", "Infinity", "-Infinity", 1.0]}
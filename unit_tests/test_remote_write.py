@@ -0,0 +1,73 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import struct
+
+import outputs
+import protobuf
+import remote_write
+import snappy_codec
+
+from test_httppush import Receiver, wait_for
+
+
+def decode(data: bytes) -> list:
+    """Decode a WriteRequest into a list of (labels, samples) tuples"""
+    series = []
+    for _, _, ts in protobuf.decode(data):
+        labels = {}
+        samples = []
+        for field, _, value in protobuf.decode(ts):
+            if field == 1:
+                label = {f: v.decode() for (f, _, v) in protobuf.decode(value)}
+                labels[label[1]] = label[2]
+            else:
+                sample = {f: v for (f, _, v) in protobuf.decode(value)}
+                samples.append((sample[2], struct.unpack("<d", sample[1])[0]))
+        series.append((labels, samples))
+    return series
+
+
+def test_batch() -> None:
+    batch = remote_write.WriteBatch()
+    batch.add("b", {"source": "192.0.2.1"}, 2, 2_000_000_000)
+    batch.add("b", {"source": "192.0.2.1"}, 1, 1_000_000_000)
+    batch.add("a", {}, 0.5, 3_500_000)
+    assert batch.samples == 3
+    assert batch.text() == 'a 0.5 3\nb{source="192.0.2.1"} 1.0 1000\nb{source="192.0.2.1"} 2.0 2000'
+    assert batch.empty()
+
+    batch.add("b", {"source": "192.0.2.1"}, 2, 2_000_000_000)
+    batch.add("b", {"source": "192.0.2.1"}, 1, 1_000_000_000)
+    assert decode(batch.encode()) == [({"__name__": "b", "source": "192.0.2.1"}, [(1000, 1.0), (2000, 2.0)])]
+
+
+def test_remote_write_output() -> None:
+    receiver = Receiver()
+    args = argparse.Namespace(
+        mode="remote_write",
+        debug=False,
+        batch_lines=1000,
+        queue_lines=100,
+        url=receiver.url("/api/v1/write"),
+    )
+    output = outputs.get_output(args)
+    output.send_peer_measurements({"source": "192.0.2.1", "offset": 0.001, "timestamp_ns": 1_700_000_000_123_000_000})
+    output.send_summary_stats({"offset": 0.5, "reach": 50.0})
+    assert len(receiver.requests) == 0
+    output.flush()
+    wait_for(lambda: len(receiver.requests) == 1)
+    path, headers, body, _ = receiver.requests[0]
+    assert path == "/api/v1/write"
+    assert headers["Content-Encoding"] == "snappy"
+    assert headers["X-Prometheus-Remote-Write-Version"] == "0.1.0"
+    series = {labels["__name__"]: (labels, samples) for (labels, samples) in decode(snappy_codec.decompress(body))}
+    assert sorted(series) == ["ntpmon_offset_seconds", "ntpmon_peer_offset_seconds", "ntpmon_reach_ratio"]
+    assert series["ntpmon_peer_offset_seconds"] == (
+        {"__name__": "ntpmon_peer_offset_seconds", "source": "192.0.2.1"},
+        [(1_700_000_000_123, 0.001)],
+    )
+    assert series["ntpmon_reach_ratio"][1][0][1] == 0.5
+    receiver.shutdown()
@@ -0,0 +1,121 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+from unittest import mock
+
+import ntpmon
+import outputs
+import process
+
+from peers import NTPPeers
+from selectdata import SelectData, parse_selectdata
+from sourcestats import SourceStats
+
+# the output of chronyc -c -m sources sourcestats selectdata
+combined = """\
+^,*,192.0.2.1,2,10,377,473,-0.000012,-0.000013,0.000034
+^,?,192.0.2.2,2,10,377,12,0.000021,0.000020,0.000045
+^,?,192.0.2.3,0,10,0,-,0.000000,0.000000,0.000000
+^,x,192.0.2.4,3,10,377,100,0.050000,0.050000,0.000050
+192.0.2.1,11,5,2765,-0.001,0.040,-0.000009,0.000026
+192.0.2.2,8,4,1803,0.123,0.456,0.000015,0.000031
+192.0.2.3,0,0,0,0.000,2000.000,0.000000,4000.000000
+192.0.2.4,10,6,2000,0.010,0.020,0.050000,0.000040
+*,192.0.2.1,N,-,P,-,-,-,-,P,-,-,-,473,1.0,-0.000046,0.000021,N
+~,192.0.2.2,Y,-,-,-,-,-,-,-,-,-,-,12,1.3,-0.000030,0.000070,N
+M,192.0.2.3,N,N,-,-,-,-,N,-,-,-,-,0,0.0,0.000000,0.000000,?
+x,192.0.2.4,N,-,-,-,-,-,-,-,-,-,-,100,5.2,0.049900,0.050100,N
+"""
+
+
+def test_parse() -> None:
+    assert parse_selectdata("*,192.0.2.1,N,-,P,-,-,-,-,P,-,-,-,473,1.0,-0.000046,0.000021,N\n") == {
+        "source": "192.0.2.1",
+        "selection": "selected",
+        "authenticated": False,
+        "last_sample": 473,
+        "score": 1.0,
+        "interval_lo": -0.000046,
+        "interval_hi": 0.000021,
+        "noselect": False,
+        "prefer": True,
+        "require": False,
+        "trust": False,
+    }
+    # options as a single field
+    stats = parse_selectdata("M,192.0.2.3,Y,N----,NT---,0,0.0,0.000000,0.000000,?")
+    assert (stats["selection"], stats["authenticated"], stats["noselect"], stats["trust"]) == ("few_samples", True, True, True)
+    # the lines of the other commands
+    assert parse_selectdata("^,*,192.0.2.1,2,10,377,473,-0.000012,-0.000013,0.000034") is None
+    assert parse_selectdata("192.0.2.1,11,5,2765,-0.001,0.040,-0.000009,0.000026") is None
+    assert parse_selectdata("") is None
+    assert parse_selectdata("*,192.0.2.1,N,-,P,-,-,-,-,P,-,-,-,-,1.0,-0.000046,0.000021,N") is None
+
+
+def test_combined_output() -> None:
+    """All three parsers ignore the others' lines, so they can share one chronyc invocation."""
+    assert NTPPeers(combined).table.addresses == ["192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4"]
+    assert len(SourceStats(combined).stats) == 4
+    selectdata = SelectData(combined)
+    assert [selectdata.selection(a) for a in ("192.0.2.1", "192.0.2.2", "192.0.2.3", "192.0.2.4", "192.0.2.5")] == [
+        "selected",
+        "max_jitter",
+        "few_samples",
+        "falseticker",
+        "unknown",
+    ]
+    assert selectdata.getmetrics() == {}
+
+
+def test_single_execution() -> None:
+    lines = combined.split("\n")
+    with mock.patch("process.execute", return_value=[lines, 0.1]) as execute:
+        objs = process.ntpchecks(["peers", "selectdata", "sourcestats"], debug=False, implementation="chronyd")
+    execute.assert_called_once_with("peers+sourcestats+selectdata", debug=False, implementation="chronyd")
+    assert set(objs) == {"peers", "selectdata", "sourcestats"}
+
+    with mock.patch("process.execute", return_value=[lines, 0.1]) as execute:
+        objs = process.ntpchecks(["peers", "selectdata"], debug=False, implementation="chronyd")
+    execute.assert_called_once_with("peers+selectdata", debug=False, implementation="chronyd")
+    assert len(objs["selectdata"].sources) == 4
+
+    with mock.patch("process.execute", return_value=[lines, 0.1]) as execute:
+        objs = process.ntpchecks(["selectdata"], debug=False, implementation="chronyd")
+    execute.assert_called_once_with("selectdata", debug=False, implementation="chronyd")
+
+    with mock.patch("process.execute", return_value=[[], 0.1]) as execute:
+        objs = process.ntpchecks(["peers", "selectdata"], debug=False, implementation="ntpd")
+    execute.assert_called_once_with("peers", debug=False, implementation="ntpd")
+    assert "selectdata" not in objs
+
+
+def test_index_peers() -> None:
+    index = ntpmon.index_peers({"peers": NTPPeers(combined), "selectdata": SelectData(combined)})
+    assert index["192.0.2.1"] == {"peertype": "sync", "selection": "selected"}
+    # chrony's ? and ~ are both invalid, but their selection states differ
+    assert index["192.0.2.2"] == {"peertype": "invalid", "selection": "max_jitter"}
+    assert index["192.0.2.3"] == {"peertype": "invalid", "selection": "few_samples"}
+    assert index[None] == {"peertype": "unknown", "selection": "unknown"}
+
+    index = ntpmon.index_peers({"peers": NTPPeers(combined)})
+    assert index["192.0.2.4"] == {"peertype": "false"}
+    assert index[None] == {"peertype": "unknown"}
+
+
+def test_send_sources() -> None:
+    output = mock.MagicMock(spec=outputs.Output)
+    args = argparse.Namespace(debug=False, source_limit=32)
+    checkobjs = {"peers": NTPPeers(combined), "selectdata": SelectData(combined), "sourcestats": SourceStats(combined)}
+    ntpmon.send_sources(args, output, checkobjs, ["sync", "invalid"])
+    sources = [c.args[0] for c in output.send_peer_source.call_args_list]
+    assert [(s["source"], s["peertype"], s["selection"]) for s in sources] == [
+        ("192.0.2.1", "sync", "selected"),
+        ("192.0.2.2", "invalid", "max_jitter"),
+        ("192.0.2.3", "invalid", "few_samples"),
+    ]
+    assert (sources[0]["prefer"], sources[0]["last_sample"], sources[0]["score"]) == (True, 473, 1.0)
+    stats = output.send_source_stats.call_args_list[1].args[0]
+    assert (stats["source"], stats["peertype"], stats["selection"]) == ("192.0.2.2", "invalid", "max_jitter")
@@ -0,0 +1,117 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+from unittest import mock
+
+import outputs
+import process
+
+from serverstats import CounterRates, ServerStats
+
+ntpq_output = """\
+uptime:                 86400
+sysstats reset:         3600
+packets received:       120000
+current version:        110000
+older version:          9000
+bad length or format:   12
+authentication failed:  0
+declined:               0
+restricted:             5
+rate limited:           40
+KoD responses:          2
+processed for time:     600
+time since reset:       3600
+receive buffers:        10
+free receive buffers:   9
+used receive buffers:   0
+low water refills:      1
+dropped packets:        0
+ignored packets:        0
+received packets:       120010
+packets sent:           119000
+packet send failures:   0
+input wakeups:          121000
+useful input wakeups:   120010
+"""
+
+
+def test_chrony() -> None:
+    stats = ServerStats(["1598,3,19,0,0,0,0,0,7,128,900,0,1598,1598,0,0,0", ""])
+    assert stats.metrics["ntp_packets_received"] == 1598
+    assert stats.metrics["ntp_packets_dropped"] == 3
+    assert stats.metrics["interleaved_ntp_packets"] == 7
+    assert stats.metrics["ntp_timestamps_held"] == 128
+    assert stats.metrics["ntp_hardware_tx_timestamps"] == 0
+    assert stats.getmetrics() == {}
+
+
+def test_chrony_old() -> None:
+    """Older versions of chrony report fewer fields."""
+    stats = ServerStats("1598,3,19,0,0\n")
+    assert stats.metrics == {
+        "ntp_packets_received": 1598,
+        "ntp_packets_dropped": 3,
+        "command_packets_received": 19,
+        "command_packets_dropped": 0,
+        "client_log_records_dropped": 0,
+    }
+
+
+def test_ntpd() -> None:
+    stats = ServerStats(ntpq_output)
+    assert stats.metrics["packets_received"] == 120000
+    assert stats.metrics["bad_length_or_format"] == 12
+    assert stats.metrics["kod_responses"] == 2
+    assert stats.metrics["received_packets"] == 120010
+    assert stats.metrics["free_receive_buffers"] == 9
+    assert len(stats.metrics) == 24
+
+
+def test_invalid() -> None:
+    assert ServerStats([]).metrics == {}
+    assert ServerStats("501 Not authorised").metrics == {}
+
+
+def test_rates() -> None:
+    rates = CounterRates()
+    first = rates.update(ServerStats("1000,10,5,0,0,0,0,0,0,16,30"), timestamp_ns=60_000_000_000)
+    assert first == {"ntp_timestamps_held": 16, "ntp_timestamp_span": 30, "timestamp_ns": 60_000_000_000}
+
+    second = rates.update(ServerStats("7000,70,5,0,0,0,0,0,0,20,31"), timestamp_ns=120_000_000_000)
+    assert second["ntp_packets_received_rate"] == 100.0
+    assert second["ntp_packets_dropped_rate"] == 1.0
+    assert second["command_packets_received_rate"] == 0.0
+    assert second["ntp_timestamps_held"] == 20
+    assert "ntp_timestamps_held_rate" not in second
+
+    # a failed collection does not disturb the rates
+    assert rates.update(ServerStats([]), timestamp_ns=150_000_000_000) == {"timestamp_ns": 150_000_000_000}
+
+    # the server was restarted, so the counters were reset
+    third = rates.update(ServerStats("3000,0,1,0,0,0,0,0,0,20,31"), timestamp_ns=180_000_000_000)
+    assert third["ntp_packets_received_rate"] == 50.0
+    assert third["ntp_packets_dropped_rate"] == 0.0
+
+
+def test_telegraf(capsys) -> None:
+    args = argparse.Namespace(batch_bytes=65536, batch_lines=100, debug=True)
+    output = outputs.TelegrafOutput(args)
+    rates = CounterRates()
+    rates.update(ServerStats("1000,10,5"), timestamp_ns=0)
+    output.send_server_stats(rates.update(ServerStats("1600,10,8"), timestamp_ns=60_000_000_000))
+    output.flush()
+    assert capsys.readouterr().out == (
+        "ntpmon_server command_packets_received_rate=0.05,ntp_packets_dropped_rate=0.0,"
+        "ntp_packets_received_rate=10.0 60000000000\n"
+    )
+
+
+def test_single_execution() -> None:
+    with mock.patch("process.execute", return_value=[ntpq_output.split("\n"), 0.1]) as execute:
+        objs = process.ntpchecks(["serverstats"], debug=False, implementation="ntpd")
+    execute.assert_called_once_with("serverstats", debug=False, implementation="ntpd")
+    assert objs["serverstats"].metrics["packets_sent"] == 119000
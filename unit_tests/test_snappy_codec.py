@@ -0,0 +1,28 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import os
+
+import snappy_codec
+
+
+def test_literal() -> None:
+    assert snappy_codec.compress_python(b"") == b"\x00"
+    assert snappy_codec.compress_python(b"abc") == b"\x03\x08abc"
+    for n in (59, 60, 61, 255, 256, 257, 70000):
+        data = os.urandom(n)
+        assert snappy_codec.decompress(snappy_codec.compress_python(data)) == data
+
+
+def test_round_trip() -> None:
+    data = b"ntpmon_peer_offset_seconds{source=192.0.2.1} 0.001\n" * 100 + os.urandom(100) + b"aaaaaaaaaaaaaaaaaaaaaaaa"
+    compressed = snappy_codec.compress_python(data)
+    assert len(compressed) < len(data) / 10
+    assert snappy_codec.decompress(compressed) == data
+    assert snappy_codec.decompress(snappy_codec.compress(data)) == data
+
+
+def test_decompress_copy1() -> None:
+    # "abcd" followed by a 1-byte offset copy of length 8 at offset 4
+    assert snappy_codec.decompress(b"\x0c\x0cabcd" + bytes([(8 - 4) << 2 | snappy_codec.TAG_COPY1, 4])) == b"abcd" * 3
@@ -0,0 +1,89 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+
+from unittest import mock
+
+import ntpmon
+import outputs
+import peer_stats
+import process
+
+from peers import NTPPeers
+from sourcestats import SourceStats, parse_sourcestats
+
+# the output of chronyc -c -m sources sourcestats
+combined = """\
+^,*,192.0.2.1,2,10,377,473,-0.000012,-0.000013,0.000034
+^,+,192.0.2.2,2,10,377,12,0.000021,0.000020,0.000045
+^,?,192.0.2.3,0,10,0,-,0.000000,0.000000,0.000000
+192.0.2.1,11,5,2765,-0.001,0.040,-0.000009,0.000026
+192.0.2.2,8,4,1803,0.123,0.456,0.000015,0.000031
+192.0.2.3,0,0,0,0.000,2000.000,0.000000,4000.000000
+"""
+
+
+def test_parse() -> None:
+    assert parse_sourcestats("192.0.2.1,11,5,2765,-0.001,0.040,-0.000009,0.000026\n") == {
+        "source": "192.0.2.1",
+        "samples": 11,
+        "runs": 5,
+        "span": 2765,
+        "freq": -0.001,
+        "skew": 0.04,
+        "offset": -0.000009,
+        "stdev": 0.000026,
+    }
+    assert parse_sourcestats("") is None
+    assert parse_sourcestats("^,*,192.0.2.1,2,10,377,473,-0.000012,-0.000013,0.000034") is None
+    assert parse_sourcestats("192.0.2.1,x,5,2765,-0.001,0.040,-0.000009,0.000026") is None
+
+
+def test_statistics_names() -> None:
+    """Source statistics use the names of the equivalent statistics.log fields."""
+    line = "2024-01-01 00:00:00 192.0.2.1 2.6e-05 -9.0e-06 1.0e-05 4.0e-02 -1.0e-03 1.0e-02 11 0 5 0.00"
+    statistics = peer_stats.extract_chrony_statistics(line.split())
+    stats = parse_sourcestats("192.0.2.1,11,5,2765,-0.001,0.040,-0.000009,0.000026")
+    for k in stats:
+        if k != "span":
+            assert stats[k] == statistics[k], k
+
+
+def test_combined_output() -> None:
+    """Both parsers ignore the other's lines, so they can share one chronyc invocation."""
+    peers = NTPPeers(combined)
+    assert peers.table.addresses == ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    stats = SourceStats(combined)
+    assert [s["source"] for s in stats.stats] == ["192.0.2.1", "192.0.2.2", "192.0.2.3"]
+    assert stats.getmetrics() == {}
+
+
+def test_single_execution() -> None:
+    with mock.patch("process.execute", return_value=[combined.split("\n"), 0.1]) as execute:
+        objs = process.ntpchecks(["peers", "sourcestats"], debug=False, implementation="chronyd")
+    execute.assert_called_once_with("peers+sourcestats", debug=False, implementation="chronyd")
+    assert len(objs["sourcestats"].stats) == 3
+    assert len(objs["peers"].table) == 3
+
+    with mock.patch("process.execute", return_value=[combined.split("\n"), 0.1]) as execute:
+        objs = process.ntpchecks(["sourcestats"], debug=False, implementation="chronyd")
+    execute.assert_called_once_with("sourcestats", debug=False, implementation="chronyd")
+
+    with mock.patch("process.execute", return_value=[[], 0.1]) as execute:
+        objs = process.ntpchecks(["peers", "sourcestats"], debug=False, implementation="ntpd")
+    execute.assert_called_once_with("peers", debug=False, implementation="ntpd")
+    assert "sourcestats" not in objs
+
+
+def test_send_sources() -> None:
+    output = mock.MagicMock(spec=outputs.Output)
+    args = argparse.Namespace(debug=False, source_limit=32)
+    checkobjs = {"peers": NTPPeers(combined), "sourcestats": SourceStats(combined)}
+    ntpmon.send_sources(args, output, checkobjs, ["sync", "survivor"])
+    assert output.send_peer_source.call_count == 2
+    assert output.send_source_stats.call_count == 2
+    stats = output.send_source_stats.call_args_list[0].args[0]
+    assert (stats["source"], stats["peertype"], stats["samples"]) == ("192.0.2.1", "sync", 11)
+    assert stats["timestamp_ns"] == output.send_peer_source.call_args_list[0].args[0]["timestamp_ns"]
@@ -0,0 +1,114 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import asyncio
+import os
+
+from tempfile import TemporaryDirectory
+
+import transport
+
+from spill import SpillJournal
+from test_transport import Receiver, wait_for
+
+
+def test_append_read_commit() -> None:
+    with TemporaryDirectory() as d:
+        j = SpillJournal(d)
+        assert j.empty()
+        assert j.read(100) == (None, b"")
+        j.append(b"a 1\nb 2\n")
+        j.append(b"c 3\n")
+        assert j.size() == 12
+        assert j.read(6) == (0, b"a 1\n")
+        assert j.read(100) == (0, b"a 1\nb 2\nc 3\n")
+        j.commit(0, 8)
+        assert j.read(100) == (0, b"c 3\n")
+        j.commit(0, 4)
+        assert j.empty()
+        assert j.getmetrics()["spill_replayed_bytes"] == 12
+
+
+def test_long_record() -> None:
+    with TemporaryDirectory() as d:
+        j = SpillJournal(d)
+        j.append(b"0123456789\nab\n")
+        assert j.read(4) == (0, b"0123456789\n")
+
+
+def test_segments_and_cap() -> None:
+    with TemporaryDirectory() as d:
+        j = SpillJournal(d, max_bytes=20, segment_bytes=7)
+        for i in range(5):
+            j.append(b"line %d\n" % i)
+        # each line fills a segment, and only the newest segments fit under the cap
+        assert len(os.listdir(d)) == 2
+        assert j.getmetrics()["spill_dropped_bytes"] == 21
+        assert j.read(100) == (3, b"line 3\n")
+        j.commit(3, 7)
+        assert j.read(100) == (4, b"line 4\n")
+        assert len(os.listdir(d)) == 1
+
+
+def test_reopen() -> None:
+    with TemporaryDirectory() as d:
+        j = SpillJournal(d, segment_bytes=8)
+        j.append(b"first\n")
+        j.append(b"second\n")
+        # a partial record from an interrupted write is skipped
+        j.append(b"third")
+        j.file.close()
+
+        j = SpillJournal(d, segment_bytes=8)
+        j.append(b"fourth\n")
+        data = b""
+        while not j.empty():
+            seq, chunk = j.read(100)
+            data += chunk
+            j.commit(seq, len(chunk))
+        assert data == b"first\nsecond\nfourth\n"
+
+
+def test_trim_during_delivery() -> None:
+    """Data read from a segment which is discarded before it is committed must not
+    cause records in the following segment to be skipped."""
+    with TemporaryDirectory() as d:
+        j = SpillJournal(d, max_bytes=20, segment_bytes=7)
+        j.append(b"line 0\n")
+        j.append(b"line 1\n")
+        seq, data = j.read(100)
+        assert (seq, data) == (0, b"line 0\n")
+        # while line 0 is being delivered, new data pushes its segment out of the journal
+        j.append(b"line 2\n")
+        assert j.segments == [1, 2]
+        j.commit(seq, len(data))
+        assert j.read(100) == (1, b"line 1\n")
+        assert j.getmetrics()["spill_replayed_bytes"] == 0
+
+
+def test_transport_spill_and_replay() -> None:
+    async def run(d: str) -> None:
+        receiver = Receiver()
+        port = await receiver.start()
+        await receiver.stop()
+
+        journal = SpillJournal(d)
+        t = transport.StreamTransport(
+            "127.0.0.1", port, max_lines=2, min_backoff=0.01, max_backoff=0.02, spill=journal, replay_rate=8
+        )
+        for i in range(6):
+            t.send(b"%d\n" % i, 1)
+        assert journal.size() == 8
+        assert t.getmetrics()["transport_dropped_lines"] == 0
+
+        receiver = Receiver()
+        await receiver.start(port)
+        await wait_for(lambda: len(receiver.data) == 12)
+        assert journal.empty()
+        assert sorted(receiver.data.split()) == [b"%d" % i for i in range(6)]
+        t.close()
+        await receiver.stop()
+
+    with TemporaryDirectory() as d:
+        asyncio.run(run(d))
@@ -0,0 +1,52 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import argparse
+import os
+
+from unittest import mock
+
+import outputs
+
+
+def test_textfile(tmp_path) -> None:
+    args = argparse.Namespace(mode="textfile", textfile_dir=str(tmp_path))
+    output = outputs.get_output(args)
+    path = tmp_path / "ntpmon.prom"
+
+    output.flush()
+    assert not path.exists()
+
+    output.send_summary_stats({"offset": 0.5, "stratum": 2})
+    output.send_peer_counts({"sync": 1, "backup": 2})
+    output.flush()
+    content = path.read_text()
+    assert "ntpmon_offset_seconds 0.5\n" in content
+    assert "ntpmon_stratum 2.0\n" in content
+    assert 'ntpmon_peers{peertype="backup"} 2.0\n' in content
+    assert os.listdir(tmp_path) == ["ntpmon.prom"]
+
+    with mock.patch("os.replace", wraps=os.replace) as replace:
+        # unchanged content is not rewritten
+        output.send_summary_stats({"offset": 0.5, "stratum": 2})
+        output.flush()
+        assert replace.call_count == 0
+
+        output.send_summary_stats({"offset": 0.25})
+        output.flush()
+        assert replace.call_count == 1
+    assert "ntpmon_offset_seconds 0.25\n" in path.read_text()
+
+
+def test_textfile_sources(tmp_path) -> None:
+    args = argparse.Namespace(mode="textfile", textfile_dir=str(tmp_path))
+    output = outputs.get_output(args)
+    output.send_peer_source({"source": "192.0.2.1", "peertype": "sync", "offset": 0.25, "reach": 75.0, "reach_register": 0o73})
+    output.send_peer_events({"added": 1, "removed": 0})
+    output.flush()
+    content = (tmp_path / "ntpmon.prom").read_text()
+    assert 'ntpmon_source_offset_seconds{peertype="sync",source="192.0.2.1"} 0.25\n' in content
+    assert 'ntpmon_source_reach_ratio{peertype="sync",source="192.0.2.1"} 0.75\n' in content
+    assert 'ntpmon_source_reach_register{peertype="sync",source="192.0.2.1"} 59.0\n' in content
+    assert 'ntpmon_peer_events{event="added"} 1.0\n' in content
@@ -0,0 +1,261 @@
+#
+# Copyright:    (c) 2024 Paul D. Gear
+# License:      AGPLv3 <http://www.gnu.org/licenses/agpl.html>
+
+import asyncio
+import os
+import socket
+
+from tempfile import TemporaryDirectory
+from typing import List
+
+import pytest
+
+import transport
+
+from spill import SpillJournal
+
+
+class Receiver:
+    """A local stand-in for telegraf's socket listener."""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.server = None
+        self.writers = []
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.writers.append(writer)
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            self.data += data
+        writer.close()
+
+    async def start(self, port: int = 0) -> int:
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        for writer in self.writers:
+            writer.close()
+        await self.server.wait_closed()
+
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    for i in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    assert condition()
+
+
+def test_parse_connect() -> None:
+    assert transport.parse_connect("127.0.0.1:8094") == ("127.0.0.1", 8094)
+    assert transport.parse_connect("[::1]:8094") == ("::1", 8094)
+    assert transport.parse_connect("localhost:1") == ("localhost", 1)
+
+
+def test_send() -> None:
+    async def run() -> None:
+        receiver = Receiver()
+        port = await receiver.start()
+        t = transport.StreamTransport("127.0.0.1", port)
+        t.send(b"a\nb\n", 2)
+        t.send(b"c\n", 1)
+        await wait_for(lambda: receiver.data == b"a\nb\nc\n")
+        await wait_for(lambda: t.queued_lines == 0)
+        metrics = t.getmetrics()
+        assert metrics["transport_sent_lines"] == 3
+        assert metrics["transport_reconnects"] == 0
+        t.close()
+        await receiver.stop()
+
+    asyncio.run(run())
+
+
+def test_drop_oldest_and_backoff() -> None:
+    async def run() -> None:
+        # find a free port, then stop listening on it
+        receiver = Receiver()
+        port = await receiver.start()
+        await receiver.stop()
+
+        t = transport.StreamTransport("127.0.0.1", port, max_lines=3, min_backoff=0.01, max_backoff=0.05)
+        for i in range(5):
+            t.send(b"%d\n" % i, 1)
+        assert [data for (data, lines) in t.queue] == [b"2\n", b"3\n", b"4\n"]
+        await wait_for(lambda: t.connect_failures >= 2)
+        assert t.getmetrics()["transport_dropped_lines"] == 2
+
+        # the queued data is delivered once the receiver comes back
+        receiver = Receiver()
+        await receiver.start(port)
+        await wait_for(lambda: receiver.data == b"2\n3\n4\n")
+        t.close()
+        await receiver.stop()
+
+    asyncio.run(run())
+
+
+def test_reconnect() -> None:
+    async def run() -> None:
+        receiver = Receiver()
+        port = await receiver.start()
+        t = transport.StreamTransport("127.0.0.1", port, min_backoff=0.01)
+        t.send(b"before\n", 1)
+        await wait_for(lambda: receiver.data == b"before\n")
+
+        # restart the receiver, dropping the existing connection
+        await receiver.stop()
+        await wait_for(lambda: t.reader.at_eof())
+        receiver = Receiver()
+        await receiver.start(port)
+        t.send(b"after\n", 1)
+        await wait_for(lambda: receiver.data == b"after\n")
+        assert t.getmetrics()["transport_reconnects"] == 1
+        t.close()
+        await receiver.stop()
+
+    asyncio.run(run())
+
+
+class SlowWriter:
+    """A stream writer whose drain() waits until it is released."""
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.released = asyncio.Event()
+
+    def write(self, data: bytes) -> None:
+        self.data += data
+
+    async def drain(self) -> None:
+        await self.released.wait()
+
+    def close(self) -> None:
+        pass
+
+    def is_closing(self) -> bool:
+        return False
+
+
+class SlowTransport(transport.StreamTransport):
+    async def connect(self) -> None:
+        self.reader = asyncio.StreamReader()
+        self.writer = self.slow
+
+
+def test_inflight_not_spilled(tmp_path) -> None:
+    async def run() -> None:
+        journal = SpillJournal(str(tmp_path))
+        t = SlowTransport(None, None, max_lines=1, spill=journal)
+        t.slow = SlowWriter()
+        t.send(b"0\n", 1)
+        await wait_for(lambda: t.inflight is not None)
+        # the first batch leaves the queue while it is being drained, so only the second is spilled
+        t.send(b"1\n", 1)
+        t.send(b"2\n", 1)
+        assert journal.read(100)[1] == b"1\n"
+        t.slow.released.set()
+        await wait_for(lambda: t.slow.data == b"0\n2\n1\n")
+        assert t.getmetrics()["transport_dropped_lines"] == 0
+        t.task.cancel()
+
+    asyncio.run(run())
+
+
+def test_unexpected_error(capsys) -> None:
+    async def run() -> None:
+        receiver = Receiver()
+        port = await receiver.start()
+        t = transport.StreamTransport("127.0.0.1", port, min_backoff=0.01)
+        attempts = []
+        connect = t.connect
+
+        async def fail_once() -> None:
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("oops")
+            await connect()
+
+        t.connect = fail_once
+        t.send(b"a\n", 1)
+        await wait_for(lambda: receiver.data == b"a\n")
+        assert not t.task.done()
+        t.close()
+        await receiver.stop()
+
+    asyncio.run(run())
+    assert "Unexpected error" in capsys.readouterr().err
+
+
+def test_parse_url() -> None:
+    assert transport.parse_url("127.0.0.1:8094") == ("tcp", "127.0.0.1:8094")
+    assert transport.parse_url("tcp://127.0.0.1:8094") == ("tcp", "127.0.0.1:8094")
+    assert transport.parse_url("UDP://[::1]:8094") == ("udp", "[::1]:8094")
+    assert transport.parse_url("unix:///run/telegraf.sock") == ("unix", "/run/telegraf.sock")
+    assert transport.parse_url("unixgram:///run/telegraf.sock") == ("unixgram", "/run/telegraf.sock")
+    with pytest.raises(ValueError):
+        transport.parse_url("http://localhost:8086")
+
+
+def test_unix_stream() -> None:
+    async def run(path: str) -> None:
+        receiver = Receiver()
+        receiver.server = await asyncio.start_unix_server(receiver.handle, path)
+        t = transport.UnixStreamTransport(path)
+        t.send(b"a\nb\n", 2)
+        await wait_for(lambda: receiver.data == b"a\nb\n")
+        t.close()
+        await receiver.stop()
+
+    with TemporaryDirectory() as d:
+        asyncio.run(run(os.path.join(d, "telegraf.sock")))
+
+
+def receive_all(sock: socket.socket) -> List[bytes]:
+    packets = []
+    while True:
+        try:
+            packets.append(sock.recv(65536))
+        except BlockingIOError:
+            return packets
+
+
+def test_udp_packing() -> None:
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.setblocking(False)
+    t = transport.DatagramTransport(socket.AF_INET, receiver.getsockname(), 20)
+
+    lines = [b"line %d" % i for i in range(10)] + [b"x" * 30, b"last"]
+    data = b"\n".join(lines) + b"\n"
+    t.send(data, len(lines))
+    packets = receive_all(receiver)
+    assert all(len(p) <= 20 and p.endswith(b"\n") for p in packets)
+    assert b"".join(packets) == data.replace(b"x" * 30 + b"\n", b"")
+    assert len(packets) == 6
+    metrics = t.getmetrics()
+    assert metrics["transport_dropped_lines"] == 1
+    assert metrics["transport_sent_lines"] == 11
+    assert metrics["transport_sent_packets"] == 6
+    receiver.close()
+
+
+def test_unixgram() -> None:
+    with TemporaryDirectory() as d:
+        path = os.path.join(d, "telegraf.sock")
+        t = transport.DatagramTransport(socket.AF_UNIX, path, 65536)
+        # nothing is listening yet
+        t.send(b"lost\n", 1)
+        assert t.getmetrics()["transport_dropped_lines"] == 1
+
+        receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        receiver.bind(path)
+        receiver.setblocking(False)
+        t.send(b"a\nb\n", 2)
+        assert receive_all(receiver) == [b"a\nb\n"]
+        receiver.close()